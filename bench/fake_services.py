@@ -0,0 +1,165 @@
+"""Local stand-ins for the qBittorrent Web API (v2) and the Radarr API (v3).
+
+One HTTP/1.1 keep-alive server answers both, backed by a library manifest from
+bench.library. It implements only what Deletarr calls, adds a configurable
+per-request latency, and counts requests per endpoint and TCP connections so the
+report can show how much network work a run did.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+QBIT_VERSION = 'v5.0.0'
+QBIT_WEBAPI_VERSION = '2.11.2'
+ARR_VERSION = '5.9.0'
+
+
+class FakeState:
+    """Torrent state shared by all request threads."""
+
+    def __init__(self, manifest, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.torrents = {t['hash']: {k: v for k, v in t.items() if k != 'hash'} for t in manifest['torrents']}
+        self.files = manifest['files']
+        self.movies = manifest['movies']
+        # sync/maindata: rid -> set of hashes at that point; deletions are the only change.
+        self.rid = 1
+        self.hashes_at = {1: set(self.torrents)}
+        self.calls = Counter()
+        self.connections = set()
+
+    def counters(self):
+        with self.lock:
+            return {'http_calls': dict(self.calls), 'http_connections': len(self.connections)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, Nagle + delayed ACK
+    # add ~40 ms to every keep-alive response and swamp what's being measured.
+    disable_nagle_algorithm = True
+    state = None  # set per server
+
+    def log_message(self, *args):
+        pass
+
+    def _params(self):
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode()
+            params.update({k: v[-1] for k, v in parse_qs(body).items()})
+        return url.path, params
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        data = body if isinstance(body, bytes) else (
+            json.dumps(body) if content_type == 'application/json' else str(body)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        path, params = self._params()
+        state = self.state
+        with state.lock:
+            state.calls[path] += 1
+            state.connections.add(self.client_address)
+        if state.latency:
+            time.sleep(state.latency)
+        handler = ROUTES.get(path)
+        if handler is None:
+            self._send(404, {'error': f'not implemented: {path}'})
+            return
+        handler(self, state, params)
+
+
+def _login(handler, state, params):
+    handler._send(200, 'Ok.', 'text/plain', {'Set-Cookie': 'SID=bench; path=/'})
+
+
+def _text(value):
+    return lambda handler, state, params: handler._send(200, value, 'text/plain')
+
+
+def _maindata(handler, state, params):
+    rid = int(params.get('rid', 0) or 0)
+    with state.lock:
+        current = set(state.torrents)
+        if rid == state.rid:
+            body = {'rid': rid}
+        elif rid in state.hashes_at:
+            body = {'rid': state.rid, 'torrents_removed': sorted(state.hashes_at[rid] - current)}
+        else:
+            body = {'rid': state.rid, 'full_update': True, 'torrents': state.torrents}
+        handler._send(200, body)
+
+
+def _torrents_info(handler, state, params):
+    wanted = params.get('hashes')
+    with state.lock:
+        hashes = wanted.split('|') if wanted else list(state.torrents)
+        body = [dict(state.torrents[h], hash=h) for h in hashes if h in state.torrents]
+    handler._send(200, body)
+
+
+def _torrents_files(handler, state, params):
+    names = state.files.get(params.get('hash'))
+    if names is None:
+        handler._send(404, 'Torrent hash was not found', 'text/plain')
+        return
+    handler._send(200, [{'index': i, 'name': n, 'size': 0, 'progress': 1} for i, n in enumerate(names)])
+
+
+def _torrents_delete(handler, state, params):
+    with state.lock:
+        for h in (params.get('hashes') or '').split('|'):
+            state.torrents.pop(h, None)
+        state.rid += 1
+        state.hashes_at[state.rid] = set(state.torrents)
+    handler._send(200, '', 'text/plain')
+
+
+def _arr_status(handler, state, params):
+    handler._send(200, {'version': ARR_VERSION})
+
+
+def _arr_movies(handler, state, params):
+    handler._send(200, state.movies)
+
+
+ROUTES = {
+    '/api/v2/auth/login': _login,
+    '/api/v2/app/version': _text(QBIT_VERSION),
+    '/api/v2/app/webapiVersion': _text(QBIT_WEBAPI_VERSION),
+    '/api/v2/sync/maindata': _maindata,
+    '/api/v2/torrents/info': _torrents_info,
+    '/api/v2/torrents/files': _torrents_files,
+    '/api/v2/torrents/delete': _torrents_delete,
+    '/api/v3/system/status': _arr_status,
+    '/api/v3/movie': _arr_movies,
+}
+
+
+def start(manifest, latency=0.0, port=0):
+    """Start the fake server on 127.0.0.1. Returns (server, state, base_url)."""
+    state = FakeState(manifest, latency)
+    handler = type('Handler', (_Handler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='bench-fake-services', daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}"
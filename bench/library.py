@@ -0,0 +1,122 @@
+"""Synthetic seedbox + media library on local disk.
+
+Lays out the same shape Deletarr sees in production:
+
+    <workdir>/downloads/<torrent>/<files>      what qBittorrent is seeding
+    <workdir>/library/<bucket>/.../<title>/    the Radarr root_folder
+
+A `hardlink_ratio` share of torrents have their files hardlinked into the library
+(KEEP), the rest only exist in downloads (CANDIDATE). `cross_seeds` extra torrents
+point at an existing torrent's data under a different hash, as cross-seeding does.
+`extra_library_files` adds files with no torrent, which only cost walk time.
+
+Files are empty: Deletarr only looks at inodes and link counts, never content.
+Generation is deterministic for a given set of parameters, and a workdir whose
+manifest matches is reused instead of rebuilt.
+"""
+import hashlib
+import json
+import os
+import random
+import shutil
+import time
+
+CATEGORY = 'radarr'
+MANIFEST = 'manifest.json'
+
+
+def default_params(**overrides):
+    params = {
+        'torrents': 2000,
+        'files_per_torrent': 3,
+        'depth': 2,
+        'hardlink_ratio': 0.8,
+        'cross_seeds': 200,
+        'extra_library_files': 2000,
+        # Share of torrents younger than min_seed_days (SKIPped before any file check).
+        'young_ratio': 0.1,
+        'seed': 1,
+    }
+    params.update(overrides)
+    return params
+
+
+def _hash(seed, i):
+    return hashlib.sha1(f"{seed}:{i}".encode()).hexdigest()
+
+
+def _bucket_path(root, i, depth):
+    # depth levels of 2-hex-digit buckets, e.g. library/3f/a0/Title (2009)
+    digest = hashlib.md5(str(i).encode()).hexdigest()
+    parts = [digest[2 * level:2 * level + 2] for level in range(depth)]
+    return os.path.join(root, *parts)
+
+
+def generate(workdir, params):
+    """Build (or reuse) the library under workdir. Returns the manifest dict.
+
+    Manifest: params, `torrents` (qBittorrent torrent records, as sync/maindata
+    reports them), `files` ({hash: [file names relative to save_path]}) and `movies`
+    (Radarr /api/v3/movie records for the hardlinked titles).
+    """
+    manifest_path = os.path.join(workdir, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('params') == params:
+            return manifest
+        shutil.rmtree(workdir)
+
+    rng = random.Random(params['seed'])
+    downloads = os.path.join(workdir, 'downloads')
+    library = os.path.join(workdir, 'library')
+    os.makedirs(downloads)
+    os.makedirs(library)
+
+    now = int(time.time())
+    day = 24 * 60 * 60
+    torrents, files, movies = [], {}, []
+    for i in range(params['torrents']):
+        torrent_hash = _hash(params['seed'], i)
+        name = f"Movie.{i:06d}.2009.1080p.BluRay.x264"
+        torrent_dir = os.path.join(downloads, name)
+        os.makedirs(torrent_dir)
+        names = []
+        for j in range(params['files_per_torrent']):
+            file_name = f"{name}.part{j}.mkv" if j else f"{name}.mkv"
+            open(os.path.join(torrent_dir, file_name), 'w').close()
+            names.append(os.path.join(name, file_name))
+
+        if rng.random() < params['hardlink_ratio']:
+            title_dir = os.path.join(_bucket_path(library, i, params['depth']), f"Movie {i:06d} (2009)")
+            os.makedirs(title_dir)
+            # Only the main file is imported, as Radarr does.
+            library_file = os.path.join(title_dir, f"Movie {i:06d} (2009).mkv")
+            os.link(os.path.join(downloads, names[0]), library_file)
+            movies.append({'id': i + 1, 'title': f"Movie {i:06d}", 'hasFile': True,
+                           'movieFile': {'path': library_file}})
+
+        young = rng.random() < params['young_ratio']
+        completion_on = now - (rng.randint(1, 20) if young else rng.randint(40, 400)) * day
+        torrents.append({
+            'hash': torrent_hash, 'name': name, 'category': CATEGORY, 'save_path': downloads,
+            'completion_on': completion_on, 'state': 'stalledUP', 'progress': 1,
+        })
+        files[torrent_hash] = names
+
+    for k in range(params['cross_seeds']):
+        original = torrents[rng.randrange(len(torrents))]
+        torrent_hash = _hash(f"{params['seed']}-xseed", k)
+        torrents.append(dict(original, hash=torrent_hash))
+        files[torrent_hash] = list(files[original['hash']])
+
+    for k in range(params['extra_library_files']):
+        extra_dir = os.path.join(_bucket_path(library, -1 - k, params['depth']), f"Untracked {k:06d}")
+        os.makedirs(extra_dir, exist_ok=True)
+        open(os.path.join(extra_dir, f"Untracked {k:06d}.mkv"), 'w').close()
+
+    manifest = {'params': params, 'downloads': downloads, 'library': library,
+                'torrents': torrents, 'files': files, 'movies': movies}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    return manifest
@@ -0,0 +1,319 @@
+"""End-to-end benchmark: synthetic library + fake services + run_deletarr.
+
+    python -m bench.run                       # medium scale, dry run, cold + warm run
+    python -m bench.run --scale large --latency 0.005
+    python -m bench.run --output before.json  # on one commit ...
+    python -m bench.run --compare before.json # ... then on another
+
+Each run is split into the phases run_deletarr reports through RunProgress. For every
+phase the report has wall time, filesystem calls (stat/lstat/scandir/listdir),
+read/write syscalls from /proc/self/io, HTTP requests per endpoint and peak Python
+heap (tracemalloc); each run also reports its peak RSS. The first run starts with an
+empty cache dir and fresh clients (a CLI run). Later runs reuse both, like runs inside
+the API process.
+
+tracemalloc slows Python code down noticeably; pass --no-memory when only timings
+matter. Reports record the commit and parameters, so two reports are comparable
+when their parameters match.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import yaml
+
+from deletarr.clients import ClientRegistry
+from deletarr.main import run_deletarr
+from deletarr.progress import RunProgress
+from . import fake_services
+from .library import default_params, generate
+
+SCALES = {
+    'small': dict(torrents=500, cross_seeds=50, extra_library_files=500),
+    'medium': dict(torrents=2000, cross_seeds=200, extra_library_files=2000),
+    'large': dict(torrents=20000, cross_seeds=2000, extra_library_files=50000, depth=3),
+}
+
+FS_CALLS = ('stat', 'lstat', 'scandir', 'listdir')
+
+
+class FsCallCounter:
+    """Counts filesystem calls made through the os module while installed."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._originals = {}
+
+    def install(self):
+        for name in FS_CALLS:
+            original = getattr(os, name)
+            self._originals[name] = original
+
+            def counted(*args, _name=name, _original=original, **kwargs):
+                with self._lock:
+                    self.counts[_name] += 1
+                return _original(*args, **kwargs)
+
+            setattr(os, name, counted)
+
+    def uninstall(self):
+        for name, original in self._originals.items():
+            setattr(os, name, original)
+        self._originals = {}
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def _proc_io():
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return {'syscr': int(fields['syscr']), 'syscw': int(fields['syscw'])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def _delta(after, before):
+    if isinstance(after, dict):
+        keys = set(after) | set(before)
+        return {k: _delta(after.get(k, 0), before.get(k, 0)) for k in sorted(keys)
+                if _delta(after.get(k, 0), before.get(k, 0))}
+    return after - before
+
+
+class PhaseRecorder(RunProgress):
+    """RunProgress that also measures each phase between set_phase calls."""
+
+    def __init__(self, fs_counter, fake_state, memory):
+        super().__init__()
+        self.fs_counter = fs_counter
+        self.fake_state = fake_state
+        self.memory = memory
+        self.phases = []
+        self._current = None
+
+    def _sample(self):
+        return {
+            'time': time.perf_counter(),
+            'fs_calls': self.fs_counter.snapshot(),
+            'io': _proc_io(),
+            'http': self.fake_state.counters(),
+        }
+
+    def _close(self):
+        if self._current is None:
+            return
+        name, start = self._current
+        end = self._sample()
+        http = _delta(end['http'], start['http'])
+        phase = {
+            'phase': name,
+            'wall_s': round(end['time'] - start['time'], 4),
+            'fs_calls': _delta(end['fs_calls'], start['fs_calls']),
+            'syscalls': _delta(end['io'], start['io']),
+            'http_calls': http.get('http_calls', {}),
+            'http_connections': http.get('http_connections', 0),
+        }
+        if self.memory:
+            phase['peak_heap_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+            tracemalloc.reset_peak()
+        self.phases.append(phase)
+        self._current = None
+
+    def set_phase(self, phase, service=None):
+        self._close()
+        self._current = (f"{phase}:{service}" if service else phase, self._sample())
+        super().set_phase(phase, service)
+
+    def finish(self):
+        self._close()
+        return self.phases
+
+
+def _git_commit():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                    capture_output=True, text=True).stdout.strip())
+        return sha + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _write_config(config_dir, base_url, manifest, args):
+    config = {
+        'qBittorrent': {'url': base_url, 'username': 'bench', 'password': 'bench',
+                        'file_list_workers': args.file_list_workers},
+        'Radarr': {
+            'enabled': True, 'url': base_url, 'api_key': 'bench',
+            'root_folder': manifest['library'], 'category': 'radarr',
+            'min_seed_days': 30, 'max_delete_percent': 100,
+            'scan_workers': args.scan_workers, 'hardlink_detection': args.mode,
+        },
+        'dry_run': True,
+        'logging': {'level': 'WARNING'},
+    }
+    path = os.path.join(config_dir, 'config.yml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+def run_bench(args):
+    params = default_params(**SCALES[args.scale])
+    for key in ('torrents', 'files_per_torrent', 'depth', 'hardlink_ratio', 'cross_seeds',
+                'extra_library_files', 'seed'):
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+
+    params_id = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:10]
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), 'deletarr-bench', params_id)
+    started = time.perf_counter()
+    manifest = generate(workdir, params)
+    print(f"Library: {workdir} ({len(manifest['torrents'])} torrents, "
+          f"generated/reused in {time.perf_counter() - started:.1f}s)", file=sys.stderr)
+
+    server, fake_state, base_url = fake_services.start(manifest, latency=args.latency)
+    config_dir = tempfile.mkdtemp(prefix='deletarr-bench-config-')
+    config_path = _write_config(config_dir, base_url, manifest, args)
+
+    # Quiet: setup_logging only adds its own handlers if the root logger has none.
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+
+    fs_counter = FsCallCounter()
+    fs_counter.install()
+    if args.memory:
+        tracemalloc.start()
+    clients = ClientRegistry()
+    runs = []
+    try:
+        for i in range(args.runs):
+            label = 'cold' if i == 0 else f'warm{i}' if args.runs > 2 else 'warm'
+            recorder = PhaseRecorder(fs_counter, fake_state, args.memory)
+            run_started = time.perf_counter()
+            result = run_deletarr(config_path, dry_run=not args.delete, clients=clients, progress=recorder)
+            wall = time.perf_counter() - run_started
+            phases = recorder.finish()
+            if not result.get('success'):
+                raise SystemExit(f"Run {label} failed: {result.get('error')}")
+            runs.append({
+                'label': label,
+                'wall_s': round(wall, 4),
+                'candidates': sum(len(t) for t in result['summary'].values()),
+                'deleted': result.get('deleted_count', 0),
+                'library_scan': result.get('library_scan'),
+                'peak_rss_mb': round(result['metrics']['peak_rss_bytes'] / 2**20, 1),
+                'phases': phases,
+            })
+    finally:
+        fs_counter.uninstall()
+        if args.memory:
+            tracemalloc.stop()
+        server.shutdown()
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': params,
+            'options': {k: getattr(args, k) for k in ('mode', 'latency', 'runs', 'delete', 'memory',
+                                                       'scan_workers', 'file_list_workers')},
+        },
+        'runs': runs,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _total(mapping):
+    return sum(mapping.values()) if mapping else 0
+
+
+def print_report(report, baseline=None):
+    base_runs = {r['label']: r for r in (baseline or {}).get('runs', [])}
+    if baseline and baseline['meta']['params'] != report['meta']['params']:
+        print("WARNING: baseline was run with different library parameters", file=sys.stderr)
+
+    def cmp(value, base):
+        if base is None:
+            return ''
+        if not base:
+            return f" ({value - base:+g})"
+        return f" ({(value - base) / base * 100:+.0f}%)"
+
+    print(f"commit {report['meta']['commit']}  params {report['meta']['params']}")
+    if baseline:
+        print(f"compared with {baseline['meta']['commit']}")
+    for run in report['runs']:
+        base_run = base_runs.get(run['label'])
+        base_phases = {p['phase']: p for p in (base_run or {}).get('phases', [])}
+        base_rss = base_run and base_run.get('peak_rss_mb')
+        rss = f"  peak RSS {run['peak_rss_mb']} MB{cmp(run['peak_rss_mb'], base_rss)}" if 'peak_rss_mb' in run else ''
+        print(f"\n[{run['label']}] {run['wall_s']:.3f}s{cmp(run['wall_s'], base_run and base_run['wall_s'])}"
+              f"  candidates={run['candidates']} deleted={run['deleted']}{rss}")
+        print(f"  {'phase':<28}{'wall s':>14}{'fs calls':>16}{'syscalls':>12}{'http':>14}{'conns':>7}{'heap MB':>9}")
+        for p in run['phases']:
+            b = base_phases.get(p['phase'])
+            print(f"  {p['phase']:<28}"
+                  f"{p['wall_s']:>8.3f}{cmp(p['wall_s'], b and b['wall_s']):>6}"
+                  f"{_total(p['fs_calls']):>10}{cmp(_total(p['fs_calls']), b and _total(b['fs_calls'])):>6}"
+                  f"{_total(p['syscalls']):>12}"
+                  f"{_total(p['http_calls']):>8}{cmp(_total(p['http_calls']), b and _total(b['http_calls'])):>6}"
+                  f"{p['http_connections']:>7}"
+                  f"{p.get('peak_heap_mb', ''):>9}")
+    print(f"\npeak RSS {report['peak_rss_mb']} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='medium')
+    parser.add_argument('--torrents', type=int)
+    parser.add_argument('--files-per-torrent', type=int)
+    parser.add_argument('--depth', type=int)
+    parser.add_argument('--hardlink-ratio', type=float)
+    parser.add_argument('--cross-seeds', type=int)
+    parser.add_argument('--extra-library-files', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workdir', help="where to build the library (reused if parameters match)")
+    parser.add_argument('--mode', choices=('walk', 'arr'), default='walk', help="hardlink_detection")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every fake HTTP response")
+    parser.add_argument('--runs', type=int, default=2, help="first run cold, the rest warm")
+    parser.add_argument('--delete', action='store_true', help="real run (deletes from the fake qBittorrent only)")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="skip tracemalloc")
+    parser.add_argument('--scan-workers', type=int, default=4)
+    parser.add_argument('--file-list-workers', type=int, default=8)
+    parser.add_argument('--output', help="write the JSON report here")
+    parser.add_argument('--compare', help="JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_bench(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,47 +1,130 @@
-from fastapi import FastAPI, HTTPException, Body
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
+import asyncio
+import json
 import logging
 import os
-import threading
 import yaml
-from .main import run_deletarr
-from .config import load_config, get_version
-from .clients import QbitClient, radarr_test_connection, sonarr_test_connection
+from .main import run_deletarr, apply_plan
+from .config import ConfigStore, get_version, ConfigError
+from .clients import ClientRegistry
+from .health import HealthChecker
+from .watcher import LibraryWatcher
+from .jobs import JobManager, JobStore, RunInProgress
+from .scheduler import Scheduler
+from .plans import PlanStore
+from .logbuffer import SharedLogBuffer, RingBufferHandler, DecisionFilter
+from .locks import FileLock
+from .metrics import metrics
+
+def get_config_path():
+    config_path = os.environ.get('DELETARR_CONFIG')
+    if not config_path:
+        default_config = './config/config.yml'
+        docker_config = '/config/config.yml'
+        config_path = docker_config if os.path.exists(docker_config) else default_config
+    return config_path
+
+# Parsed + validated config, re-read only when config.yml changes on disk or is saved
+# through POST /api/config. Runs, health checks and the scheduler all read from it.
+config_store = ConfigStore(get_config_path())
 
 # A single run (dry or real) at a time. FastAPI runs sync handlers on a threadpool,
 # so two concurrent /api/run calls would otherwise both walk hardlinks and both delete.
-_run_lock = threading.Lock()
+# A file lock in the config directory, so this also holds across uvicorn workers.
+CONFIG_DIR = os.path.dirname(os.path.abspath(config_store.path))
+_run_lock = FileLock(os.path.join(CONFIG_DIR, 'deletarr.lock'))
 
-# In-memory log buffer
-log_buffer = []
+# Log capture for the console, shared by all workers through files in the cache dir.
+# Two lanes: per-torrent decision lines get their own buffer so a large library can't
+# push everything else out of the main one.
+log_buffer = SharedLogBuffer(capacity=500, path=os.path.join(config_store.cache_dir, 'logs', 'main.jsonl'))
+decision_log_buffer = SharedLogBuffer(capacity=2000, path=os.path.join(config_store.cache_dir, 'logs', 'decisions.jsonl'))
+LOG_LANES = {'main': log_buffer, 'decisions': decision_log_buffer}
 
-class ListHandler(logging.Handler):
-    """
-    Custom logging handler that appends logs to a list, keeping only the last N items.
-    """
-    def __init__(self, capacity=100):
-        super().__init__()
-        self.capacity = capacity
-        
-    def emit(self, record):
-        try:
-            msg = self.format(record)
-            log_buffer.append(msg)
-            if len(log_buffer) > self.capacity:
-                log_buffer.pop(0)
-        except Exception:
-            self.handleError(record)
-
-# Initialize capture handler
-capture_handler = ListHandler(capacity=200)
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-capture_handler.setFormatter(formatter)
-# Attach to root logger
-logging.getLogger().addHandler(capture_handler)
+capture_handler = RingBufferHandler(log_buffer)
+capture_handler.addFilter(DecisionFilter(exclude=True))
+decision_capture_handler = RingBufferHandler(decision_log_buffer)
+decision_capture_handler.addFilter(DecisionFilter())
+for _handler in (capture_handler, decision_capture_handler):
+    _handler.setFormatter(formatter)
+    # Attach to root logger
+    logging.getLogger().addHandler(_handler)
 # Attach to uvicorn logger as well to capture access logs
 logging.getLogger("uvicorn").addHandler(capture_handler)
 
-app = FastAPI(title="Deletarr API", version=get_version())
+# inotify-backed live library indexes (opt-in via `library_watch: true`). Runs use them
+# instead of walking root_folder; a stale watcher makes runs walk as before. Only the
+# leader worker (see scheduler) watches, so N workers don't hold N copies of every
+# watch; runs served by the other workers walk.
+library_watcher = LibraryWatcher()
+
+def apply_library_watch(config):
+    """Start/stop library watchers to match the config."""
+    roots = []
+    if config.library_watch and scheduler.leading:
+        roots = [s.root_folder for s in config.services if s.enabled]
+    library_watcher.watch(roots)
+
+def on_leader():
+    """This worker just became the leader: start its library watchers."""
+    try:
+        apply_library_watch(config_store.get())
+    except ConfigError as e:
+        logging.warning(f"Library watch not started: {e}")
+
+# Clients are kept across runs and health checks so sessions stay logged in and the
+# torrent snapshot only syncs deltas. Each is rebuilt when its config section changes.
+clients = ClientRegistry()
+
+# Cached, concurrent probes behind /api/health/services.
+health_checker = HealthChecker()
+
+def run_with_shared_clients(dry_run, progress=None, plan_id=None):
+    if plan_id is not None:
+        return apply_plan(plan_id, live_indexes=library_watcher, clients=clients, progress=progress,
+                          config_store=config_store)
+    return run_deletarr(dry_run=dry_run, live_indexes=library_watcher, clients=clients, progress=progress,
+                        config_store=config_store)
+
+def plan_store():
+    return PlanStore(os.path.join(config_store.cache_dir, 'plans'))
+
+# Background runs. Shares _run_lock with the blocking endpoints below; job state is
+# published to the cache dir so any worker can answer for any job.
+job_manager = JobManager(_run_lock, run_with_shared_clients, JobStore(os.path.join(config_store.cache_dir, 'jobs')))
+
+# In-process scheduled runs (opt-in via the `schedule` section), submitted as jobs.
+# Only the worker holding the leader lock fires them and runs the library watchers.
+scheduler = Scheduler(job_manager, config_store,
+                      leader_lock=FileLock(os.path.join(CONFIG_DIR, 'leader.lock')),
+                      state_path=os.path.join(config_store.cache_dir, 'schedule.json'),
+                      on_lead=on_leader)
+
+def apply_config(config):
+    # Scheduler first: configuring it is what takes the leader lock on startup.
+    scheduler.configure(config)
+    apply_library_watch(config)
+
+# Every newly loaded config (startup, file edit, POST /api/config) is applied here.
+config_store.on_change(apply_config)
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        config_store.get()
+    except ConfigError as e:
+        logging.warning(f"Library watch and scheduler not started: {e}")
+    yield
+    scheduler.stop()
+    library_watcher.stop()
+    for buffer in LOG_LANES.values():
+        buffer.flush()
+
+app = FastAPI(title="Deletarr API", version=get_version(), lifespan=lifespan)
 
 # CORS only applies when the SPA is hosted on a different origin than the API.
 # In production the SPA is served same-origin by FastAPI, so this never fires.
@@ -58,14 +141,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def get_config_path():
-    config_path = os.environ.get('DELETARR_CONFIG')
-    if not config_path:
-        default_config = './config/config.yml'
-        docker_config = '/config/config.yml'
-        config_path = docker_config if os.path.exists(docker_config) else default_config
-    return config_path
-
 @app.get("/api/health")
 def health():
     return {
@@ -74,38 +149,49 @@ def health():
         "env": os.environ.get('DELETARR_ENV')
     }
 
+@app.get("/metrics")
+def prometheus_metrics():
+    """Run phase timings, decision counts and backend HTTP latencies for Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/health/services")
 def health_services():
-    config_path = get_config_path()
-    config = load_config(config_path)
-    results = {}
-    
-    # qBittorrent
+    """
+    Connectivity per service. Results are cached for health_check_ttl seconds and then
+    refreshed in the background; each carries latency_ms and checked_at.
+    """
     try:
-        qbit = QbitClient(config['qBittorrent'])
-        results['qBittorrent'] = qbit.test_connection()
-    except Exception as e:
-        results['qBittorrent'] = {"status": "error", "message": str(e)}
-        
-    # Radarr
-    radarr_conf = config.get('Radarr')
-    if radarr_conf and radarr_conf.get('enabled', True):
-        results['Radarr'] = radarr_test_connection(radarr_conf)
-    else:
-        results['Radarr'] = {"status": "disabled"}
-        
-    # Sonarr
-    sonarr_conf = config.get('Sonarr')
-    if sonarr_conf and sonarr_conf.get('enabled', True):
-        results['Sonarr'] = sonarr_test_connection(sonarr_conf)
-    else:
-        results['Sonarr'] = {"status": "disabled"}
-        
-    return results
+        config = config_store.get()
+    except ConfigError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # One probe per qBittorrent instance and per *arr instance, keyed by instance name.
+    probes = {
+        qbit_cfg.name: (
+            (qbit_cfg.url, qbit_cfg.username, qbit_cfg.password),
+            lambda cfg=qbit_cfg: clients.qbit(cfg, cache_dir=config_store.cache_dir).test_connection(),
+        )
+        for qbit_cfg in config.download_clients
+    }
+    results = {}
+    for service_config in config.services:
+        if service_config.enabled and not (service_config.url and service_config.api_key):
+            results[service_config.name] = {"status": "error", "message": "url and api_key are not set"}
+        elif service_config.enabled:
+            probes[service_config.name] = (
+                (service_config.url, service_config.api_key),
+                lambda cfg=service_config: clients.arr(cfg.name, cfg).test_connection(),
+            )
+        else:
+            results[service_config.name] = {"status": "disabled"}
+
+    results.update(health_checker.check(probes, ttl=config.health_check_ttl))
+    names = [c.name for c in config.download_clients] + [s.name for s in config.services]
+    return {name: results[name] for name in names}
 
 @app.get("/api/config")
 def get_config():
-    path = get_config_path()
+    path = config_store.path
     try:
         with open(path, 'r') as f:
             return yaml.safe_load(f)
@@ -114,31 +200,157 @@ def get_config():
 
 @app.post("/api/config")
 def save_config(new_config: dict = Body(...)):
-    path = get_config_path()
+    # Validated before anything is written: a bad POST can't replace a working config.
+    # The store writes atomically (temp file + os.replace) and swaps in the new snapshot.
     try:
-        # Basic validation: ensure it's a dict and not empty
-        if not isinstance(new_config, dict) or not new_config:
-            raise HTTPException(status_code=400, detail="Invalid configuration data")
-            
-        # Safe Write: Write to temp file first
-        temp_path = f"{path}.tmp"
-        with open(temp_path, 'w') as f:
-            yaml.safe_dump(new_config, f, default_flow_style=False, sort_keys=False)
-        
-        # Atomically move temp file to original path
-        os.replace(temp_path, path)
-        
-        logging.info("Configuration updated successfully via API.")
-        return {"status": "success", "message": "Configuration saved"}
+        config_store.save(new_config)
+    except ConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Failed to save configuration: {e}")
-        if os.path.exists(f"{path}.tmp"):
-            os.remove(f"{path}.tmp")
         raise HTTPException(status_code=500, detail=str(e))
+    logging.info("Configuration updated successfully via API.")
+    return {"status": "success", "message": "Configuration saved"}
+
+@app.get("/api/library/watch")
+def library_watch_status():
+    return library_watcher.status()
+
+@app.get("/api/schedule")
+def schedule_status():
+    return scheduler.status()
+
+def _log_query(lane, level):
+    buffer = LOG_LANES.get(lane)
+    if buffer is None:
+        raise HTTPException(status_code=400, detail=f"Unknown log lane '{lane}' (expected one of: {', '.join(LOG_LANES)})")
+    min_level = logging.NOTSET
+    if level:
+        min_level = logging.getLevelName(level.upper())
+        if not isinstance(min_level, int):
+            raise HTTPException(status_code=400, detail=f"Unknown log level '{level}'")
+    return buffer, min_level
 
 @app.get("/api/logs")
-def get_logs():
-    return {"logs": log_buffer}
+def get_logs(since: int = 0, level: str = None, lane: str = 'main', limit: int = None):
+    """
+    Log records with seq > `since` and at least `level`, oldest first.
+    Pass the returned `last_seq` as the next `since` to only get new records.
+    lane=decisions returns the per-torrent SKIP/KEEP/CANDIDATE lines instead.
+    """
+    buffer, min_level = _log_query(lane, level)
+    records, last_seq = buffer.since(since, min_level, limit)
+    return {"logs": records, "last_seq": last_seq}
+
+@app.get("/api/logs/stream")
+async def stream_logs(request: Request, since: int = None, level: str = None, lane: str = 'main'):
+    """
+    Server-sent events: one `logs` event (a JSON list of records) per batch of new
+    records, with the batch's last seq as the event id so a reconnecting EventSource
+    resumes where it left off. Without `since`, starts with what's currently buffered.
+    """
+    buffer, min_level = _log_query(lane, level)
+    last_event_id = request.headers.get('last-event-id', '')
+    cursor = int(last_event_id) if last_event_id.isdigit() else (since or 0)
+
+    async def events():
+        nonlocal cursor
+        idle = 0.0
+        while not await request.is_disconnected():
+            # Reading the shared log store touches files; keep it off the event loop.
+            last_seq = await asyncio.to_thread(lambda: buffer.last_seq)
+            if last_seq > cursor:
+                records, cursor = await asyncio.to_thread(buffer.since, cursor, min_level)
+                if records:
+                    idle = 0.0
+                    yield f"id: {cursor}\nevent: logs\ndata: {json.dumps(records)}\n\n"
+                    continue
+            idle += 0.5
+            if idle >= 15:
+                # Keep proxies from closing an idle stream.
+                idle = 0.0
+                yield ": keepalive\n\n"
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/api/jobs", status_code=202)
+def submit_job(body: dict = Body(default={})):
+    """
+    Start a run in the background and return its job id immediately.
+    Body: {"dry_run": true|false} (defaults to a dry run), or {"plan_id": "..."} to
+    delete exactly the candidates of an earlier dry run after re-checking them.
+    """
+    body = body if isinstance(body, dict) else {}
+    plan_id = body.get('plan_id')
+    if plan_id is not None:
+        if plan_store().get(plan_id) is None:
+            raise HTTPException(status_code=404, detail="Plan not found or expired; run a new dry run")
+        dry_run = False
+    else:
+        dry_run = body.get('dry_run', True)
+        if not isinstance(dry_run, bool):
+            raise HTTPException(status_code=400, detail="dry_run must be a boolean")
+    try:
+        job = job_manager.submit(dry_run, plan_id)
+    except RunInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job.to_dict()
+
+@app.get("/api/plans/{plan_id}")
+def get_plan(plan_id: str):
+    """A saved dry-run plan: its candidates per service (file fingerprints left out)."""
+    plan = plan_store().get(plan_id)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Plan not found or expired")
+    return {
+        "id": plan['id'],
+        "created_at": plan['created_at'],
+        "services": {name: [{"hash": c['hash'], "name": c['name']} for c in candidates]
+                     for name, candidates in plan['services'].items()},
+    }
+
+@app.get("/api/jobs")
+def list_jobs():
+    return {"jobs": job_manager.list()}
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job(job_id: str):
+    """
+    Server-sent events: a `progress` event whenever the job's progress changes, a
+    `decisions` event with each batch of per-torrent decisions made since the last one,
+    then one `done` event carrying the full job (including its result).
+    """
+    # Other workers' jobs are read from the job store: file reads, so off the event loop.
+    if await asyncio.to_thread(job_manager.get, job_id, False) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last_state = None
+        cursor = 0
+        while True:
+            # Read before the decisions, so a job seen done has all of them flushed.
+            state = await asyncio.to_thread(job_manager.get, job_id, False)
+            decisions, cursor = await asyncio.to_thread(job_manager.decisions_since, job_id, cursor)
+            if decisions:
+                yield f"event: decisions\ndata: {json.dumps(decisions)}\n\n"
+            if state is None or state['status'] != 'running':
+                final = await asyncio.to_thread(job_manager.get, job_id)
+                yield f"event: done\ndata: {json.dumps(final)}\n\n"
+                return
+            if state != last_state:
+                last_state = state
+                yield f"event: progress\ndata: {json.dumps(state)}\n\n"
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/api/dry-run")
 def dry_run():
@@ -148,7 +360,7 @@ def dry_run():
     if not _run_lock.acquire(blocking=False):
         raise HTTPException(status_code=409, detail="Another run is already in progress")
     try:
-        results = run_deletarr(dry_run=True)
+        results = run_with_shared_clients(dry_run=True)
         return results
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -163,7 +375,7 @@ def trigger_run():
     if not _run_lock.acquire(blocking=False):
         raise HTTPException(status_code=409, detail="Another run is already in progress")
     try:
-        results = run_deletarr(dry_run=False)
+        results = run_with_shared_clients(dry_run=False)
         return results
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -171,8 +383,8 @@ def trigger_run():
         _run_lock.release()
 
 # Serves static files for the frontend
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
+from .static import StaticSite, etag_matches
 
 # frontend_path = os.path.join(os.path.dirname(__file__), "../frontend/dist")
 # In docker, we might put it elsewhere, e.g. /app/frontend/dist
@@ -180,26 +392,27 @@ from fastapi.responses import FileResponse
 FRONTEND_DIST = os.environ.get("FRONTEND_DIST", os.path.join(os.getcwd(), "frontend/dist"))
 
 if os.path.exists(FRONTEND_DIST):
-    app.mount("/assets", StaticFiles(directory=os.path.join(FRONTEND_DIST, "assets")), name="assets")
-    FRONTEND_DIST_REAL = os.path.realpath(FRONTEND_DIST)
-    INDEX_HTML = os.path.join(FRONTEND_DIST_REAL, "index.html")
+    # Indexed once: requests are served from memory, precompressed, with cache headers.
+    static_site = StaticSite(FRONTEND_DIST)
 
     @app.get("/{full_path:path}")
-    async def serve_react_app(full_path: str):
+    async def serve_react_app(full_path: str, request: Request):
         # Unknown /api/* routes must 404 rather than silently returning the SPA HTML.
         if full_path.startswith("api/"):
             raise HTTPException(status_code=404, detail="Not Found")
 
-        # Resolve the requested path and verify it stays inside the dist root
-        # before serving. Blocks traversal via ../ or symlink jumps.
-        requested = os.path.realpath(os.path.join(FRONTEND_DIST_REAL, full_path))
-        if (
-            os.path.commonpath([requested, FRONTEND_DIST_REAL]) == FRONTEND_DIST_REAL
-            and os.path.isfile(requested)
-        ):
-            return FileResponse(requested)
-
-        # SPA fallback: always the fixed index.html, never an attacker-controlled path.
-        return FileResponse(INDEX_HTML)
+        # Only files indexed inside the dist root can be named here, so ../ or symlink
+        # jumps fall through to the fixed index.html, never an attacker-controlled path.
+        static_file = static_site.lookup(full_path)
+        if static_file is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+
+        encoding, body, etag = static_site.select(static_file, request.headers.get("accept-encoding"))
+        headers = {"ETag": etag, "Cache-Control": static_file.cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=static_file.content_type, headers=headers)
 else:
     logging.warning(f"Frontend dist not found at {FRONTEND_DIST}. Web UI will not be available.")
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Bump when the on-disk layout changes; older files are ignored (the pass starts over).
+CHECKPOINT_VERSION = 1
+# A pass not finished within this long starts over, so trusted KEEPs can't go stale.
+CHECKPOINT_MAX_AGE = 7 * 24 * 60 * 60
+# While a run goes, the checkpoint is rewritten at most this often (survives a kill).
+CHECKPOINT_SAVE_INTERVAL = 30
+
+
+class BudgetExhausted(Exception):
+    """Raised by evaluate_service, after its last decision, when the budget cut the pass short."""
+
+
+class RunBudget:
+    """How much evaluation one run may do before it stops and checkpoints.
+
+    max_seconds counts from the start of the run (library scans included); max_files
+    counts torrent files checked. Shared by every service of the run; thread-safe.
+    """
+
+    def __init__(self, max_seconds=None, max_files=None):
+        self.deadline = time.monotonic() + max_seconds if max_seconds is not None else None
+        self.max_files = max_files
+        self.files = 0
+        self._lock = threading.Lock()
+
+    def add_files(self, n):
+        with self._lock:
+            self.files += n
+
+    def exhausted(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        with self._lock:
+            return self.max_files is not None and self.files >= self.max_files
+
+
+class RunCheckpoint:
+    """Verdicts of an unfinished pass, so the next run resumes instead of starting over.
+
+    A pass is one evaluation of every enabled service's torrents. When a run's budget
+    runs out, the KEEP and CANDIDATE verdicts made so far are saved here, and later
+    runs only evaluate the torrents without one. A checkpointed KEEP is trusted as-is
+    (keeping is always safe). A checkpointed CANDIDATE is re-checked against its saved
+    file fingerprints before the pass completes, since deletion only ever happens at
+    the end of a complete pass.
+
+    `inputs` is plans.plan_inputs(config): a changed services config starts a new pass.
+    """
+
+    def __init__(self, path=None, inputs=None, max_age=CHECKPOINT_MAX_AGE):
+        self.path = path
+        self.inputs = inputs
+        self.started_at = time.time()
+        self._services = {}
+        self._dirty = False
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        if path:
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                if (
+                    data.get('version') == CHECKPOINT_VERSION
+                    and data.get('inputs') == inputs
+                    and time.time() - data.get('started_at', 0) < max_age
+                ):
+                    self.started_at = data['started_at']
+                    self._services = data.get('services', {})
+                else:
+                    logging.info("Discarding the run checkpoint (config changed or too old); starting a new pass")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable run checkpoint {path}: {e}")
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(verdicts) for verdicts in self._services.values())
+
+    def verdicts(self, service_name):
+        """{hash: [decision, reason, files]} checkpointed for one service (a copy)."""
+        with self._lock:
+            return dict(self._services.get(service_name, {}))
+
+    def record(self, service_name, torrent_hash, decision, reason, files=None):
+        with self._lock:
+            self._services.setdefault(service_name, {})[torrent_hash] = [decision, reason, files]
+            self._dirty = True
+
+    def save(self, min_interval=0):
+        """Write the checkpoint if anything changed (and min_interval passed since the last write)."""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty or time.monotonic() - self._saved_at < min_interval:
+                    return
+                data = {
+                    'version': CHECKPOINT_VERSION,
+                    'inputs': self.inputs,
+                    'started_at': self.started_at,
+                    'services': {name: dict(verdicts) for name, verdicts in self._services.items()},
+                }
+                self._dirty = False
+                self._saved_at = time.monotonic()
+            temp_path = f"{self.path}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(temp_path, 'w') as f:
+                    json.dump(data, f, separators=(',', ':'))
+                os.replace(temp_path, self.path)
+            except Exception as e:
+                # The next run then re-evaluates what this one did; nothing is lost but time.
+                logging.warning(f"Could not save run checkpoint {self.path}: {e}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def clear(self):
+        """The pass is complete: forget it, on disk too."""
+        with self._lock:
+            self._services = {}
+            self._dirty = False
+        if not self.path:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove run checkpoint {self.path}: {e}")
@@ -1,79 +1,541 @@
 import qbittorrentapi
 import requests
+from requests.adapters import HTTPAdapter
 import logging
+import json
+import os
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .progress import NO_PROGRESS
+from .metrics import http_response_hook
+
+# Bulk deletion defaults; overridable in the qBittorrent config section.
+DEFAULT_DELETE_CHUNK_SIZE = 50
+DEFAULT_DELETE_INTERVAL = 0.5
+DEFAULT_DELETE_RETRIES = 3
+DELETE_RETRY_BACKOFF = 1.0
+# qBittorrent removes torrents asynchronously; poll this many times before calling one undeleted.
+DELETE_VERIFY_POLLS = 3
+DELETE_VERIFY_DELAY = 1.0
+# Concurrent torrents_files requests; overridable as qBittorrent.file_list_workers.
+DEFAULT_FILE_LIST_WORKERS = 8
+# Name of a qBittorrent instance configured as a single mapping (no `name`).
+DEFAULT_QBIT_NAME = 'qBittorrent'
+# Seconds a test_connection() may take before the service is reported down.
+CONNECTION_TEST_TIMEOUT = 5
+
+
+# Joins a torrent's file names into one string; names can't contain NUL.
+_FILE_SEP = '\0'
+
+
+class FileListCache:
+    """Per-torrent file lists keyed by info-hash, persisted across runs.
+
+    A completed torrent's file list doesn't change, so an entry stays valid until its
+    hash disappears from qBittorrent (see prune). Thread-safe: fetch workers add to it.
+    Each list is held (and saved) as one NUL-joined string rather than a list of
+    strings, about a third of the memory on a large client; get() splits it again.
+
+    Nothing stays in memory between runs. The file is read when a run first asks for a
+    list, each entry is dropped as soon as get() hands it out, and what's left goes
+    when the last reader (see open/close) is done. save() merges the lists fetched
+    since the last save into what's on disk. Without a path nothing outlives a save.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        # Entries read from disk and not handed out yet; None until a run asks.
+        self._files = None
+        # Fetched since the last save.
+        self._new = {}
+        # Hashes qBittorrent has, from the last prune(); None keeps every entry.
+        self._known = None
+        self._readers = 0
+        self._lock = threading.Lock()
+        # Services sharing a client fetch (and save) concurrently; one writer at a time.
+        self._save_lock = threading.Lock()
+
+    def _read(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                files = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable file list cache {self.path}: {e}")
+            return {}
+        # Caches written before lists were joined hold plain lists.
+        for torrent_hash, names in files.items():
+            if isinstance(names, list):
+                files[torrent_hash] = _FILE_SEP.join(names)
+        return files
+
+    def open(self):
+        """A reader (one iter_torrent_files call) starts."""
+        with self._lock:
+            self._readers += 1
+
+    def close(self):
+        """A reader is done; once none is left, drop the entries nobody asked for."""
+        with self._lock:
+            self._readers -= 1
+            if self._readers <= 0:
+                self._readers = 0
+                self._files = None
+
+    def get(self, torrent_hash):
+        with self._lock:
+            if self._files is None:
+                self._files = self._read()
+            names = self._files.pop(torrent_hash, None)
+            if names is None:
+                names = self._new.get(torrent_hash)
+        if names is None:
+            return None
+        return names.split(_FILE_SEP) if names else []
+
+    def put(self, torrent_hash, names):
+        with self._lock:
+            self._new[torrent_hash] = _FILE_SEP.join(names)
+
+    def prune(self, known_hashes):
+        """Drop entries for torrents qBittorrent no longer has (on disk at the next save)."""
+        with self._lock:
+            self._known = set(known_hashes)
+
+    def save(self):
+        if not self.path:
+            with self._lock:
+                self._new = {}
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._new:
+                    return
+                new = dict(self._new)
+                known = self._known
+            data = self._read()
+            data.update(new)
+            if known is not None:
+                data = {h: names for h, names in data.items() if h in known}
+            temp_path = f"{self.path}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(temp_path, 'w') as f:
+                    json.dump(data, f, separators=(',', ':'))
+                os.replace(temp_path, self.path)
+            except Exception as e:
+                # Only an accelerator; a failed write means the next run fetches again.
+                logging.warning(f"Could not save file list cache {self.path}: {e}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return
+            with self._lock:
+                for torrent_hash in new:
+                    if self._new.get(torrent_hash) is new[torrent_hash]:
+                        del self._new[torrent_hash]
+
+
+# Torrent states qBittorrent's own 'completed' filter matches: the download is finished
+# and the torrent is seeding, queued/paused/stopped as a seed, or rechecking as one.
+# State-based so we never rely on float-equality against progress.
+COMPLETED_STATES = {'uploading', 'stalledUP', 'pausedUP', 'stoppedUP', 'queuedUP', 'forcedUP', 'checkingUP'}
+
+
+class Torrent:
+    """One torrent, holding only the fields the pipeline reads.
+
+    maindata sends about 50 fields per torrent; a client with tens of thousands of
+    torrents would keep all of them for the life of the process. Categories and save
+    paths repeat across torrents and are interned, so each distinct value is stored once.
+    """
+
+    __slots__ = ('hash', 'name', 'category', 'save_path', 'completion_on', 'state')
+
+    def __init__(self, torrent_hash):
+        self.hash = torrent_hash
+        self.name = None
+        self.category = ''
+        self.save_path = None
+        self.completion_on = None
+        self.state = None
+
+    def update(self, fields):
+        """Apply a full or partial maindata entry, ignoring fields we don't keep."""
+        if 'name' in fields:
+            self.name = fields['name']
+        if 'category' in fields:
+            self.category = sys.intern(fields['category'] or '')
+        if 'save_path' in fields:
+            self.save_path = sys.intern(fields['save_path']) if fields['save_path'] else fields['save_path']
+        if 'completion_on' in fields:
+            self.completion_on = fields['completion_on']
+        if 'state' in fields:
+            self.state = fields['state']
+
+
+class TorrentSnapshot:
+    """Every torrent in qBittorrent, kept current with the sync/maindata `rid` protocol.
+
+    The first refresh downloads the full torrent list; later refreshes send the last
+    `rid` back and qBittorrent only returns changed fields and removed hashes. Kept on a
+    long-lived QbitClient, repeat runs in the API process only transfer deltas.
+    Torrents are kept as compact Torrent records.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.rid = 0
+        self.torrents = {}
+        self._by_category = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            data = self.client.sync_maindata(rid=self.rid)
+            if data.get('full_update'):
+                self.torrents = {}
+            for torrent_hash, fields in (data.get('torrents') or {}).items():
+                torrent = self.torrents.get(torrent_hash)
+                if torrent is None:
+                    torrent = self.torrents[torrent_hash] = Torrent(torrent_hash)
+                torrent.update(fields)
+            for torrent_hash in data.get('torrents_removed') or []:
+                self.torrents.pop(torrent_hash, None)
+            self.rid = data.get('rid', 0)
+            self._by_category = None
+            return len(self.torrents)
+
+    def completed_by_category(self):
+        """{category: [Torrent, ...]} of completed torrents, built once per refresh.
+
+        The lists share the snapshot's Torrent records; callers must not modify them.
+        """
+        with self._lock:
+            if self._by_category is None:
+                by_category = {}
+                for t in self.torrents.values():
+                    if t.state in COMPLETED_STATES:
+                        by_category.setdefault(t.category, []).append(t)
+                self._by_category = by_category
+            return self._by_category
+
+    def hashes(self):
+        with self._lock:
+            return set(self.torrents)
+
+    def get(self, torrent_hash):
+        """The Torrent record for a hash, or None if qBittorrent no longer has it."""
+        with self._lock:
+            return self.torrents.get(torrent_hash)
 
 
 class QbitClient:
-    def __init__(self, cfg):
+    def __init__(self, cfg, cache_dir=None):
         self.cfg = cfg
+        # One keep-alive pool sized for the concurrent file-list fetches. qbittorrent-api
+        # logs in on first use and again by itself whenever the session cookie expires (403).
         self.client = qbittorrentapi.Client(
-            host=cfg['url'],
-            username=cfg['username'],
-            password=cfg['password']
+            host=cfg.url,
+            username=cfg.username,
+            password=cfg.password,
+            HTTPADAPTER_ARGS={'pool_connections': 1, 'pool_maxsize': cfg.file_list_workers},
+            REQUESTS_ARGS={'hooks': {'response': [http_response_hook(cfg.name.lower())]}},
         )
+        # Hashes are only unique within one qBittorrent, so each instance has its own file.
+        cache_name = 'file_lists.json' if cfg.name == DEFAULT_QBIT_NAME else f"file_lists.{cfg.name}.json"
+        self.file_cache = FileListCache(os.path.join(cache_dir, cache_name) if cache_dir else None)
+        self.snapshot = TorrentSnapshot(self.client)
+        self._refreshed = False
+
+    def close(self):
+        """Save file lists not on disk yet and close the keep-alive pool."""
+        self.file_cache.save()
+        # qbittorrent-api's session reset; a run still holding this client gets a new
+        # session on its next request.
+        self.client._trigger_session_initialization()
 
     def test_connection(self):
         try:
-            version = self.client.app.version
+            version = self.client.app_version(requests_args={'timeout': CONNECTION_TEST_TIMEOUT})
             return {"status": "ok", "version": version}
         except Exception as e:
             return {"status": "error", "message": str(e)}
 
+    def refresh(self):
+        """Bring the torrent snapshot up to date. Call once per run; every service reads it."""
+        count = self.snapshot.refresh()
+        self._refreshed = True
+        self.file_cache.prune(self.snapshot.hashes())
+        logging.info(f"{self.cfg.name} snapshot: {count} torrents (rid {self.snapshot.rid})")
+
     def get_torrents(self, categories):
-        # Filter completion on the server (status_filter='completed') so we don't rely on
-        # float-equality against t.progress. Category is filtered in Python because
-        # torrents_info() accepts a single category, not a list.
-        torrents = self.client.torrents_info(status_filter='completed')
-        filtered = [
-            {
-                'hash': t.hash,
-                'name': t.name,
-                'category': t.category,
-                'save_path': t.save_path,
-                'completion_on': getattr(t, 'completion_on', None),
-                'progress': getattr(t, 'progress', 0)
-            }
-            for t in torrents
-            if t.category in categories
-        ]
+        # Served from the shared snapshot; refreshed here only if the caller didn't.
+        if not self._refreshed:
+            self.refresh()
+        by_category = self.snapshot.completed_by_category()
+        filtered = [t for category in categories for t in by_category.get(category, [])]
         logging.info(f"Fetched {len(filtered)} torrents for categories {categories} (completed)")
         return filtered
 
-    def delete_torrents(self, hashes, delete_data=True):
-        """Delete torrents one at a time. Returns the list of hashes that were actually deleted
-        (a transient failure on one hash must not be reported as success for all)."""
-        deleted = []
+    def get_torrent_files(self, hashes, progress=NO_PROGRESS):
+        """File names (relative to save_path) for each hash, as {hash: [names] or Exception}."""
+        return dict(self.iter_torrent_files(hashes, progress))
+
+    def iter_torrent_files(self, hashes, progress=NO_PROGRESS):
+        """Yield (hash, [names] or Exception) for each hash as its file list becomes available.
+
+        Cached lists come first, as-is; the rest are fetched concurrently over the
+        client's shared session with file_list_workers requests in flight and yielded
+        as they complete. A failed fetch maps to its exception so the caller can skip
+        just that torrent. Closing the generator early cancels the fetches not yet started.
+        """
+        self.file_cache.open()
+        try:
+            yield from self._iter_torrent_files(hashes, progress)
+        finally:
+            self.file_cache.close()
+
+    def _iter_torrent_files(self, hashes, progress):
+        missing = []
         for h in hashes:
+            cached = self.file_cache.get(h)
+            if cached is not None:
+                progress.add('file_lists_fetched')
+                yield h, cached
+            else:
+                missing.append(h)
+
+        def fetch(h):
+            try:
+                names = [f['name'] for f in self.client.torrents_files(h)]
+            except Exception as e:
+                return h, e
+            finally:
+                progress.add('file_lists_fetched')
+            self.file_cache.put(h, names)
+            return h, names
+
+        pool = None
+        try:
+            if missing:
+                pool = ThreadPoolExecutor(max_workers=self.cfg.file_list_workers, thread_name_prefix="qbit-files")
+                for future in as_completed([pool.submit(fetch, h) for h in missing]):
+                    yield future.result()
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            self.file_cache.save()
+        logging.info(f"File lists: {len(hashes) - len(missing)} cached, {len(missing)} fetched")
+
+    def delete_torrents(self, hashes, delete_data=True, progress=NO_PROGRESS):
+        """Delete torrents in chunks, then re-fetch to confirm which are actually gone.
+
+        Each chunk is one torrents_delete call. Transient failures (connection errors,
+        5xx) are retried with exponential backoff; chunks are spaced by delete_interval.
+        Returns the list of hashes that were actually deleted (a transient failure on one
+        chunk must not be reported as success for all).
+        """
+        hashes = list(hashes)
+        if not hashes:
+            return []
+        chunk_size = self.cfg.delete_chunk_size
+        interval = self.cfg.delete_interval
+        retries = self.cfg.delete_retries
+
+        requested = []
+        for i in range(0, len(hashes), chunk_size):
+            if i:
+                time.sleep(interval)  # avoid hammering API
+            chunk = hashes[i:i + chunk_size]
             try:
-                self.client.torrents_delete(delete_files=delete_data, torrent_hashes=h)
-                deleted.append(h)
-                logging.info(f"Deleted torrent {h} (delete_data={delete_data})")
+                self._with_retries(
+                    lambda: self.client.torrents_delete(delete_files=delete_data, torrent_hashes=chunk),
+                    retries,
+                )
+                requested.extend(chunk)
+                logging.info(f"Requested deletion of {len(chunk)} torrent(s) (delete_data={delete_data})")
             except Exception as e:
-                logging.error(f"Failed to delete torrent {h}: {e}")
-            time.sleep(0.2)  # avoid hammering API
+                logging.error(f"Failed to delete {len(chunk)} torrent(s) {chunk[0]}..: {e}")
+
+        try:
+            remaining = self._still_present(hashes, chunk_size, retries)
+        except Exception as e:
+            # Can't verify: fall back to what qBittorrent accepted, which is what we reported before.
+            logging.warning(f"Could not verify deletions, reporting accepted requests: {e}")
+            progress.add('deletions_done', len(requested))
+            return requested
+
+        sent = set(requested)
+        deleted = [h for h in hashes if h not in remaining]
+        for h in deleted:
+            logging.info(f"Deleted torrent {h} (delete_data={delete_data})")
+        for h in hashes:
+            if h not in remaining:
+                continue
+            if h in sent:
+                logging.error(f"Torrent {h} is still present after deletion")
+            else:
+                logging.error(f"Torrent {h} not deleted (request failed)")
+        progress.add('deletions_done', len(deleted))
         return deleted
 
+    def _still_present(self, hashes, chunk_size, retries):
+        """Hashes from `hashes` that qBittorrent still lists, polling briefly while removals settle."""
+        remaining = set(hashes)
+        for attempt in range(DELETE_VERIFY_POLLS):
+            if attempt:
+                time.sleep(DELETE_VERIFY_DELAY)
+            candidates = list(remaining)
+            present = set()
+            for i in range(0, len(candidates), chunk_size):
+                chunk = candidates[i:i + chunk_size]
+                info = self._with_retries(lambda: self.client.torrents_info(torrent_hashes=chunk), retries)
+                present.update(t.hash for t in info)
+            remaining = present
+            if not remaining:
+                break
+        return remaining
 
-def radarr_test_connection(cfg):
-    url = f"{cfg['url'].rstrip('/')}/api/v3/system/status"
-    headers = {"X-Api-Key": cfg['api_key']}
-    try:
-        resp = requests.get(url, headers=headers, timeout=5)
-        resp.raise_for_status()
-        data = resp.json()
-        return {"status": "ok", "version": data.get('version')}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+    @staticmethod
+    def _with_retries(call, retries):
+        delay = DELETE_RETRY_BACKOFF
+        for attempt in range(retries + 1):
+            try:
+                return call()
+            except Exception as e:
+                if attempt == retries or not _is_transient(e):
+                    raise
+                logging.warning(f"qBittorrent request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay *= 2
+
+
+def _is_transient(e):
+    """Connection problems and 5xx are worth retrying; 4xx and bad credentials are not."""
+    if isinstance(e, (qbittorrentapi.HTTP4XXError, qbittorrentapi.LoginFailed)):
+        return False
+    return isinstance(e, qbittorrentapi.APIConnectionError)
+
+
+# Timeout for library listings; a large library's /movie or /series response is big.
+ARR_LIBRARY_TIMEOUT = 60
+ARR_LIBRARY_WORKERS = 8
 
 
-def sonarr_test_connection(cfg):
-    url = f"{cfg['url'].rstrip('/')}/api/v3/system/status"
-    headers = {"X-Api-Key": cfg['api_key']}
-    try:
-        resp = requests.get(url, headers=headers, timeout=5)
+class ArrClient:
+    """Radarr/Sonarr v3 API client on one keep-alive session.
+
+    The pool is sized for ARR_LIBRARY_WORKERS concurrent requests, so parallel
+    episode-file listings reuse connections instead of each paying a new handshake.
+    """
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.base_url = f"{cfg.url.rstrip('/')}/api/v3"
+        self.session = requests.Session()
+        self.session.headers["X-Api-Key"] = cfg.api_key
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=ARR_LIBRARY_WORKERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.hooks['response'].append(http_response_hook(cfg.name.lower()))
+
+    def get(self, path, params=None, timeout=ARR_LIBRARY_TIMEOUT):
+        resp = self.session.get(f"{self.base_url}/{path}", params=params, timeout=timeout)
         resp.raise_for_status()
-        data = resp.json()
-        return {"status": "ok", "version": data.get('version')}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        return resp.json()
+
+    def test_connection(self):
+        try:
+            data = self.get('system/status', timeout=CONNECTION_TEST_TIMEOUT)
+            return {"status": "ok", "version": data.get('version')}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    def close(self):
+        self.session.close()
+
+
+def radarr_get_file_paths(arr):
+    """Every imported movie file path, as Radarr sees it.
+
+    Returns (paths, expected) where expected is the number of movies Radarr says have a
+    file, so the caller can tell a complete listing from a partial one. The movie list
+    embeds each movieFile, which avoids one /moviefile request per movie.
+    """
+    movies = arr.get('movie')
+    expected = sum(1 for m in movies if m.get('hasFile'))
+    paths = [m['movieFile']['path'] for m in movies if (m.get('movieFile') or {}).get('path')]
+    return paths, expected
+
+
+def sonarr_get_file_paths(arr):
+    """Every imported episode file path, as Sonarr sees it.
+
+    Returns (paths, expected) where expected is the sum of each series'
+    episodeFileCount. Episode files are listed per series, concurrently.
+    """
+    series = arr.get('series')
+    expected = sum((s.get('statistics') or {}).get('episodeFileCount', 0) for s in series)
+
+    def files_for(series_id):
+        return arr.get('episodefile', params={'seriesId': series_id})
+
+    paths = []
+    with ThreadPoolExecutor(max_workers=ARR_LIBRARY_WORKERS, thread_name_prefix="sonarr-files") as pool:
+        for files in pool.map(files_for, [s['id'] for s in series]):
+            paths.extend(f['path'] for f in files if f.get('path'))
+    return paths, expected
+
+
+ARR_FILE_PATH_FETCHERS = {
+    'Radarr': radarr_get_file_paths,
+    'Sonarr': sonarr_get_file_paths,
+}
+
+
+class ClientRegistry:
+    """Long-lived clients keyed by config section.
+
+    The API process keeps one registry so runs and health checks share warm, logged-in
+    sessions and the qBittorrent snapshot. A client is rebuilt only when its config
+    section (or the cache dir) actually changes; unchanged sections keep their client.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._qbits = {}
+        self._arrs = {}
+
+    def qbit(self, cfg, cache_dir=None):
+        # Connection and pool settings need a new client; the delete tuning options are
+        # read per call, so a change there just updates the live client's config.
+        key = (cfg.url, cfg.username, cfg.password, cfg.file_list_workers, cache_dir)
+        with self._lock:
+            client, client_key = self._qbits.get(cfg.name, (None, None))
+            if client is None or client_key != key:
+                if client is not None:
+                    logging.info(f"{cfg.name} connection settings changed; reconnecting")
+                    client.close()
+                client = QbitClient(cfg, cache_dir=cache_dir)
+                self._qbits[cfg.name] = (client, key)
+            else:
+                client.cfg = cfg
+            return client
+
+    def arr(self, name, cfg):
+        # Only the connection settings matter; editing e.g. min_seed_days keeps the session.
+        key = (cfg.url, cfg.api_key)
+        with self._lock:
+            client, client_key = self._arrs.get(name, (None, None))
+            if client is None or client_key != key:
+                if client is not None:
+                    client.close()
+                client = ArrClient(cfg)
+                self._arrs[name] = (client, key)
+            return client
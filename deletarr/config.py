@@ -2,10 +2,27 @@ import yaml
 import logging
 import sys
 import os
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+from .clients import (
+    DEFAULT_DELETE_CHUNK_SIZE, DEFAULT_DELETE_INTERVAL, DEFAULT_DELETE_RETRIES, DEFAULT_FILE_LIST_WORKERS,
+    DEFAULT_QBIT_NAME,
+)
+from .library import DEFAULT_SCAN_WORKERS
+from .scheduler import parse_schedule, ScheduleError
+from .health import DEFAULT_HEALTH_CHECK_TTL
+
+# *arr kinds, each its own top-level section. A section (like qBittorrent) is either one
+# mapping or a list of mappings with unique `name`s, one per instance.
+SERVICE_KINDS = ('Radarr', 'Sonarr')
+# Services evaluated at the same time; overridable as parallel_services.
+DEFAULT_PARALLEL_SERVICES = 2
+HARDLINK_DETECTION_MODES = ('walk', 'arr')
 
 
 class ConfigError(Exception):
-    """Raised when config can't be loaded or parsed.
+    """Raised when config can't be loaded, parsed or validated.
     Caller decides how to surface this (CLI prints + exits, API returns 500)."""
 
 
@@ -16,9 +33,324 @@ def load_config(config_path: str) -> dict:
     except Exception as e:
         raise ConfigError(f"Error loading config at {config_path}: {e}") from e
 
-def setup_logging(log_config: dict):
-    level_str = log_config.get('level', 'INFO').upper()
-    level = getattr(logging, level_str, logging.INFO)
+
+# Validated, typed config. Frozen so a run can hold one snapshot for its whole duration
+# while the API swaps in a newer one.
+
+@dataclass(frozen=True)
+class QbitConfig:
+    url: str
+    username: str = ''
+    password: str = ''
+    delete_chunk_size: int = DEFAULT_DELETE_CHUNK_SIZE
+    delete_interval: float = DEFAULT_DELETE_INTERVAL
+    delete_retries: int = DEFAULT_DELETE_RETRIES
+    file_list_workers: int = DEFAULT_FILE_LIST_WORKERS
+    name: str = DEFAULT_QBIT_NAME
+
+
+@dataclass(frozen=True)
+class ServiceConfig:
+    name: str
+    kind: str = ''
+    download_client: str = DEFAULT_QBIT_NAME
+    enabled: bool = True
+    url: str = ''
+    api_key: str = ''
+    root_folder: str = ''
+    category: str = ''
+    min_seed_days: float = 30
+    max_delete_percent: Optional[float] = None
+    scan_workers: int = DEFAULT_SCAN_WORKERS
+    hardlink_detection: str = 'walk'
+    arr_path_mappings: dict = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class LoggingConfig:
+    level: str = 'INFO'
+    file: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class ScheduleConfig:
+    enabled: bool = False
+    cron: Optional[str] = None
+    interval_minutes: Optional[float] = None
+    jitter_seconds: float = 0
+    dry_run: Optional[bool] = None
+
+
+@dataclass(frozen=True)
+class BudgetConfig:
+    # Unset means unlimited. Either one ends the run's evaluation early (see checkpoint.py).
+    max_seconds: Optional[float] = None
+    max_files: Optional[int] = None
+
+    @property
+    def limited(self):
+        return self.max_seconds is not None or self.max_files is not None
+
+
+@dataclass(frozen=True)
+class AppConfig:
+    download_clients: tuple
+    services: tuple = ()
+    parallel_services: int = DEFAULT_PARALLEL_SERVICES
+    dry_run: bool = True
+    library_watch: bool = False
+    health_check_ttl: float = DEFAULT_HEALTH_CHECK_TTL
+    logging: LoggingConfig = LoggingConfig()
+    schedule: ScheduleConfig = ScheduleConfig()
+    budget: BudgetConfig = BudgetConfig()
+
+    def service(self, name):
+        return next((s for s in self.services if s.name == name), None)
+
+    def download_client(self, name):
+        return next((c for c in self.download_clients if c.name == name), None)
+
+
+_MISSING = object()
+
+
+def _get(section, key, where, kind, default=_MISSING, minimum=None, maximum=None):
+    value = section.get(key)
+    if value is None:
+        if default is _MISSING:
+            raise ConfigError(f"{where}.{key} is required")
+        return default
+    if kind is bool:
+        ok = isinstance(value, bool)
+    elif kind is str:
+        ok = isinstance(value, str)
+        if ok and not value.strip() and default is _MISSING:
+            raise ConfigError(f"{where}.{key} is required")
+    elif kind is int:
+        ok = isinstance(value, int) and not isinstance(value, bool)
+    else:  # float: accept ints too
+        ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+    if not ok:
+        raise ConfigError(f"{where}.{key} must be {'a number' if kind is float else f'a {kind.__name__}'}, got {value!r}")
+    if minimum is not None and value < minimum:
+        raise ConfigError(f"{where}.{key} must be >= {minimum}, got {value!r}")
+    if maximum is not None and value > maximum:
+        raise ConfigError(f"{where}.{key} must be <= {maximum}, got {value!r}")
+    return value
+
+
+def _section(raw, key, required=False):
+    section = raw.get(key)
+    if section is None:
+        if required:
+            raise ConfigError(f"Missing '{key}' section")
+        return None
+    if not isinstance(section, dict):
+        raise ConfigError(f"'{key}' must be a mapping")
+    return section
+
+
+def _instances(raw, key, required=False):
+    """[(name, where, section)] for a section given as one mapping or a list of mappings.
+
+    A single mapping is named after its key unless it sets `name`; in a list every entry
+    needs a `name`. `where` prefixes validation messages (the key, or the instance name).
+    """
+    value = raw.get(key)
+    if value is None:
+        if required:
+            raise ConfigError(f"Missing '{key}' section")
+        return []
+    if isinstance(value, dict):
+        return [(_get(value, 'name', key, str, key), key, value)]
+    if not isinstance(value, list) or not value:
+        raise ConfigError(f"'{key}' must be a mapping or a non-empty list of mappings")
+    instances = []
+    for i, section in enumerate(value):
+        if not isinstance(section, dict):
+            raise ConfigError(f"{key}[{i}] must be a mapping")
+        name = _get(section, 'name', f"{key}[{i}]", str)
+        instances.append((name, name, section))
+    return instances
+
+
+def _parse_qbit(name, where, qbit):
+    return QbitConfig(
+        name=name,
+        url=_get(qbit, 'url', where, str),
+        username=_get(qbit, 'username', where, str, ''),
+        password=_get(qbit, 'password', where, str, ''),
+        delete_chunk_size=_get(qbit, 'delete_chunk_size', where, int, DEFAULT_DELETE_CHUNK_SIZE, minimum=1),
+        delete_interval=_get(qbit, 'delete_interval', where, float, DEFAULT_DELETE_INTERVAL, minimum=0),
+        delete_retries=_get(qbit, 'delete_retries', where, int, DEFAULT_DELETE_RETRIES, minimum=0),
+        file_list_workers=_get(qbit, 'file_list_workers', where, int, DEFAULT_FILE_LIST_WORKERS, minimum=1),
+    )
+
+
+def _parse_service(name, kind, where, section, client_names):
+    enabled = _get(section, 'enabled', where, bool, True)
+    # A disabled service may be left half-filled; it's never used.
+    required = _MISSING if enabled else ''
+    hardlink_detection = _get(section, 'hardlink_detection', where, str, 'walk')
+    if hardlink_detection not in HARDLINK_DETECTION_MODES:
+        raise ConfigError(f"{where}.hardlink_detection must be one of {', '.join(HARDLINK_DETECTION_MODES)}, got {hardlink_detection!r}")
+    # Runs only talk to the *arr itself for hardlink_detection: arr; with the walk,
+    # url/api_key are optional (only the health check uses them).
+    arr_required = required if hardlink_detection == 'arr' else ''
+    mappings = section.get('arr_path_mappings') or {}
+    if not isinstance(mappings, dict) or not all(isinstance(k, str) and isinstance(v, str) for k, v in mappings.items()):
+        raise ConfigError(f"{where}.arr_path_mappings must map *arr path prefixes to local path prefixes")
+    # Defaults to the first (usually only) qBittorrent instance.
+    download_client = _get(section, 'download_client', where, str, client_names[0])
+    if download_client not in client_names:
+        raise ConfigError(f"{where}.download_client must be one of {', '.join(client_names)}, got {download_client!r}")
+    return ServiceConfig(
+        name=name,
+        kind=kind,
+        download_client=download_client,
+        enabled=enabled,
+        url=_get(section, 'url', where, str, arr_required),
+        api_key=_get(section, 'api_key', where, str, arr_required),
+        root_folder=_get(section, 'root_folder', where, str, required),
+        category=_get(section, 'category', where, str, required),
+        min_seed_days=_get(section, 'min_seed_days', where, float, 30, minimum=0),
+        max_delete_percent=_get(section, 'max_delete_percent', where, float, None, minimum=0, maximum=100),
+        scan_workers=_get(section, 'scan_workers', where, int, DEFAULT_SCAN_WORKERS, minimum=1),
+        hardlink_detection=hardlink_detection,
+        arr_path_mappings=dict(mappings),
+    )
+
+
+def parse_config(raw) -> AppConfig:
+    """Validate a raw YAML dict into an AppConfig. Raises ConfigError naming the bad key."""
+    if not isinstance(raw, dict) or not raw:
+        raise ConfigError("Config is empty or not a mapping")
+
+    download_clients = [_parse_qbit(name, where, section)
+                        for name, where, section in _instances(raw, DEFAULT_QBIT_NAME, required=True)]
+    client_names = [c.name for c in download_clients]
+
+    services = []
+    for kind in SERVICE_KINDS:
+        for name, where, section in _instances(raw, kind):
+            services.append(_parse_service(name, kind, where, section, client_names))
+    # Names key results, logs, metrics, plans and health checks, so they must be unique
+    # across kinds and not clash with a qBittorrent instance.
+    names = client_names + [s.name for s in services]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ConfigError(f"Instance names must be unique, duplicated: {', '.join(duplicates)}")
+
+    log = _section(raw, 'logging') or {}
+    level = _get(log, 'level', 'logging', str, 'INFO').upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise ConfigError(f"logging.level must be one of DEBUG, INFO, WARNING, ERROR, got {level!r}")
+
+    sched = _section(raw, 'schedule') or {}
+    schedule = ScheduleConfig(
+        enabled=_get(sched, 'enabled', 'schedule', bool, False),
+        cron=_get(sched, 'cron', 'schedule', str, None),
+        interval_minutes=_get(sched, 'interval_minutes', 'schedule', float, None),
+        jitter_seconds=_get(sched, 'jitter_seconds', 'schedule', float, 0, minimum=0),
+        dry_run=_get(sched, 'dry_run', 'schedule', bool, None),
+    )
+    try:
+        parse_schedule(schedule)
+    except ScheduleError as e:
+        raise ConfigError(f"schedule: {e}") from e
+
+    budget = _section(raw, 'budget') or {}
+
+    return AppConfig(
+        download_clients=tuple(download_clients),
+        services=tuple(services),
+        parallel_services=_get(raw, 'parallel_services', 'config', int, DEFAULT_PARALLEL_SERVICES, minimum=1),
+        dry_run=_get(raw, 'dry_run', 'config', bool, True),
+        library_watch=_get(raw, 'library_watch', 'config', bool, False),
+        health_check_ttl=_get(raw, 'health_check_ttl', 'config', float, DEFAULT_HEALTH_CHECK_TTL, minimum=0),
+        logging=LoggingConfig(level=level, file=_get(log, 'file', 'logging', str, None)),
+        schedule=schedule,
+        budget=BudgetConfig(
+            max_seconds=_get(budget, 'max_seconds', 'budget', float, None, minimum=1),
+            max_files=_get(budget, 'max_files', 'budget', int, None, minimum=1),
+        ),
+    )
+
+
+class ConfigStore:
+    """The parsed config for one config file, cached until the file changes.
+
+    get() is a stat() plus a reference read while the file's mtime and size are
+    unchanged, so runs, health checks and the scheduler can all call it freely. A
+    changed file is re-read and validated first; the new AppConfig replaces the old one
+    in a single assignment, so a caller always holds one consistent snapshot. Listeners
+    registered with on_change run after each swap.
+    """
+
+    def __init__(self, config_path):
+        self.path = config_path
+        self.cache_dir = get_cache_dir(config_path)
+        self._lock = threading.Lock()
+        self._config = None
+        self._stamp = None
+        self._listeners = []
+
+    def on_change(self, listener):
+        self._listeners.append(listener)
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            raise ConfigError(f"Error loading config at {self.path}: {e}") from e
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self) -> AppConfig:
+        stamp = self._file_stamp()
+        with self._lock:
+            if self._config is not None and stamp == self._stamp:
+                return self._config
+            config = parse_config(load_config(self.path))
+            self._config, self._stamp = config, stamp
+        self._notify(config)
+        return config
+
+    def save(self, raw) -> AppConfig:
+        """Validate, atomically write and install a new config. Raises ConfigError if invalid."""
+        config = parse_config(raw)
+        with self._lock:
+            temp_path = f"{self.path}.tmp"
+            try:
+                with open(temp_path, 'w') as f:
+                    yaml.safe_dump(raw, f, default_flow_style=False, sort_keys=False)
+                os.replace(temp_path, self.path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            self._config, self._stamp = config, self._file_stamp()
+        self._notify(config)
+        return config
+
+    def _notify(self, config):
+        for listener in self._listeners:
+            try:
+                listener(config)
+            except Exception as e:
+                logging.error(f"Applying config change failed: {e}")
+
+def get_cache_dir(config_path: str) -> str:
+    """Directory for Deletarr's own persisted state, next to the config file."""
+    return os.path.join(os.path.dirname(os.path.abspath(config_path)), 'cache')
+
+# Last LoggingConfig applied; setup_logging is a no-op until it changes.
+_applied_logging = None
+
+def setup_logging(log_config: LoggingConfig):
+    global _applied_logging
+    if log_config == _applied_logging:
+        return
+    _applied_logging = log_config
+    level = getattr(logging, log_config.level, logging.INFO)
     
     # Get root logger
     root_logger = logging.getLogger()
@@ -31,8 +363,8 @@ def setup_logging(log_config: dict):
     # Only add handlers if none exist or to the root
     if not root_logger.handlers:
         log_handlers = []
-        if log_config.get('file'):
-            log_handlers.append(logging.FileHandler(log_config.get('file')))
+        if log_config.file:
+            log_handlers.append(logging.FileHandler(log_config.file))
         log_handlers.append(logging.StreamHandler(sys.stdout))
         
         formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
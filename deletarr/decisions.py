@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Bump when the on-disk layout changes; older files are ignored.
+DECISION_CACHE_VERSION = 1
+# A cached KEEP is re-checked against the library at least this often, even if its
+# file never changed (e.g. the library folder holding the link was moved away).
+DECISION_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def fingerprint(stat_info):
+    """What has to stay the same for a verdict about this file to still hold.
+
+    Linking or unlinking a file changes its st_nlink and st_ctime, so a new, removed or
+    renamed hardlink always shows up here.
+    """
+    return [stat_info.st_dev, stat_info.st_ino, stat_info.st_nlink,
+            stat_info.st_mtime_ns, stat_info.st_ctime_ns]
+
+
+class DecisionCache:
+    """KEEP verdicts from earlier runs, keyed by torrent info-hash and persisted.
+
+    An entry records the torrent file that was found hardlinked into the library and
+    that file's fingerprint. While the fingerprint, root folder and detection mode are
+    unchanged, the torrent is kept again after one stat, with no library lookup.
+
+    Only KEEP is cached. A CANDIDATE can flip to KEEP without its files changing at
+    all (a directory holding another link is moved into the library), and a candidate
+    whose files have no other links is already decided by a single stat. Inconclusive
+    checks (HardlinkCheckError) are never cached, and they drop any existing entry.
+    """
+
+    def __init__(self, path=None, max_age=DECISION_CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path:
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == DECISION_CACHE_VERSION:
+                    self._entries = data.get('entries', {})
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable decision cache {path}: {e}")
+
+    def lookup(self, torrent_hash, context, paths):
+        """True if the cached KEEP for this torrent still holds, else None.
+
+        context identifies what the verdict was checked against (root folder and
+        detection mode); paths are the torrent's current file paths. A stale entry
+        is dropped.
+        """
+        with self._lock:
+            entry = self._entries.get(torrent_hash)
+        if entry is None:
+            return None
+        valid = (
+            entry.get('context') == context
+            and time.time() - entry.get('at', 0) < self.max_age
+            and entry.get('path') in paths
+        )
+        if valid:
+            try:
+                valid = fingerprint(os.stat(entry['path'])) == entry.get('fingerprint')
+            except OSError:
+                valid = False
+        if not valid:
+            self.discard(torrent_hash)
+            return None
+        return True
+
+    def keep(self, torrent_hash, context, path, stat_info):
+        """Remember that `path` (stat'd as stat_info before the check) was found linked."""
+        with self._lock:
+            self._entries[torrent_hash] = {
+                'context': context,
+                'path': path,
+                'fingerprint': fingerprint(stat_info),
+                'at': time.time(),
+            }
+            self._dirty = True
+
+    def discard(self, torrent_hash):
+        with self._lock:
+            if self._entries.pop(torrent_hash, None) is not None:
+                self._dirty = True
+
+    def prune(self, known_hashes):
+        """Drop entries for torrents qBittorrent no longer has."""
+        with self._lock:
+            gone = [h for h in self._entries if h not in known_hashes]
+            for h in gone:
+                del self._entries[h]
+            if gone:
+                self._dirty = True
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'version': DECISION_CACHE_VERSION, 'entries': dict(self._entries)}
+            self._dirty = False
+        temp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            # Only an accelerator; a failed write means the next run checks again.
+            logging.warning(f"Could not save decision cache {self.path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Default seconds a probe result is served before it's refreshed; overridable as
+# health_check_ttl in config.yml.
+DEFAULT_HEALTH_CHECK_TTL = 30
+
+
+class _Entry:
+    def __init__(self):
+        self.result = None
+        self.checked_at = 0.0
+        self.pending = None  # Future of the probe in flight, if any
+
+
+class HealthChecker:
+    """Service health probes: concurrent, cached, stale-while-revalidate.
+
+    Each service's probe result is kept for `ttl` seconds. After that the cached result
+    is still returned immediately while one background probe refreshes it, so however
+    many browsers poll, each service sees at most one probe in flight. Only a service
+    with no result yet (first check, or its connection settings changed) makes the
+    caller wait, and those probes run in parallel so the wait is the slowest one rather
+    than the sum.
+    """
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="health")
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def check(self, probes, ttl=DEFAULT_HEALTH_CHECK_TTL):
+        """Results for `probes`, a dict of name -> (key, probe).
+
+        `key` identifies the connection (a new key discards the old result); `probe()`
+        returns a status dict like QbitClient.test_connection. Each result gains
+        `latency_ms` and `checked_at` (epoch seconds).
+        """
+        now = time.time()
+        waiting = {}
+        results = {}
+        with self._lock:
+            for name, (key, probe) in probes.items():
+                entry = self._entries.get((name, key))
+                if entry is None:
+                    entry = self._entries[(name, key)] = _Entry()
+                    # Drop results for this service's previous settings.
+                    for old in [k for k in self._entries if k[0] == name and k != (name, key)]:
+                        del self._entries[old]
+                if entry.result is not None and now - entry.checked_at < ttl:
+                    results[name] = entry.result
+                    continue
+                if entry.pending is None:
+                    entry.pending = self._executor.submit(self._probe, name, key, entry, probe)
+                if entry.result is not None:
+                    results[name] = entry.result  # stale; refreshed in the background
+                else:
+                    waiting[name] = entry.pending
+        if waiting:
+            wait(waiting.values())
+            for name, future in waiting.items():
+                results[name] = future.result()
+        return {name: results[name] for name in probes}
+
+    def _probe(self, name, key, entry, probe):
+        started = time.monotonic()
+        try:
+            result = dict(probe())
+        except Exception as e:
+            result = {"status": "error", "message": str(e) or type(e).__name__}
+        result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        result["checked_at"] = time.time()
+        if result.get("status") != "ok":
+            logging.debug(f"Health check {name}: {result}")
+        with self._lock:
+            entry.result = result
+            entry.checked_at = result["checked_at"]
+            entry.pending = None
+        return result
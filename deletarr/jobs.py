@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from .progress import RunProgress
+
+# Finished jobs kept for polling; older ones are dropped first.
+MAX_FINISHED_JOBS = 20
+# A running job's state is written to the JobStore at most this often, and at least every
+# JOB_HEARTBEAT_SECONDS. One not written for JOB_STALE_SECONDS lost its worker.
+JOB_PUBLISH_INTERVAL = 0.5
+JOB_HEARTBEAT_SECONDS = 5
+JOB_STALE_SECONDS = 60
+
+_JOB_ID = re.compile(r'^[0-9a-f]{12}$')
+
+
+class RunInProgress(Exception):
+    """Raised when a run is requested while another one holds the run lock."""
+
+
+class Job:
+    def __init__(self, dry_run, plan_id=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.dry_run = dry_run
+        self.plan_id = plan_id
+        self.status = 'running'
+        self.created_at = time.time()
+        self.finished_at = None
+        self.progress = RunProgress()
+        self.result = None
+        self.error = None
+
+    @property
+    def done(self):
+        return self.status in ('succeeded', 'failed')
+
+    @property
+    def version(self):
+        # Changes whenever progress moves or the job finishes.
+        return (self.progress.version, self.status)
+
+    def to_dict(self, include_result=True):
+        data = {
+            'id': self.id,
+            'dry_run': self.dry_run,
+            'plan_id': self.plan_id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'progress': self.progress.snapshot(),
+            'error': self.error,
+        }
+        if include_result:
+            data['result'] = self.result
+        return data
+
+
+class JobStore:
+    """Job state on disk, so every API worker can serve every job.
+
+    Per job: `<id>.json` (to_dict without the result, rewritten atomically as the job
+    moves), `<id>.decisions.jsonl` (its per-torrent decisions, appended in batches) and,
+    once it finished, `<id>.result.json`.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    def _write(self, path, data):
+        temp_path = f"{path}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temp_path, path)
+        except Exception as e:
+            # The job itself goes on; other workers just see it lag behind.
+            logging.warning(f"Could not save job state {path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def save(self, data, result=None):
+        """Write a job's state (and its result, once it has one)."""
+        if result is not None:
+            self._write(self._path(data['id'], '.result.json'), result)
+        self._write(self._path(data['id'], '.json'), dict(data, heartbeat_at=time.time()))
+
+    def append_decisions(self, job_id, decisions):
+        if not decisions:
+            return
+        lines = ''.join(json.dumps(d, separators=(',', ':')) + '\n' for d in decisions)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # One write per batch: readers only consume complete lines.
+            with open(self._path(job_id, '.decisions.jsonl'), 'a') as f:
+                f.write(lines)
+        except Exception as e:
+            logging.warning(f"Could not save decisions of job {job_id}: {e}")
+
+    def _read(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable job state {path}: {e}")
+            return None
+
+    def get(self, job_id, include_result=True):
+        """A job's to_dict(), or None. A running job whose worker stopped writing is reported failed."""
+        if not isinstance(job_id, str) or not _JOB_ID.match(job_id):
+            return None
+        data = self._read(self._path(job_id, '.json'))
+        if data is None:
+            return None
+        heartbeat_at = data.pop('heartbeat_at', 0)
+        if data['status'] == 'running' and time.time() - heartbeat_at > JOB_STALE_SECONDS:
+            data['status'] = 'failed'
+            data['finished_at'] = heartbeat_at
+            data['error'] = "The worker running this job stopped before it finished"
+        if include_result:
+            data['result'] = self._read(self._path(job_id, '.result.json'))
+        return data
+
+    def read_decisions(self, job_id, offset=0):
+        """(decisions appended after byte offset, new offset)."""
+        try:
+            with open(self._path(job_id, '.decisions.jsonl'), 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return [], offset
+        end = chunk.rfind(b'\n') + 1
+        decisions = [json.loads(line) for line in chunk[:end].splitlines() if line]
+        return decisions, offset + end
+
+    def list(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        jobs = (self.get(name[:-len('.json')], include_result=False)
+                for name in names if name.endswith('.json') and not name.endswith('.result.json'))
+        return [job for job in jobs if job is not None]
+
+    def prune(self, keep=MAX_FINISHED_JOBS):
+        finished = sorted((j for j in self.list() if j['status'] != 'running'), key=lambda j: j['created_at'])
+        for job in finished[:max(0, len(finished) - keep)]:
+            for suffix in ('.json', '.result.json', '.decisions.jsonl'):
+                try:
+                    os.remove(self._path(job['id'], suffix))
+                except FileNotFoundError:
+                    pass
+
+
+class JobManager:
+    """Runs run_deletarr in background threads, one at a time.
+
+    `run_lock` is the same lock the synchronous endpoints use, so a job and a
+    blocking /api/run can never overlap; a FileLock makes that hold across API workers.
+    `runner(dry_run, progress, plan_id)` does the work and returns run_deletarr's (or
+    apply_plan's, with a plan_id) result dict.
+
+    With a `store`, jobs are also published to disk while they run, and get()/list()/
+    decisions_since() serve jobs started by other workers from it. Jobs of this worker
+    are always served from memory.
+    """
+
+    def __init__(self, run_lock, runner, store=None):
+        self.run_lock = run_lock
+        self.runner = runner
+        self.store = store
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, dry_run, plan_id=None):
+        """Start a run (or apply plan_id) and return its Job immediately. Raises RunInProgress if busy."""
+        if not self.run_lock.acquire(blocking=False):
+            raise RunInProgress("Another run is already in progress")
+        try:
+            job = Job(dry_run, plan_id)
+            with self._lock:
+                self._jobs[job.id] = job
+                self._prune()
+            if self.store is not None:
+                self.store.save(job.to_dict(include_result=False))
+            threading.Thread(target=self._execute, args=(job,), name=f"run-job:{job.id}", daemon=True).start()
+        except Exception:
+            self.run_lock.release()
+            raise
+        return job
+
+    def _execute(self, job):
+        status, error = 'failed', None
+        finished = threading.Event()
+        publisher = None
+        if self.store is not None:
+            publisher = threading.Thread(target=self._publish, args=(job, finished),
+                                         name=f"run-job-publish:{job.id}", daemon=True)
+            publisher.start()
+        try:
+            result = self.runner(job.dry_run, job.progress, job.plan_id)
+            job.result = result
+            if result.get('success'):
+                status = 'succeeded'
+            else:
+                error = result.get('error')
+        except Exception as e:
+            logging.error(f"Run job {job.id} failed: {e}")
+            error = str(e) or type(e).__name__
+        finally:
+            job.finished_at = time.time()
+            job.progress.set_phase('done')
+            # Release before publishing the final status, so a client that sees the job
+            # finish can immediately start the next one.
+            self.run_lock.release()
+            if publisher is not None:
+                finished.set()
+                publisher.join()
+            job.error = error
+            job.status = status
+            if self.store is not None:
+                self.store.save(job.to_dict(include_result=False), result=job.result)
+
+    def _publish(self, job, finished):
+        """Mirror a running job into the store until it finishes."""
+        last_version, last_decision, saved_at = job.version, 0, time.monotonic()
+        while True:
+            stop = finished.wait(JOB_PUBLISH_INTERVAL)
+            decisions = job.progress.decisions_since(last_decision)
+            if decisions:
+                last_decision = decisions[-1]['seq']
+                self.store.append_decisions(job.id, decisions)
+            if stop:
+                return
+            if job.version != last_version or time.monotonic() - saved_at >= JOB_HEARTBEAT_SECONDS:
+                last_version, saved_at = job.version, time.monotonic()
+                self.store.save(job.to_dict(include_result=False))
+
+    def _prune(self):
+        finished = sorted((j for j in self._jobs.values() if j.done), key=lambda j: j.created_at)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+        if self.store is not None:
+            self.store.prune()
+
+    def get(self, job_id, include_result=True):
+        """The job's to_dict(), or None if no worker knows it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict(include_result)
+        if self.store is not None:
+            return self.store.get(job_id, include_result)
+        return None
+
+    def decisions_since(self, job_id, cursor=0):
+        """(decisions after cursor, next cursor); cursors are only meaningful per worker."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            decisions = job.progress.decisions_since(cursor)
+            return decisions, decisions[-1]['seq'] if decisions else cursor
+        if self.store is not None:
+            return self.store.read_decisions(job_id, cursor)
+        return [], cursor
+
+    def list(self):
+        """Every job (without results), newest first; this worker's from memory."""
+        with self._lock:
+            jobs = {job.id: job.to_dict(include_result=False) for job in self._jobs.values()}
+        if self.store is not None:
+            for data in self.store.list():
+                jobs.setdefault(data['id'], data)
+        return sorted(jobs.values(), key=lambda j: j['created_at'], reverse=True)
@@ -0,0 +1,565 @@
+import os
+import stat
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .utils import HardlinkCheckError, LiveIndexStale, mounts
+from .metrics import metrics
+
+# Bump when the on-disk snapshot layout changes; older snapshots are ignored (full rescan).
+# 2: file keys are verified against st_ino (version 1 could hold unverified d_ino keys).
+# 3: no d_ino keys on overlayfs (version 2 trusted a per-directory sample there).
+SNAPSHOT_VERSION = 3
+
+# A directory modified this close to the scan may change again within the same timestamp
+# tick without its mtime moving, so it is never trusted on the next run.
+_RACY_WINDOW_NS = 2 * 1_000_000_000
+
+# Per-service `scan_workers` default. The walk is I/O-latency bound, not CPU bound.
+DEFAULT_SCAN_WORKERS = 4
+
+
+class LibraryIndex:
+    """Every (st_dev, st_ino) pair found under a library root folder, mapped to one path.
+
+    Built once per root folder per run so the hardlink check is a dict lookup
+    instead of a full library walk for every linked torrent file.
+    """
+
+    def __init__(self, root_folder, inodes, unreadable_dirs=None, scan_stats=None):
+        self.root_folder = root_folder
+        self.inodes = inodes
+        self.unreadable_dirs = unreadable_dirs or []
+        self.scan_stats = scan_stats or {}
+
+    def __len__(self):
+        return len(self.inodes)
+
+    def find(self, stat_info):
+        """Library path linked to the stat'd file, or None.
+
+        Raises HardlinkCheckError on a miss when part of the tree could not be read —
+        the missing link may live in the directory we couldn't list.
+        """
+        path = self.inodes.get((stat_info.st_dev, stat_info.st_ino))
+        if path is not None:
+            return path
+        if self.unreadable_dirs:
+            raise HardlinkCheckError(
+                f"Library index for {self.root_folder} is incomplete "
+                f"({len(self.unreadable_dirs)} unreadable director(ies), e.g. {self.unreadable_dirs[0]})"
+            )
+        return None
+
+    def contains(self, stat_info):
+        return self.find(stat_info) is not None
+
+
+def _new_scan_stats(full_rescan):
+    return {
+        "full_rescan": full_rescan,
+        "dirs_scanned": 0,
+        "dirs_reused": 0,
+        "files_scanned": 0,
+        "files_reused": 0,
+        "unreadable_dirs": 0,
+    }
+
+
+def _overlay_devices(root_folder):
+    """st_dev of the overlayfs mounts a walk of root_folder can enter.
+
+    overlayfs merges layers per file, so one file's d_ino can match its st_ino while
+    its neighbour's doesn't; a sample can't vouch for the rest of a directory there.
+    """
+    root = os.path.realpath(root_folder)
+    containing, containing_type = "", ""
+    overlays = []
+    for mount_point, fs_type in mounts():
+        if root == mount_point or root.startswith(mount_point.rstrip("/") + "/"):
+            if len(mount_point) >= len(containing):
+                containing, containing_type = mount_point, fs_type
+        elif fs_type == "overlay" and mount_point.startswith(root.rstrip("/") + "/"):
+            overlays.append(mount_point)
+    if containing_type == "overlay":
+        overlays.append(containing)
+    devices = set()
+    for mount_point in overlays:
+        try:
+            devices.add(os.stat(mount_point).st_dev)
+        except OSError:
+            continue
+    return devices
+
+
+def _list_directory(path, dir_stat, scan_started_ns, overlay_devices=frozenset()):
+    """scandir one directory. Returns (record, [(subdir_name, lstat), ...]).
+
+    Regular files are indexed from the DirEntry's own inode number (d_ino from the
+    directory listing) and the directory's st_dev, so they cost no stat call at all —
+    but only after one lstat per directory confirms d_ino is the real st_ino there.
+    On FUSE without use_ino and some network filesystems it isn't, and a d_ino key
+    would never match a torrent file's stat (a false "no hardlink"); such directories
+    are lstat'd file by file. Directories on overlay_devices (overlayfs, where the
+    sample isn't representative) always are.
+    Symlinked files are stat'd following the link (a library symlink to a torrent file
+    counts, as it always has); symlinked directories are not descended into.
+    """
+    files = []
+    subdirs = []
+    regular = []
+    has_symlinks = False
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_symlink():
+                    has_symlinks = True
+                    if entry.is_dir():
+                        continue
+                    st = entry.stat()
+                    files.append([entry.name, st.st_dev, st.st_ino])
+                elif entry.is_dir(follow_symlinks=False):
+                    subdirs.append((entry.name, entry.stat(follow_symlinks=False)))
+                else:
+                    regular.append(entry)
+            except OSError:
+                continue  # individual unreadable files are tolerable during the inode scan
+
+    trust_d_ino = False
+    if dir_stat.st_dev not in overlay_devices:
+        for entry in regular:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            trust_d_ino = st.st_ino == entry.inode() and st.st_dev == dir_stat.st_dev
+            break
+    for entry in regular:
+        if trust_d_ino:
+            files.append([entry.name, dir_stat.st_dev, entry.inode()])
+            continue
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        files.append([entry.name, st.st_dev, st.st_ino])
+
+    record = {
+        "mtime_ns": dir_stat.st_mtime_ns,
+        "ctime_ns": dir_stat.st_ctime_ns,
+        # A symlink's target can change without touching this directory, so
+        # directories holding symlinks are always rescanned.
+        "rescan": has_symlinks or max(dir_stat.st_mtime_ns, dir_stat.st_ctime_ns) >= scan_started_ns - _RACY_WINDOW_NS,
+        "files": files,
+        "subdirs": [name for name, _ in subdirs],
+    }
+    return record, subdirs
+
+
+def _visit_directory(path, dir_stat, cached, scan_started_ns, overlay_devices):
+    """Index one directory, from `cached` if it is untouched. Runs on a scan worker.
+
+    Returns (record, subdirs, reused, unreadable_paths). Raises OSError if the
+    directory itself can't be listed.
+    """
+    if (
+        cached is not None
+        and not cached.get("rescan")
+        and cached.get("mtime_ns") == dir_stat.st_mtime_ns
+        and cached.get("ctime_ns") == dir_stat.st_ctime_ns
+    ):
+        subdirs = []
+        unreadable = []
+        for name in cached["subdirs"]:
+            sub_path = os.path.join(path, name)
+            try:
+                sub_stat = os.lstat(sub_path)
+            except OSError as e:
+                logging.warning(f"Cannot stat library directory {sub_path}: {e}")
+                unreadable.append(sub_path)
+                continue
+            if stat.S_ISDIR(sub_stat.st_mode):
+                subdirs.append((name, sub_stat))
+        return cached, subdirs, True, unreadable
+
+    record, subdirs = _list_directory(path, dir_stat, scan_started_ns, overlay_devices)
+    return record, subdirs, False, []
+
+
+def scan_library(root_folder, previous=None, workers=1):
+    """Index root_folder, reusing entries from a previous snapshot where possible.
+
+    Every directory is stat'd, but only directories whose mtime or ctime changed since
+    `previous` are listed again; untouched directories reuse their cached
+    (name, dev, inode) entries. If the root's device id or mtime no longer matches
+    the snapshot, the snapshot is discarded and everything is rescanned.
+
+    Directories are visited on a pool of `workers` threads. On NFS every listing and
+    stat is a network round trip, so the walk is latency-bound and overlapping
+    directories is what makes it fast.
+
+    Returns (LibraryIndex, snapshot). Raises HardlinkCheckError if the root itself is
+    missing or can't be listed.
+    """
+    try:
+        root_stat = os.stat(root_folder)
+    except OSError as e:
+        raise HardlinkCheckError(f"Target folder does not exist or is not a directory: {root_folder}") from e
+    if not stat.S_ISDIR(root_stat.st_mode):
+        raise HardlinkCheckError(f"Target folder does not exist or is not a directory: {root_folder}")
+
+    prev_dirs = {}
+    if previous:
+        if (
+            previous.get("version") == SNAPSHOT_VERSION
+            and previous.get("dev") == root_stat.st_dev
+            and previous.get("root_mtime_ns") == root_stat.st_mtime_ns
+        ):
+            prev_dirs = previous.get("dirs", {})
+        else:
+            logging.info(f"Library snapshot for {root_folder} is stale (device or root mtime changed); full rescan")
+
+    scan_stats = _new_scan_stats(full_rescan=not prev_dirs)
+    scan_started_ns = time.time_ns()
+    overlay_devices = _overlay_devices(root_folder)
+    inodes = {}
+    dirs = {}
+    unreadable_dirs = []
+
+    # Workers only read the filesystem; all index/stat bookkeeping happens on this thread.
+    with ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="library-scan") as pool:
+        def submit(rel, path, dir_stat):
+            future = pool.submit(_visit_directory, path, dir_stat, prev_dirs.get(rel), scan_started_ns, overlay_devices)
+            in_flight[future] = (rel, path)
+
+        in_flight = {}
+        submit("", root_folder, root_stat)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel, path = in_flight.pop(future)
+                try:
+                    record, subdirs, reused, unreadable = future.result()
+                except OSError as e:
+                    if not rel:
+                        raise HardlinkCheckError(f"Error walking target folder {root_folder}: {e}") from e
+                    logging.warning(f"Cannot list library directory {path}: {e}")
+                    unreadable_dirs.append(path)
+                    continue
+
+                if reused:
+                    scan_stats["dirs_reused"] += 1
+                    scan_stats["files_reused"] += len(record["files"])
+                else:
+                    scan_stats["dirs_scanned"] += 1
+                    scan_stats["files_scanned"] += len(record["files"])
+                unreadable_dirs.extend(unreadable)
+
+                dirs[rel] = record
+                for name, dev, ino in record["files"]:
+                    inodes[(dev, ino)] = os.path.join(path, name)
+                for name, sub_stat in subdirs:
+                    submit(os.path.join(rel, name) if rel else name, os.path.join(path, name), sub_stat)
+
+    scan_stats["unreadable_dirs"] = len(unreadable_dirs)
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "root": root_folder,
+        "dev": root_stat.st_dev,
+        "root_mtime_ns": root_stat.st_mtime_ns,
+        "dirs": dirs,
+    }
+    return LibraryIndex(root_folder, inodes, unreadable_dirs, scan_stats), snapshot
+
+
+def build_library_index(root_folder, workers=1):
+    """Walk root_folder once and collect the inode of every file in it (no snapshot)."""
+    index, _ = scan_library(root_folder, workers=workers)
+    return index
+
+
+class ArrLibrarySource:
+    """Where hardlink_detection: arr gets its file list: one Radarr/Sonarr instance.
+
+    fetch_paths() returns (paths, expected) as the *arr reports them; path_mappings
+    rewrites the *arr's path prefixes to how this container sees the same files.
+    """
+
+    def __init__(self, name, fetch_paths, path_mappings=None):
+        self.name = name
+        self.fetch_paths = fetch_paths
+        # Longest prefix first so /data/movies-4k wins over /data/movies.
+        self.path_mappings = sorted((path_mappings or {}).items(), key=lambda m: len(m[0]), reverse=True)
+
+    def map_path(self, path):
+        for arr_prefix, local_prefix in self.path_mappings:
+            if path == arr_prefix or path.startswith(arr_prefix.rstrip("/") + "/"):
+                return local_prefix.rstrip("/") + path[len(arr_prefix.rstrip("/")):]
+        return path
+
+
+def build_arr_library_index(root_folder, source, workers=1):
+    """Index only the files the *arr says it imported under root_folder.
+
+    Stats a few thousand known paths instead of walking the whole tree. Returns
+    (LibraryIndex, None) when the listing looks complete, or (None, reason) when it
+    doesn't — an API error, fewer paths than the *arr's own file count, or any listed
+    file that can't be stat'd — so the caller can fall back to a full walk.
+    """
+    try:
+        paths, expected = source.fetch_paths()
+    except Exception as e:
+        return None, f"{source.name} API error: {e}"
+    if len(paths) < expected:
+        return None, f"{source.name} listed {len(paths)} file paths but reports {expected} files"
+
+    # Match against both spellings of the root rather than realpath()ing every file.
+    root_prefixes = tuple({root_folder.rstrip("/") + "/", os.path.realpath(root_folder).rstrip("/") + "/"})
+    local_paths = []
+    outside = 0
+    for path in paths:
+        local = source.map_path(path)
+        if local.startswith(root_prefixes):
+            local_paths.append(local)
+        else:
+            outside += 1
+    if paths and not local_paths:
+        return None, f"none of {source.name}'s {len(paths)} file paths are under {root_folder} (check arr_path_mappings)"
+    if outside:
+        logging.info(f"[{source.name}] {outside} library file(s) are outside {root_folder}; ignoring them")
+
+    def stat_path(path):
+        try:
+            return path, os.stat(path)
+        except OSError as e:
+            return path, e
+
+    inodes = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="arr-stat") as pool:
+        for path, st in pool.map(stat_path, local_paths):
+            if isinstance(st, OSError):
+                failed.append(path)
+            else:
+                inodes[(st.st_dev, st.st_ino)] = path
+    if failed:
+        return None, f"{len(failed)} of {source.name}'s files can't be stat'd (e.g. {failed[0]})"
+
+    scan_stats = _new_scan_stats(full_rescan=False)
+    scan_stats.update({"arr": source.name, "files_scanned": len(local_paths)})
+    return LibraryIndex(root_folder, inodes, scan_stats=scan_stats), None
+
+
+class LibraryIndexCache:
+    """Run-scoped cache of library indexes, keyed by the resolved root folder.
+
+    Services that point at the same root folder share one index. Indexes are built
+    lazily on first use, so a run with no linked torrent files never walks the library.
+    A failed build is remembered too, so every check against that root fails the same way.
+    Different roots are built concurrently; callers needing the same root wait for one build.
+
+    roots are the root folders of every service in the run. A root nested inside
+    another one (e.g. /data/movies/4k under /data/movies) isn't walked on its own: the
+    outermost root is walked once and the nested index is cut out of its directory list.
+
+    With a cache_dir, each index is also persisted as a snapshot and the next run
+    rescans only the directories that changed since. With live_indexes (a
+    watcher.LibraryWatcher), a root that has a current inotify-backed index uses it
+    and is not walked at all. If that index goes stale mid-run, find() walks the root
+    and uses the walk for the rest of the run.
+    """
+
+    def __init__(self, cache_dir=None, live_indexes=None, roots=()):
+        self.cache_dir = cache_dir
+        self.live_indexes = live_indexes
+        self.roots = sorted({os.path.realpath(root) for root in roots}, key=len)
+        # Roots with another root inside them keep their walked directories for the run.
+        self._parents = {root for root in self.roots if any(self._outer_root(other) == root for other in self.roots)}
+        self._indexes = {}
+        self._dirs = {}
+        self._build_locks = {}
+        self._lock = threading.Lock()
+        # Total time spent building indexes this run, so callers timing lookups can
+        # leave the scan out.
+        self.scan_seconds = 0.0
+
+    def _outer_root(self, key):
+        """Outermost of self.roots that key is strictly inside, or None."""
+        for root in self.roots:  # shortest first
+            if key != root and key.startswith(root.rstrip(os.sep) + os.sep):
+                return root
+        return None
+
+    def _build_lock(self, key):
+        with self._lock:
+            return self._build_locks.setdefault(key, threading.Lock())
+
+    def _timed_build(self, mode, build, *args):
+        started = time.perf_counter()
+        try:
+            return build(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.scan_seconds += elapsed
+            metrics.observe('deletarr_phase_seconds', elapsed, phase='library_scan', mode=mode)
+
+    def _snapshot_path(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, "library", f"{digest}.json")
+
+    def _load_snapshot(self, key):
+        path = self._snapshot_path(key)
+        try:
+            with open(path, "r") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable library snapshot {path}: {e}")
+            return None
+        # Same digest, different root (hash collision or moved config): never reuse.
+        return snapshot if snapshot.get("root") == key else None
+
+    def _save_snapshot(self, key, snapshot):
+        path = self._snapshot_path(key)
+        temp_path = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, "w") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(temp_path, path)
+        except Exception as e:
+            # The snapshot is only an accelerator; failing to write it must not fail the run.
+            logging.warning(f"Could not save library snapshot {path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _build(self, key, workers):
+        index, snapshot = scan_library(key, self._load_snapshot(key) if self.cache_dir else None, workers)
+        if self.cache_dir:
+            self._save_snapshot(key, snapshot)
+        if key in self._parents:
+            with self._lock:
+                self._dirs[key] = snapshot["dirs"]
+        return index
+
+    def _nested(self, key, outer, workers):
+        """Index for key cut out of the outer root's walk, or None if it can't be."""
+        try:
+            parent = self.get(outer, workers)
+        except HardlinkCheckError:
+            return None
+        with self._lock:
+            dirs = self._dirs.get(outer)
+        rel = os.path.relpath(key, outer)
+        # A live parent index has no directory list, and its inode map holds only one
+        # path per inode, which may be outside key; walk key itself in those cases.
+        if dirs is None or rel not in dirs:
+            return None
+        prefix = rel + os.sep
+        inodes = {}
+        files = 0
+        for dir_rel, record in dirs.items():
+            if dir_rel == rel or dir_rel.startswith(prefix):
+                path = os.path.join(outer, dir_rel)
+                files += len(record["files"])
+                for name, dev, ino in record["files"]:
+                    inodes[(dev, ino)] = os.path.join(path, name)
+        unreadable_dirs = [p for p in parent.unreadable_dirs if p == key or p.startswith(key + os.sep)]
+        scan_stats = _new_scan_stats(full_rescan=False)
+        scan_stats.update({"files_reused": files, "unreadable_dirs": len(unreadable_dirs), "shared_with": outer})
+        return LibraryIndex(key, inodes, unreadable_dirs, scan_stats)
+
+    def _build_entry(self, root_folder, key, workers, use_live=True):
+        live = self.live_indexes.get(key) if self.live_indexes is not None and use_live else None
+        if live is not None:
+            live.refresh_symlinks()
+            logging.info(f"Using live library index for {root_folder} ({len(live)} inodes)")
+            return live
+        outer = self._outer_root(key)
+        if outer is not None:
+            entry = self._nested(key, outer, workers)
+            if entry is not None:
+                logging.info(f"Indexed {len(entry)} inodes under {root_folder} from the walk of {outer}")
+                return entry
+        try:
+            entry = self._timed_build('walk', self._build, key, workers)
+        except HardlinkCheckError as e:
+            return e
+        s = entry.scan_stats
+        logging.info(
+            f"Indexed {len(entry)} inodes under {root_folder}: "
+            f"{s['dirs_scanned']} dirs / {s['files_scanned']} files rescanned, "
+            f"{s['dirs_reused']} dirs / {s['files_reused']} files reused"
+            + (" (full rescan)" if s['full_rescan'] else "")
+        )
+        return entry
+
+    def get(self, root_folder, workers=1, arr_source=None):
+        """Index for root_folder, built on first use with `workers` scan threads.
+
+        With an ArrLibrarySource the index holds only that *arr's imported files (keyed
+        per *arr, since two *arrs sharing a root each only know their own files). If
+        the *arr listing looks incomplete, the shared filesystem index is used instead.
+        """
+        key = os.path.realpath(root_folder)
+        if arr_source is not None:
+            arr_key = (key, arr_source.name)
+            with self._build_lock(arr_key):
+                with self._lock:
+                    entry = self._indexes.get(arr_key)
+                if entry is None:
+                    entry, reason = self._timed_build('arr', build_arr_library_index, root_folder, arr_source, workers)
+                    if entry is None:
+                        logging.warning(f"[{arr_source.name}] Library listing looks incomplete ({reason}); walking {root_folder} instead")
+                        entry = False
+                    else:
+                        logging.info(f"[{arr_source.name}] Indexed {len(entry)} inodes from {entry.scan_stats['files_scanned']} library files")
+                    with self._lock:
+                        self._indexes[arr_key] = entry
+            if entry is not False:
+                return entry
+
+        # Nested roots take their own lock, then the outer root's; never the other way.
+        with self._build_lock(key):
+            with self._lock:
+                entry = self._indexes.get(key)
+            if entry is None:
+                entry = self._build_entry(root_folder, key, workers)
+                with self._lock:
+                    self._indexes[key] = entry
+        if isinstance(entry, HardlinkCheckError):
+            raise HardlinkCheckError(str(entry))
+        return entry
+
+    def find(self, root_folder, stat_info, workers=1, arr_source=None):
+        """get(root_folder, ...).find(stat_info), walking instead of a live index that went stale."""
+        index = self.get(root_folder, workers, arr_source)
+        try:
+            return index.find(stat_info)
+        except LiveIndexStale as e:
+            key = os.path.realpath(root_folder)
+            with self._build_lock(key):
+                with self._lock:
+                    entry = self._indexes.get(key)
+                if entry is index:  # not replaced by another worker already
+                    logging.warning(f"{e}; walking {root_folder} for the rest of this run")
+                    entry = self._build_entry(root_folder, key, workers, use_live=False)
+                    with self._lock:
+                        self._indexes[key] = entry
+            if isinstance(entry, HardlinkCheckError):
+                raise HardlinkCheckError(str(entry))
+            return entry.find(stat_info)
+
+    def scan_stats(self):
+        """{root_folder: scan stats} for every index built so far this run."""
+        with self._lock:
+            return {
+                (key if isinstance(key, str) else f"{key[0]} ({key[1]})"): entry.scan_stats
+                for key, entry in self._indexes.items()
+                if entry is not False and not isinstance(entry, HardlinkCheckError)
+            }
@@ -0,0 +1,58 @@
+import fcntl
+import os
+import threading
+
+
+class FileLock:
+    """An exclusive lock shared by every process using the same lock file.
+
+    Drop-in for threading.Lock's acquire(blocking)/release, so it can guard runs when
+    the API is served by several uvicorn workers. It's an flock on `path`, so the
+    kernel releases it if the holder dies; a thread lock in front keeps threads of one
+    process from contending on the file. The holder's pid is written into the file for
+    whoever is looking.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except Exception:
+            self._thread_lock.release()
+            raise
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            self._thread_lock.release()
+            return False
+        except Exception:
+            os.close(fd)
+            self._thread_lock.release()
+            raise
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
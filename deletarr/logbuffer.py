@@ -0,0 +1,250 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from collections import deque
+from itertools import islice
+
+# Per-torrent SKIP/KEEP/CANDIDATE lines go to this logger. They still reach stdout and
+# the log file through the root logger, but the API keeps them in their own lane so a
+# big library can't push everything else out of the console buffer.
+DECISIONS_LOGGER = 'deletarr.decisions'
+
+
+class LogRingBuffer:
+    """Bounded, thread-safe buffer of formatted log records.
+
+    Each record gets a monotonic `seq`, so readers can ask for just what they haven't
+    seen (`since`) instead of re-fetching the whole buffer. Appends are O(1); a read is
+    O(records returned).
+    """
+
+    def __init__(self, capacity):
+        self._records = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def append(self, level, time, message):
+        with self._lock:
+            self._seq += 1
+            self._records.append({'seq': self._seq, 'time': time, 'level': level, 'message': message})
+
+    def since(self, seq=0, min_level=logging.NOTSET, limit=None):
+        """Records with seq > `seq` and level >= `min_level`, oldest first.
+
+        Returns (records, last_seq); pass last_seq as the next `seq` to get only newer
+        records, even if this read filtered everything out.
+        """
+        with self._lock:
+            last_seq = self._seq
+            if not self._records:
+                return [], last_seq
+            # seqs in the deque are contiguous, so the first unseen record is at a fixed offset.
+            start = max(0, seq - self._records[0]['seq'] + 1)
+            records = list(islice(self._records, start, None))
+        if min_level > logging.NOTSET:
+            records = [r for r in records if logging.getLevelName(r['level']) >= min_level]
+        if limit is not None:
+            records = records[-limit:] if limit > 0 else []
+        return records, last_seq
+
+
+class SharedLogBuffer(LogRingBuffer):
+    """A LogRingBuffer that every API worker (process) appends to and reads from.
+
+    Records go to an append-only JSON-lines file at `path`, numbered under an flock on
+    `<path>.lock` so all workers share one seq sequence. append() only queues the
+    record; one writer thread per buffer numbers and writes whatever queued up every
+    FLUSH_INTERVAL seconds, in one locked write over a file descriptor kept open. Each
+    worker tails the file into its in-memory ring on read, so a read only parses what
+    was appended since the last one (a record shows up once it's flushed). Once the
+    file holds twice `capacity` records it is rewritten with the last `capacity`. If
+    the file can't be written, the buffer carries on in memory only.
+    """
+
+    FLUSH_INTERVAL = 0.2
+
+    def __init__(self, capacity, path):
+        super().__init__(capacity)
+        self.capacity = capacity
+        self.path = path
+        self._file = None
+        self._inode = None
+        self._offset = 0
+        self._lines = 0
+        self._lock_fd = None
+        self._append_fd = None
+        self._queue = deque()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._writer = None
+
+    @property
+    def last_seq(self):
+        self._refresh()
+        return self._seq
+
+    def since(self, seq=0, min_level=logging.NOTSET, limit=None):
+        self._refresh()
+        return super().since(seq, min_level, limit)
+
+    def _refresh(self):
+        with self._lock:
+            if self.path:
+                try:
+                    self._sync()
+                except OSError:
+                    pass  # keep serving what's buffered; the next read retries
+
+    def _sync(self):
+        """Read records appended since the last sync. Caller holds self._lock."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if self._file is None or st.st_ino != self._inode or st.st_size < self._offset:
+            # First read, or another worker compacted the file: start over, skipping seen seqs.
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path, 'rb')
+            self._inode = os.fstat(self._file.fileno()).st_ino
+            self._offset = 0
+            self._lines = 0
+        self._file.seek(self._offset)
+        chunk = self._file.read()
+        # Writers append whole batches in one write; a partial last line is read next time.
+        end = chunk.rfind(b'\n') + 1
+        self._offset += end
+        for line in chunk[:end].splitlines():
+            if not line:
+                continue
+            self._lines += 1
+            record = json.loads(line)
+            if record['seq'] <= self._seq:
+                continue
+            if record['seq'] != self._seq + 1:
+                # Fell behind a compaction: the ring's seqs must stay contiguous.
+                self._records.clear()
+            self._records.append(record)
+            self._seq = record['seq']
+
+    def append(self, level, time, message):
+        if not self.path:
+            super().append(level, time, message)
+            return
+        self._queue.append((level, time, message))
+        if self._writer is None:
+            with self._flush_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="log-store", daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        while self.path:
+            self._wake.wait(self.FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write every queued record now (the writer thread does this every FLUSH_INTERVAL)."""
+        failed = None
+        with self._flush_lock:
+            batch = []
+            while self._queue:
+                batch.append(self._queue.popleft())
+            if not batch:
+                return
+            if not self.path:
+                for record in batch:
+                    super().append(*record)
+                return
+            try:
+                self._write_batch(batch)
+            except OSError as e:
+                failed = e
+                with self._lock:
+                    self.path = None
+                for record in batch:
+                    super().append(*record)
+        if failed is not None:
+            # Logged after the path is cleared, so this record stays in memory.
+            logging.warning(f"Log store not writable, keeping logs in this worker only: {failed}")
+
+    def _write_batch(self, batch):
+        if self._lock_fd is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._lock_fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            with self._lock:
+                # Another worker may have compacted (replaced) the file since our last write.
+                if self._append_fd is None or os.fstat(self._append_fd).st_ino != self._path_inode():
+                    if self._append_fd is not None:
+                        os.close(self._append_fd)
+                    self._append_fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self._sync()
+                seq = self._seq
+                lines = []
+                for level, time, message in batch:
+                    seq += 1
+                    record = {'seq': seq, 'time': time, 'level': level, 'message': message}
+                    lines.append(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+                os.write(self._append_fd, b''.join(lines))
+                self._sync()
+                if self._lines >= 2 * self.capacity:
+                    self._compact()
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _path_inode(self):
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def _compact(self):
+        """Rewrite the file with just the ring's records. Caller holds both locks."""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(b''.join(json.dumps(r, separators=(',', ':')).encode() + b'\n' for r in self._records))
+        os.replace(temp_path, self.path)
+        os.close(self._append_fd)
+        self._append_fd = os.open(self.path, os.O_WRONLY | os.O_APPEND, 0o644)
+        self._sync()
+
+
+class RingBufferHandler(logging.Handler):
+    """Logging handler that appends to a LogRingBuffer."""
+
+    def __init__(self, buffer):
+        super().__init__()
+        self.buffer = buffer
+
+    def emit(self, record):
+        try:
+            self.buffer.append(record.levelname, record.created, self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class DecisionFilter(logging.Filter):
+    """Passes only records from the decisions logger (or, with exclude, everything else).
+
+    Excluding still lets decision warnings through, so an inconclusive hardlink check
+    shows up in the main console.
+    """
+
+    def __init__(self, exclude=False):
+        super().__init__()
+        self.exclude = exclude
+
+    def filter(self, record):
+        is_decision = record.name == DECISIONS_LOGGER or record.name.startswith(DECISIONS_LOGGER + '.')
+        if self.exclude:
+            return not is_decision or record.levelno >= logging.WARNING
+        return is_decision
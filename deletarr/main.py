@@ -1,9 +1,20 @@
 import os
 import logging
+import re
 import sys
-from .config import load_config, setup_logging, get_version, ConfigError
-from .clients import QbitClient
-from .processor import process_service
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .config import ConfigStore, setup_logging, get_version, ConfigError
+from .clients import ClientRegistry, COMPLETED_STATES
+from .processor import process_service, verify_candidate
+from .library import LibraryIndexCache
+from .decisions import DecisionCache
+from .checkpoint import RunBudget, RunCheckpoint
+from .plans import PlanStore, plan_inputs
+from .progress import NO_PROGRESS
+from .metrics import metrics, reset_peak_rss, peak_rss_bytes
+
+_PHASE_SUM = re.compile(r'^deletarr_phase_seconds_sum\{.*phase="([^"]+)"')
 
 def print_summary(deletions_map, dry_run):
     print("\n" + "="*50)
@@ -32,95 +43,298 @@ def print_summary(deletions_map, dry_run):
         print(f"Result: {total_deletions} torrents {status}.")
     print("="*50 + "\n")
 
-def run_deletarr(config_path=None, dry_run=None):
-    """
-    Core function to run the process.
-    dry_run override allowed for API manual runs.
-    Returns the results dictionary.
-    """
+def _record_run(before, started, dry_run, result):
+    """Record the run-level metrics and return this run's share of all metrics."""
+    duration = time.perf_counter() - started
+    metrics.inc('deletarr_runs_total', dry_run='unknown' if dry_run is None else str(bool(dry_run)).lower(),
+                result='success' if result.get('success') else 'failure')
+    # Counters and timings only; the last-run gauges are set afterwards.
+    run_metrics = metrics.diff(before, metrics.snapshot())
+    metrics.set('deletarr_last_run_timestamp_seconds', time.time())
+    metrics.set('deletarr_last_run_duration_seconds', round(duration, 6))
+    # Since reset_peak_rss() at the start of the run, where the platform allows it.
+    peak_rss = peak_rss_bytes()
+    metrics.set('deletarr_last_run_peak_rss_bytes', peak_rss)
+    phases = {}
+    for name, value in run_metrics.items():
+        match = _PHASE_SUM.match(name)
+        if match:
+            phases[match.group(1)] = phases.get(match.group(1), 0) + value
+    for phase, seconds in phases.items():
+        metrics.set('deletarr_last_run_phase_seconds', round(seconds, 6), phase=phase)
+    run_metrics['duration_seconds'] = round(duration, 6)
+    run_metrics['peak_rss_bytes'] = peak_rss
+    result['metrics'] = run_metrics
+    logging.info(f"Run took {duration:.1f}s, peak RSS {peak_rss / 2**20:.0f} MB")
+    return result
+
+def _resolve_config_store(config_path, config_store):
+    if config_store is not None:
+        return config_store
     if not config_path:
         config_path = os.environ.get('DELETARR_CONFIG')
         if not config_path:
             default_config = './config/config.yml'
             docker_config = '/config/config.yml'
             config_path = docker_config if os.path.exists(docker_config) else default_config
+    return ConfigStore(config_path)
+
+def _load_config(config_store, progress):
+    progress.set_phase('loading_config')
+    # One validated snapshot for the whole run; the store only re-parses when the
+    # file changed, and a config swapped in mid-run doesn't affect this one.
+    with metrics.timer('config_load'):
+        config = config_store.get()
+        # No-op unless the logging section changed since it was last applied.
+        setup_logging(config.logging)
+    logging.info(f'Deletarr version: {get_version()}')
+    return config
+
+def _refresh(config, services, clients, cache_dir, progress):
+    """{download client name: QbitClient} for the services, each with a fresh snapshot."""
+    progress.set_phase('fetching_torrents')
+    qbits = {}
+    for service_config in services:
+        name = service_config.download_client
+        if name not in qbits:
+            qbits[name] = clients.qbit(config.download_client(name), cache_dir=cache_dir)
+            # One torrent snapshot per client per run, shared by its services.
+            with metrics.timer('torrent_fetch', client=name):
+                qbits[name].refresh()
+    return qbits
+
+def _delete(qbit, hashes, progress):
+    """Delete torrents (with data) and return the hashes that are actually gone."""
+    if not hashes:
+        logging.info(f"[{qbit.cfg.name}] No deletions to perform.")
+        return []
+    logging.info(f"[{qbit.cfg.name}] Performing actual deletion of {len(hashes)} torrents...")
+    progress.set_phase('deleting')
+    progress.add_total('deletions_done', len(hashes))
+    with metrics.timer('delete'):
+        deleted_hashes = qbit.delete_torrents(hashes, delete_data=True, progress=progress)
+    failed = len(hashes) - len(deleted_hashes)
+    metrics.inc('deletarr_deletions_total', len(deleted_hashes), result='ok')
+    if failed:
+        metrics.inc('deletarr_deletions_total', failed, result='failed')
+        logging.warning(f"[{qbit.cfg.name}] Deletions completed: {len(deleted_hashes)} succeeded, {failed} failed.")
+    else:
+        logging.info(f"[{qbit.cfg.name}] Deletions completed: {len(deleted_hashes)} succeeded.")
+    return deleted_hashes
+
+def _delete_per_client(config, qbits, summary, progress):
+    """Delete each service's torrents through its own download client; returns the deleted hashes."""
+    hashes_by_client = {name: [] for name in qbits}
+    for service_name, torrents in summary.items():
+        hashes_by_client[config.service(service_name).download_client].extend(t['hash'] for t in torrents)
+    return [h for name, hashes in hashes_by_client.items() for h in _delete(qbits[name], hashes, progress)]
+
+def _failure(e):
+    if isinstance(e, ConfigError):
+        # Config not yet loaded so logging may not be configured — print plus best-effort log.
+        print(f"Deletarr: {e}")
+        logging.error(str(e))
+        return {"success": False, "error": str(e)}
+    # Some libraries (e.g. qbittorrent-api's LoginFailed) raise with an empty message.
+    # Fall back to the class name so the user gets *something* actionable.
+    error_msg = str(e) or type(e).__name__
+    logging.error(f"Run failed: {error_msg}")
+    logging.debug("Traceback:", exc_info=True)
+    return {"success": False, "error": error_msg}
+
+def run_deletarr(config_path=None, dry_run=None, live_indexes=None, clients=None, progress=None, config_store=None):
+    """
+    Core function to run the process.
+    dry_run override allowed for API manual runs.
+    live_indexes is the API process's LibraryWatcher, if library_watch is enabled.
+    clients is a long-lived ClientRegistry to reuse (the API keeps one so sessions stay
+    logged in and the torrent snapshot only syncs deltas); otherwise a fresh one is used.
+    config_store is the API's cached ConfigStore; otherwise config_path is read once.
+    progress is a RunProgress the caller can poll while the run is going.
+    Enabled services run concurrently, up to parallel_services at a time, each against
+    its own download client; results and the max_delete_percent gate stay per service.
+    Returns the results dictionary; its `metrics` key holds what this run added to the
+    process-wide metrics (see metrics.py). A dry run also saves its candidates as a
+    plan and returns its `plan_id` for apply_plan.
+    With a `budget` configured, a run that uses it up stops evaluating, checkpoints its
+    verdicts and returns `complete: False` with the unfinished services in `pending`;
+    nothing is deleted (and no plan made) until a later run completes the pass.
+    """
+    started = time.perf_counter()
+    before = metrics.snapshot()
+    reset_peak_rss()
+    if progress is None:
+        progress = NO_PROGRESS
+    config_store = _resolve_config_store(config_path, config_store)
 
     try:
-        # Load config each time to catch changes
-        config = load_config(config_path)
-        # If logging already setup, this might be redundant but harmless usually
-        # For a long running app, we set up logging once at startup,
-        # but here we might need to ensure we capture it.
-        setup_logging(config['logging'])
+        config = _load_config(config_store, progress)
+        budget = RunBudget(config.budget.max_seconds, config.budget.max_files) if config.budget.limited else None
 
-        version = get_version()
-        logging.info(f'Deletarr version: {version}')
+        if clients is None:
+            clients = ClientRegistry()
+        for service_config in config.services:
+            if not service_config.enabled:
+                logging.info(f'[{service_config.name}] Service is disabled. Skipping.')
+        services = [s for s in config.services if s.enabled]
+        qbits = _refresh(config, services, clients, config_store.cache_dir, progress)
 
-        qbit = QbitClient(config['qBittorrent'])
-        
         # Allow override, otherwise use config
         if dry_run is None:
-            dry_run = config.get('dry_run', True)
+            dry_run = config.dry_run
         
         if dry_run:
             logging.info("Dry run is ENABLED. No actual deletions will be performed.")
 
-        deletions_map = {}
-        for service_name in ['Radarr', 'Sonarr']:
-            if service_name in config:
-                service_config = config[service_name]
-                if service_config.get('enabled', True):
-                    logging.info(f'[{service_name}] Started processing...')
-                    torrents_to_delete = process_service(service_name, service_config, qbit)
-                    deletions_map[service_name] = torrents_to_delete
-                else:
-                    logging.info(f'[{service_name}] Service is disabled. Skipping.')
-
-        summary_parts = [f"{svc} {len(items)} candidate(s)" for svc, items in deletions_map.items()]
-        logging.info("Run summary: " + (", ".join(summary_parts) if summary_parts else "no services processed"))
+        # Shared across services so a root_folder used by several (or nested in another
+        # one's) is only walked once. Persisted under the config dir so the next run only
+        # rescans changed directories.
+        library_indexes = LibraryIndexCache(cache_dir=config_store.cache_dir, live_indexes=live_indexes,
+                                            roots=[s.root_folder for s in services])
+        decisions = DecisionCache(os.path.join(config_store.cache_dir, 'decisions.json'))
+        candidate_files = {s.name: {} for s in services}
+        # Verdicts of a pass an earlier run's budget cut short; this run picks up from them.
+        checkpoint = RunCheckpoint(os.path.join(config_store.cache_dir, 'checkpoint.json'), plan_inputs(config))
+        if len(checkpoint):
+            logging.info(f"Resuming a pass started {time.strftime('%Y-%m-%d %H:%M', time.localtime(checkpoint.started_at))} "
+                         f"({len(checkpoint)} torrent(s) already decided)")
+
+        def run_service(service_config):
+            service_name = service_config.name
+            logging.info(f'[{service_name}] Started processing...')
+            arr = clients.arr(service_name, service_config)
+            return process_service(service_name, service_config, qbits[service_config.download_client],
+                                   library_indexes, progress, arr, decisions, candidate_files[service_name],
+                                   budget, checkpoint)
 
-        # Perform actual deletions if not dry run
-        deleted_hashes = []
-        if not dry_run:
-            all_hashes = []
-            for torrents in deletions_map.values():
-                all_hashes.extend([t['hash'] for t in torrents])
-
-            if all_hashes:
-                logging.info(f"Performing actual deletion of {len(all_hashes)} torrents...")
-                deleted_hashes = qbit.delete_torrents(all_hashes, delete_data=True)
-                failed = len(all_hashes) - len(deleted_hashes)
-                if failed:
-                    logging.warning(f"Deletions completed: {len(deleted_hashes)} succeeded, {failed} failed.")
-                else:
-                    logging.info(f"Deletions completed: {len(deleted_hashes)} succeeded.")
+        deletions_map = {}
+        pending = []
+        try:
+            if services:
+                progress.set_phase('evaluating', ', '.join(s.name for s in services))
+                with ThreadPoolExecutor(max_workers=min(config.parallel_services, len(services)),
+                                        thread_name_prefix="service") as pool:
+                    futures = [(s.name, pool.submit(run_service, s)) for s in services]
+                    # In config order, whichever finishes first.
+                    for service_name, future in futures:
+                        torrents_to_delete = future.result()
+                        if torrents_to_delete is None:
+                            pending.append(service_name)
+                        deletions_map[service_name] = torrents_to_delete or []
+        finally:
+            # Also on failure, so an interrupted pass isn't lost.
+            if pending or len(deletions_map) < len(services):
+                checkpoint.save()
             else:
-                logging.info("No deletions to perform.")
+                checkpoint.clear()
+
+        library_scan = library_indexes.scan_stats()
+        decisions.prune(set().union(*(qbit.snapshot.hashes() for qbit in qbits.values())))
+        decisions.save()
+
+        summary_parts = [f"{svc} unfinished" if svc in pending else f"{svc} {len(items)} candidate(s)"
+                         for svc, items in deletions_map.items()]
+        logging.info("Run summary: " + (", ".join(summary_parts) if summary_parts else "no services processed"))
 
-        return {
+        result = {
             "success": True,
             "summary": deletions_map,
             "dry_run": dry_run,
-            "deleted_count": len(deleted_hashes) if not dry_run else 0
-        }
-    except ConfigError as e:
-        # Config not yet loaded so logging may not be configured — print plus best-effort log.
-        print(f"Deletarr: {e}")
-        logging.error(str(e))
-        return {
-            "success": False,
-            "error": str(e)
+            "deleted_count": 0,
+            "library_scan": library_scan,
+            "complete": not pending,
         }
+        if pending:
+            # Deleting only after a full pass keeps max_delete_percent meaningful.
+            logging.info(f"Run budget used up before {', '.join(pending)} finished; "
+                         f"the next run resumes the pass. Nothing is deleted until it completes.")
+            result["pending"] = pending
+        elif dry_run:
+            # What was reviewed is what apply_plan deletes, after re-checking just these torrents.
+            plan = PlanStore(os.path.join(config_store.cache_dir, 'plans')).create(plan_inputs(config), {
+                service_name: [{'hash': t['hash'], 'name': t['name'],
+                                'files': candidate_files[service_name].get(t['hash'], [])}
+                               for t in torrents]
+                for service_name, torrents in deletions_map.items()
+            })
+            result["plan_id"] = plan['id'] if plan else None
+        else:
+            result["deleted_count"] = len(_delete_per_client(config, qbits, deletions_map, progress))
+        return _record_run(before, started, dry_run, result)
     except Exception as e:
-        # Some libraries (e.g. qbittorrent-api's LoginFailed) raise with an empty message.
-        # Fall back to the class name so the user gets *something* actionable.
-        error_msg = str(e) or type(e).__name__
-        logging.error(f"Run failed: {error_msg}")
-        logging.debug("Traceback:", exc_info=True)
-        return {
-            "success": False,
-            "error": error_msg
-        }
+        return _record_run(before, started, dry_run, _failure(e))
+
+def apply_plan(plan_id, config_path=None, live_indexes=None, clients=None, progress=None, config_store=None):
+    """
+    Delete exactly the candidates a dry run saved as plan `plan_id`.
+    Each candidate is re-checked first: the torrent must still be in qBittorrent, in
+    the service's category and completed, and every file must stat the same as during the dry run (and still not be linked into
+    the library); anything else is kept and reported under `dropped`. Fails if the plan
+    is unknown or expired, or if the services config changed since it was made.
+    Other arguments as for run_deletarr; the result has the same shape plus `plan_id`
+    and `dropped` ({service: [{hash, name, reason}]}).
+    """
+    started = time.perf_counter()
+    before = metrics.snapshot()
+    reset_peak_rss()
+    if progress is None:
+        progress = NO_PROGRESS
+    config_store = _resolve_config_store(config_path, config_store)
+
+    try:
+        config = _load_config(config_store, progress)
+        plans = PlanStore(os.path.join(config_store.cache_dir, 'plans'))
+        plan = plans.get(plan_id)
+        if plan is None:
+            raise ValueError(f"Plan {plan_id} not found or expired; run a new dry run")
+        if plan['inputs'] != plan_inputs(config):
+            raise ValueError(f"The configuration changed since plan {plan_id} was made; run a new dry run")
+
+        if clients is None:
+            clients = ClientRegistry()
+        services = [config.service(service_name) for service_name in plan['services']]
+        qbits = _refresh(config, services, clients, config_store.cache_dir, progress)
+
+        progress.set_phase('verifying')
+        library_indexes = LibraryIndexCache(cache_dir=config_store.cache_dir, live_indexes=live_indexes,
+                                            roots=[s.root_folder for s in services])
+        verified, dropped = {}, {}
+        with metrics.timer('plan_verify'):
+            for service_name, candidates in plan['services'].items():
+                service_config = config.service(service_name)
+                verified[service_name] = []
+                snapshot = qbits[service_config.download_client].snapshot
+                for candidate in candidates:
+                    torrent = snapshot.get(candidate['hash'])
+                    if torrent is None:
+                        reason = f"no longer in {service_config.download_client}"
+                    elif torrent.category != service_config.category:
+                        reason = f"its category is now '{torrent.category}', not '{service_config.category}'"
+                    elif torrent.state not in COMPLETED_STATES:
+                        reason = f"its state is now '{torrent.state}', not completed"
+                    else:
+                        reason = verify_candidate(candidate['files'], service_config, library_indexes)
+                    if reason:
+                        logging.warning(f"[{service_name}] KEEP '{candidate['name']}' (planned, but {reason})")
+                        dropped.setdefault(service_name, []).append(
+                            {'hash': candidate['hash'], 'name': candidate['name'], 'reason': reason})
+                    else:
+                        verified[service_name].append({'hash': candidate['hash'], 'name': candidate['name']})
+
+        logging.info(f"Plan {plan_id}: {sum(len(v) for v in verified.values())} candidate(s) verified, "
+                     f"{sum(len(d) for d in dropped.values())} kept")
+        deleted_hashes = _delete_per_client(config, qbits, verified, progress)
+        plans.discard(plan_id)
+        return _record_run(before, started, False, {
+            "success": True,
+            "summary": verified,
+            "dry_run": False,
+            "deleted_count": len(deleted_hashes),
+            "plan_id": plan_id,
+            "dropped": dropped,
+        })
+    except Exception as e:
+        return _record_run(before, started, False, _failure(e))
 
 def main():
     # CLI entry point
@@ -128,6 +342,10 @@ def main():
     if not results.get('success'):
         print(f"Deletarr run failed: {results.get('error', 'unknown error')}")
         sys.exit(1)
+    if not results.get('complete', True):
+        print(f"Run budget used up before {', '.join(results['pending'])} finished; "
+              f"run again to resume the pass. Nothing was deleted.")
+        return
     print_summary(results['summary'], results['dry_run'])
 
 if __name__ == "__main__":
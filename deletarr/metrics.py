@@ -0,0 +1,186 @@
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets (seconds, upper bounds).
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HARDLINK_CHECK_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+
+# name -> (type, help) for the # HELP / # TYPE lines of /metrics.
+METRIC_DEFINITIONS = {
+    'deletarr_runs_total': ('counter', "Runs finished, by dry_run and result."),
+    'deletarr_last_run_timestamp_seconds': ('gauge', "When the last run finished (unix time)."),
+    'deletarr_last_run_duration_seconds': ('gauge', "Wall time of the last run."),
+    'deletarr_phase_seconds': ('summary', "Time spent per run phase (config_load, torrent_fetch, file_list_fetch, library_scan, hardlink_check, plan_verify, delete)."),
+    'deletarr_last_run_phase_seconds': ('gauge', "Time spent per phase in the last run."),
+    'deletarr_last_run_peak_rss_bytes': ('gauge', "Peak resident memory during the last run (process peak where it can't be reset)."),
+    'deletarr_torrents_evaluated_total': ('counter', "Torrents evaluated, by service and decision."),
+    'deletarr_decision_cache_total': ('counter', "Decision cache lookups for aged torrents, by service and result (hit/miss)."),
+    'deletarr_files_checked_total': ('counter', "Torrent files checked for hardlinks, by service."),
+    'deletarr_hardlink_check_seconds': ('histogram', "Per-file hardlink lookup time (library scans excluded)."),
+    'deletarr_deletions_total': ('counter', "Torrent deletions, by result."),
+    'deletarr_http_requests_total': ('counter', "HTTP requests to backends, by backend and status code."),
+    'deletarr_http_request_seconds': ('histogram', "HTTP response time (until headers) per backend."),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (f'{k}="{_escape(v)}"' for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metrics:
+    """In-process counters, gauges, summaries and histograms.
+
+    Deliberately tiny (no prometheus_client dependency): values live in dicts keyed by
+    (name, labels) behind one lock, and render() writes the Prometheus text format.
+    snapshot()/diff() let a run report just its own share of the totals.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}      # counters and gauges: (name, labels) -> float
+        self._summaries = {}   # (name, labels) -> [count, sum]
+        self._histograms = {}  # (name, labels) -> [bucket counts..., count, sum]
+        self._buckets = {}     # name -> bucket bounds
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, _label_key(labels))] = value
+
+    def observe(self, name, seconds, count=1, **labels):
+        """Add to a summary; count > 1 records a batch whose total is `seconds`."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            entry = self._summaries.setdefault(key, [0, 0.0])
+            entry[0] += count
+            entry[1] += seconds
+
+    def observe_histogram(self, name, value, buckets, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._buckets.setdefault(name, buckets)
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [0] * len(buckets) + [0, 0.0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += 1
+            entry[-1] += value
+
+    @contextmanager
+    def timer(self, phase, **labels):
+        """Time a block into deletarr_phase_seconds{phase=...}."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('deletarr_phase_seconds', time.perf_counter() - started, phase=phase, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            flat = {}
+            for (name, key), value in self._values.items():
+                flat[name + _format_labels(key)] = value
+            for (name, key), (count, total) in self._summaries.items():
+                flat[name + '_count' + _format_labels(key)] = count
+                flat[name + '_sum' + _format_labels(key)] = total
+            for (name, key), entry in self._histograms.items():
+                flat[name + '_count' + _format_labels(key)] = entry[-2]
+                flat[name + '_sum' + _format_labels(key)] = entry[-1]
+            return flat
+
+    @staticmethod
+    def diff(before, after):
+        """What changed between two snapshots (counters, summary/histogram count and sum)."""
+        changed = {}
+        for name, value in after.items():
+            delta = value - before.get(name, 0)
+            if delta:
+                changed[name] = round(delta, 6) if isinstance(delta, float) else delta
+        return changed
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            by_name = {}
+            for (name, key), value in sorted(self._values.items()):
+                by_name.setdefault(name, []).append(f"{name}{_format_labels(key)} {value}")
+            for (name, key), (count, total) in sorted(self._summaries.items()):
+                lines = by_name.setdefault(name, [])
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            for (name, key), entry in sorted(self._histograms.items()):
+                lines = by_name.setdefault(name, [])
+                for bound, count in zip(self._buckets[name], entry):
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', repr(float(bound)))])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {entry[-2]}")
+                lines.append(f"{name}_count{_format_labels(key)} {entry[-2]}")
+                lines.append(f"{name}_sum{_format_labels(key)} {entry[-1]}")
+        out = []
+        for name in sorted(by_name):
+            kind, help_text = METRIC_DEFINITIONS.get(name, ('untyped', ''))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(by_name[name])
+        return '\n'.join(out) + '\n'
+
+
+# Process-wide registry: the API serves it at /metrics; each run reports its own delta.
+metrics = Metrics()
+
+
+def http_response_hook(backend):
+    """requests response hook that records latency and status for `backend`."""
+    def hook(response, *args, **kwargs):
+        metrics.inc('deletarr_http_requests_total', backend=backend, status=response.status_code)
+        metrics.observe_histogram('deletarr_http_request_seconds', response.elapsed.total_seconds(),
+                                  HTTP_BUCKETS, backend=backend)
+    return hook
+
+
+def reset_peak_rss():
+    """Start a new peak-RSS window. False where the peak can't be reset (non-Linux).
+
+    Writing 5 to /proc/self/clear_refs resets the kernel's high-water mark (VmHWM), so
+    peak_rss_bytes() then reports the peak since this call rather than since startup.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """Peak resident set size since the last reset_peak_rss() (or process start)."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
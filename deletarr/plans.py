@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from dataclasses import asdict
+
+# A plan can be applied this long after the dry run that made it; after that a new
+# dry run is needed.
+PLAN_MAX_AGE = 6 * 60 * 60
+# Most recent plans kept on disk; older ones are removed when a new one is saved.
+MAX_PLANS = 10
+
+_PLAN_ID = re.compile(r'^[0-9a-f]{12}$')
+
+
+def plan_inputs(config):
+    """Fingerprint of the config a plan depends on (qBittorrent names and URLs, service sections).
+
+    Logging, schedule, parallelism and the global dry_run flag don't change which
+    torrents a run picks, so editing them doesn't invalidate a plan.
+    """
+    data = {'download_clients': [[c.name, c.url] for c in config.download_clients],
+            'services': [asdict(s) for s in config.services]}
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class PlanStore:
+    """Dry-run plans persisted as one JSON file each under `directory`.
+
+    A plan is what a dry run decided to delete, per service: each candidate's hash and
+    name plus the path and stat fingerprint of every file that was checked. Applying a
+    plan re-verifies exactly those torrents instead of re-running the pipeline.
+    """
+
+    def __init__(self, directory, max_age=PLAN_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+
+    def _path(self, plan_id):
+        return os.path.join(self.directory, f"{plan_id}.json")
+
+    def create(self, inputs, services):
+        """Save a new plan and return it. services: {name: [{hash, name, files}, ...]}."""
+        plan = {
+            'id': uuid.uuid4().hex[:12],
+            'created_at': time.time(),
+            'inputs': inputs,
+            'services': services,
+        }
+        path = self._path(plan['id'])
+        temp_path = f"{path}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, 'w') as f:
+                json.dump(plan, f, separators=(',', ':'))
+            os.replace(temp_path, path)
+        except Exception as e:
+            # The dry run itself still succeeded; it just can't be applied by id.
+            logging.warning(f"Could not save plan {plan['id']}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        self._prune()
+        return plan
+
+    def get(self, plan_id):
+        """The plan with this id, or None if it doesn't exist or has expired."""
+        if not isinstance(plan_id, str) or not _PLAN_ID.match(plan_id):
+            return None
+        try:
+            with open(self._path(plan_id), 'r') as f:
+                plan = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable plan {plan_id}: {e}")
+            return None
+        if time.time() - plan.get('created_at', 0) > self.max_age:
+            self.discard(plan_id)
+            return None
+        return plan
+
+    def discard(self, plan_id):
+        try:
+            os.remove(self._path(plan_id))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove plan {plan_id}: {e}")
+
+    def _prune(self):
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith('.json')]
+        except OSError:
+            return
+        plans = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                plans.append((os.stat(path).st_mtime, name[:-len('.json')]))
+            except OSError:
+                continue
+        plans.sort(reverse=True)
+        now = time.time()
+        for i, (mtime, plan_id) in enumerate(plans):
+            if i >= MAX_PLANS or now - mtime > self.max_age:
+                self.discard(plan_id)
@@ -1,74 +1,298 @@
 import os
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from .utils import has_hardlinks_to_folder, HardlinkCheckError
+from .library import LibraryIndexCache, ArrLibrarySource
+from .clients import ArrClient, ARR_FILE_PATH_FETCHERS
+from .progress import NO_PROGRESS
+from .logbuffer import DECISIONS_LOGGER
+from .decisions import DecisionCache, fingerprint
+from .checkpoint import CHECKPOINT_SAVE_INTERVAL, BudgetExhausted
+from .metrics import metrics, HARDLINK_CHECK_BUCKETS
 
+# Per-torrent SKIP/KEEP/CANDIDATE lines; kept out of the API's main log buffer.
+decision_log = logging.getLogger(DECISIONS_LOGGER)
 
-def process_service(service_name, service_config, qbit):
-    root_folder = service_config['root_folder']
-    category = service_config['category']
-    logging.info(f"[{service_name}] Processing category '{category}' with hardlink detection to: {root_folder}")
+# Torrents queued per evaluation worker before file-list intake waits for one to finish.
+EVALUATION_BACKLOG = 4
 
-    # Fail loud and skip the service if the library folder isn't mounted/accessible.
-    # Without this every torrent would look 'unhardlinked' and become a delete candidate.
-    if not os.path.isdir(root_folder):
-        logging.error(f"[{service_name}] root_folder '{root_folder}' does not exist or is not a directory. Skipping service.")
-        return []
+
+def _decision(torrent, decision, reason, seed_days=None, files=None, cached=False, inconclusive=False,
+              resumed=False):
+    return {'torrent': torrent, 'decision': decision, 'reason': reason, 'seed_days': seed_days,
+            'files': files, 'cached': cached, 'inconclusive': inconclusive, 'resumed': resumed}
+
+
+def verify_candidate(files, service_config, library_indexes):
+    """None if a candidate checked earlier can still be deleted, else why it's kept.
+
+    files are the candidate's [[path, fingerprint], ...] from when it was checked.
+    """
+    for path, checked in files:
+        try:
+            stat_info = os.stat(path)
+        except OSError:
+            return "file missing"
+        if fingerprint(stat_info) != checked:
+            return "file changed since it was checked"
+        # Same inode, link count and ctime, so no link was added or removed. Linked files
+        # are still looked up, since a directory moved into the library wouldn't show here.
+        try:
+            if has_hardlinks_to_folder(path, service_config.root_folder, library_indexes,
+                                       service_config.scan_workers, stat_info=stat_info):
+                return "now hardlinked into the library"
+        except HardlinkCheckError as e:
+            return f"hardlink check inconclusive: {e}"
+    return None
+
+
+def evaluate_service(service_name, service_config, qbit, library_indexes=None, progress=NO_PROGRESS, arr=None,
+                     decisions=None, budget=None, checkpoint=None):
+    """Yield one decision per torrent in the service's category, as each is made.
+
+    A decision is a dict: torrent (a clients.Torrent), decision ('skip' | 'keep' | 'candidate'), reason,
+    seed_days, cached (KEEP reused from the decision cache), inconclusive (KEEP because
+    the hardlink check raised), resumed (taken from the run checkpoint) and, for a
+    candidate, files: [[path, fingerprint], ...] with the stat of each file when it was
+    checked. Nothing is deleted here and the max_delete_percent gate is not applied —
+    see process_service.
+
+    Evaluation is pipelined: file lists arrive from qBittorrent (cached, or fetched
+    file_list_workers at a time) while up to scan_workers torrents are stat'd and looked
+    up in the library, so network and disk latency overlap instead of adding up.
+    Decisions come out in completion order, not torrent order.
+
+    Torrents with a verdict in `checkpoint` (a RunCheckpoint) aren't evaluated again. Once
+    `budget` (a RunBudget) is exhausted no new torrent is started, so some torrents get no
+    decision at all; the checkpointed candidates are then not re-verified, and once the
+    evaluations in flight are handed out BudgetExhausted is raised.
+    """
+    root_folder = service_config.root_folder
+    category = service_config.category
+
+    # One library walk per root folder per run; the caller passes a shared cache so
+    # services with the same root_folder reuse the index.
+    if library_indexes is None:
+        library_indexes = LibraryIndexCache()
+    # KEEP verdicts from earlier runs; a hit costs one stat instead of a library lookup.
+    if decisions is None:
+        decisions = DecisionCache()
+    decision_context = [root_folder, service_config.hardlink_detection]
+
+    # hardlink_detection: arr stats only the files the *arr imported; the walk stays
+    # as the fallback whenever that listing looks incomplete.
+    arr_source = None
+    if service_config.hardlink_detection == 'arr':
+        fetch = ARR_FILE_PATH_FETCHERS[service_config.kind]
+        if arr is None:
+            arr = ArrClient(service_config)
+        arr_source = ArrLibrarySource(
+            service_name,
+            lambda: fetch(arr),
+            service_config.arr_path_mappings,
+        )
 
     torrents = qbit.get_torrents([category])
+    progress.add('torrents_fetched', len(torrents))
 
     now = int(time.time())
-    min_seed_days = service_config.get('min_seed_days', 30)
+    min_seed_days = service_config.min_seed_days
+    scan_workers = service_config.scan_workers
     min_age_sec = min_seed_days * 24 * 60 * 60
 
-    service_torrents_to_delete = []
-
+    resumed = checkpoint.verdicts(service_name) if checkpoint is not None else {}
+    aged = {}
+    deferred = []
     for torrent in torrents:
-        name = torrent['name']
-        completion_on = torrent.get('completion_on')
+        completion_on = torrent.completion_on
         if completion_on is None:
-            logging.info(f"[{service_name}] SKIP '{name}' (no completion time)")
+            yield _decision(torrent, 'skip', "no completion time")
             continue
         seed_days = (now - int(completion_on)) / (24 * 60 * 60)
         if now - int(completion_on) < min_age_sec:
-            logging.info(f"[{service_name}] SKIP '{name}' (seeding {seed_days:.1f}d < {min_seed_days}d min)")
+            yield _decision(torrent, 'skip', f"seeding {seed_days:.1f}d < {min_seed_days}d min", seed_days)
             continue
+        verdict = resumed.get(torrent.hash)
+        if verdict is None:
+            aged[torrent.hash] = (torrent, seed_days)
+        elif verdict[0] == 'keep':
+            yield _decision(torrent, 'keep', f"{verdict[1]}; checkpointed", seed_days, resumed=True)
+        else:
+            deferred.append((torrent, seed_days, verdict[2]))
+
+    check_seconds = [0.0]
+    check_lock = threading.Lock()
 
+    def evaluate(torrent, seed_days, torrent_files):
+        if budget is not None:
+            budget.add_files(len(torrent_files))
+        paths = [os.path.join(torrent.save_path, file_name) for file_name in torrent_files]
         try:
-            torrent_files = qbit.client.torrents_files(torrent['hash'])
-        except Exception as e:
-            logging.info(f"[{service_name}] SKIP '{name}' (file list unavailable: {e})")
-            continue
+            if decisions.lookup(torrent.hash, decision_context, paths):
+                metrics.inc('deletarr_decision_cache_total', service=service_name, result='hit')
+                return _decision(torrent, 'keep', f"hardlinked, unchanged since last check, {seed_days:.1f}d seeded",
+                                 seed_days, cached=True)
+            metrics.inc('deletarr_decision_cache_total', service=service_name, result='miss')
+
+            checked = []
+            for torrent_file_path in paths:
+                # Timed per file, minus any library scan the lookup triggered (timed separately).
+                started, scan_before = time.perf_counter(), library_indexes.scan_seconds
+                try:
+                    # Stat'd before the check, so any change after it invalidates the cached verdict.
+                    stat_info = os.stat(torrent_file_path)
+                except OSError:
+                    stat_info = None  # has_hardlinks_to_folder reports it as inconclusive
+                try:
+                    if has_hardlinks_to_folder(torrent_file_path, root_folder, library_indexes, scan_workers,
+                                               arr_source, stat_info):
+                        decisions.keep(torrent.hash, decision_context, torrent_file_path, stat_info)
+                        return _decision(torrent, 'keep', f"hardlinked, {seed_days:.1f}d seeded", seed_days)
+                except HardlinkCheckError as e:
+                    # Uncertainty must fail safe — keep the torrent rather than risk deleting a still-linked file.
+                    decisions.discard(torrent.hash)
+                    return _decision(torrent, 'keep', f"hardlink check inconclusive: {e}", seed_days,
+                                     inconclusive=True)
+                finally:
+                    # Another worker's scan can land inside this window; never report below zero.
+                    elapsed = max(0.0, time.perf_counter() - started - (library_indexes.scan_seconds - scan_before))
+                    with check_lock:
+                        check_seconds[0] += elapsed
+                    metrics.observe_histogram('deletarr_hardlink_check_seconds', elapsed, HARDLINK_CHECK_BUCKETS,
+                                              service=service_name)
+                checked.append([torrent_file_path, fingerprint(stat_info)])
+            return _decision(torrent, 'candidate', f"no hardlinks, {seed_days:.1f}d seeded", seed_days, checked)
+        finally:
+            # Counted per torrent (including files skipped after an early KEEP) so it reaches its total.
+            progress.add('files_checked', len(torrent_files))
+            metrics.inc('deletarr_files_checked_total', len(torrent_files), service=service_name)
 
-        has_hardlinks = False
-        for f in torrent_files:
-            torrent_file_path = os.path.join(torrent['save_path'], f['name'])
-            try:
-                if has_hardlinks_to_folder(torrent_file_path, root_folder):
-                    has_hardlinks = True
-                    break
-            except HardlinkCheckError as e:
-                # Uncertainty must fail safe — keep the torrent rather than risk deleting a still-linked file.
-                logging.warning(f"[{service_name}] KEEP '{name}' (hardlink check inconclusive: {e})")
-                has_hardlinks = True
+    def reverify(torrent, seed_days, files):
+        reason = verify_candidate(files, service_config, library_indexes)
+        if reason:
+            return _decision(torrent, 'keep', f"checkpointed as a candidate, but {reason}", seed_days)
+        return _decision(torrent, 'candidate', f"no hardlinks, {seed_days:.1f}d seeded; checkpointed, re-checked",
+                         seed_days, files)
+
+    progress.add_total('file_lists_fetched', len(aged))
+    backlog = scan_workers * EVALUATION_BACKLOG
+    intake_started = time.perf_counter()
+    cut_short = False
+    with ThreadPoolExecutor(max_workers=scan_workers, thread_name_prefix=f"evaluate-{service_name}") as pool:
+        pending = set()
+        file_lists = qbit.iter_torrent_files(list(aged), progress)
+        for torrent_hash, torrent_files in file_lists:
+            if budget is not None and budget.exhausted():
+                # Closing the generator also cancels file-list fetches not yet started.
+                file_lists.close()
+                cut_short = True
+                logging.info(f"[{service_name}] Run budget used up; {len(aged)} torrent(s) left for the next run")
                 break
+            # Nothing here holds a torrent's file list once its decision is handed out.
+            torrent, seed_days = aged.pop(torrent_hash)
+            if isinstance(torrent_files, Exception) or torrent_files is None:
+                yield _decision(torrent, 'skip', f"file list unavailable: {torrent_files}", seed_days)
+                continue
+            progress.add_total('files_checked', len(torrent_files))
+            pending.add(pool.submit(evaluate, torrent, seed_days, torrent_files))
+            # Hand out whatever has finished; only block while the backlog is full.
+            done = {future for future in pending if future.done()}
+            if len(pending) - len(done) >= backlog:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                yield future.result()
+        # Until the last file list arrived; evaluation overlaps it.
+        metrics.observe('deletarr_phase_seconds', time.perf_counter() - intake_started,
+                        phase='file_list_fetch', service=service_name)
+        # Candidates are only needed when the pass completes, which it can't if the budget cut it short.
+        if deferred and not cut_short:
+            pending.update(pool.submit(reverify, *entry) for entry in deferred)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
 
-        if has_hardlinks:
-            logging.info(f"[{service_name}] KEEP '{name}' (hardlinked, {seed_days:.1f}d seeded)")
-        else:
-            service_torrents_to_delete.append(torrent)
-            logging.info(f"[{service_name}] CANDIDATE '{name}' (no hardlinks, {seed_days:.1f}d seeded)")
+    metrics.observe('deletarr_phase_seconds', check_seconds[0], phase='hardlink_check', service=service_name)
+    if cut_short:
+        raise BudgetExhausted(f"{len(aged) + len(deferred)} torrent(s) of {service_name} left for the next run")
+
+
+def process_service(service_name, service_config, qbit, library_indexes=None, progress=NO_PROGRESS, arr=None,
+                    decisions=None, candidate_files=None, budget=None, checkpoint=None):
+    """Delete candidates for one service (after the max_delete_percent gate).
+
+    Consumes evaluate_service, logging each decision and publishing it to progress as
+    soon as it is made. The percent gate needs the whole category decided, so nothing
+    is returned until the last decision is in. Only candidates are kept until then.
+    Returns the candidates as [{hash, name}, ...] in qBittorrent's order, or None if
+    `budget` ran out before every torrent was decided. KEEP and CANDIDATE verdicts are
+    recorded in `checkpoint` as they are made, so a cut-short pass resumes from them.
+    candidate_files, if given, is filled with {hash: [[path, fingerprint], ...]} for
+    every candidate: the stat of each file at the time it was checked, for a plan.
+    """
+    root_folder = service_config.root_folder
+    category = service_config.category
+    logging.info(f"[{service_name}] Processing category '{category}' with hardlink detection to: {root_folder}")
+
+    # Fail loud and skip the service if the library folder isn't mounted/accessible.
+    # Without this every torrent would look 'unhardlinked' and become a delete candidate.
+    if not os.path.isdir(root_folder):
+        logging.error(f"[{service_name}] root_folder '{root_folder}' does not exist or is not a directory. Skipping service.")
+        return []
+
+    evaluated = 0
+    cached_keeps = 0
+    service_torrents_to_delete = []
+    planned_files = {}
+    try:
+        for decision in evaluate_service(service_name, service_config, qbit, library_indexes, progress, arr,
+                                         decisions, budget, checkpoint):
+            torrent = decision['torrent']
+            evaluated += 1
+            line = f"[{service_name}] {decision['decision'].upper()} '{torrent.name}' ({decision['reason']})"
+            if decision['inconclusive']:
+                decision_log.warning(line)
+            else:
+                decision_log.info(line)
+            cached_keeps += decision['cached']
+            # Inconclusive checks are left for the next run to retry.
+            if (checkpoint is not None and decision['decision'] in ('keep', 'candidate')
+                    and not decision['resumed'] and not decision['inconclusive']):
+                checkpoint.record(service_name, torrent.hash, decision['decision'], decision['reason'],
+                                  decision['files'])
+                checkpoint.save(min_interval=CHECKPOINT_SAVE_INTERVAL)
+            metrics.inc('deletarr_torrents_evaluated_total', service=service_name, decision=decision['decision'])
+            progress.add_decision({'service': service_name, 'hash': torrent.hash, 'name': torrent.name,
+                                   'decision': decision['decision'], 'reason': decision['reason']})
+            if decision['decision'] == 'candidate':
+                service_torrents_to_delete.append(torrent)
+                planned_files[torrent.hash] = decision['files']
+    except BudgetExhausted as e:
+        # No gate and no candidates until a later run finishes the pass.
+        logging.info(f"[{service_name}] Run budget used up after {evaluated} decisions this run; {e}")
+        return None
+
+    if cached_keeps:
+        logging.info(f"[{service_name}] {cached_keeps} KEEP verdicts reused from the decision cache")
 
     # --- SAFETY CHECK: max_delete_percent ---
-    max_delete_percent = service_config.get('max_delete_percent', None)
-    if max_delete_percent is not None and torrents:
-        percent_to_delete = (len(service_torrents_to_delete) / len(torrents)) * 100
+    max_delete_percent = service_config.max_delete_percent
+    if max_delete_percent is not None and evaluated:
+        percent_to_delete = (len(service_torrents_to_delete) / evaluated) * 100
         if percent_to_delete > max_delete_percent:
             logging.error(
-                f"[{service_name}] ABORT (would delete {len(service_torrents_to_delete)}/{len(torrents)} "
+                f"[{service_name}] ABORT (would delete {len(service_torrents_to_delete)}/{evaluated} "
                 f"= {percent_to_delete:.1f}% > max_delete_percent {max_delete_percent}%)"
             )
             return []
-        logging.info(f"[{service_name}] {len(service_torrents_to_delete)}/{len(torrents)} candidates ({percent_to_delete:.1f}%)")
+        logging.info(f"[{service_name}] {len(service_torrents_to_delete)}/{evaluated} candidates ({percent_to_delete:.1f}%)")
 
-    return service_torrents_to_delete
+    if candidate_files is not None:
+        candidate_files.update(planned_files)
+    # Decisions arrive in completion order; return candidates in qBittorrent's order.
+    order = {torrent.hash: i for i, torrent in enumerate(qbit.get_torrents([category]))}
+    service_torrents_to_delete.sort(key=lambda t: order.get(t.hash, 0))
+    return [{'hash': t.hash, 'name': t.name} for t in service_torrents_to_delete]
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import deque
+
+# Most recent per-torrent decisions a RunProgress keeps for streaming.
+MAX_DECISIONS = 2000
+
+
+class RunProgress:
+    """Per-phase progress counters for one run.
+
+    Updated from the run thread and its worker pools, read by the API while the run is
+    still going. Every change bumps `version`, so pollers can tell whether anything moved.
+    Per-torrent decisions are kept seq-numbered (the last MAX_DECISIONS) so a stream can
+    send just the new ones.
+    """
+
+    COUNTERS = ('torrents_fetched', 'file_lists_fetched', 'files_checked', 'deletions_done')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phase = 'starting'
+        self.service = None
+        self.counters = {name: 0 for name in self.COUNTERS}
+        self.totals = {}
+        self.decisions = deque(maxlen=MAX_DECISIONS)
+        self.decision_seq = 0
+        self.updated_at = time.time()
+        self.version = 0
+
+    def _touch(self):
+        self.updated_at = time.time()
+        self.version += 1
+
+    def set_phase(self, phase, service=None):
+        with self._lock:
+            self.phase = phase
+            self.service = service
+            self._touch()
+
+    def add(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+            self._touch()
+
+    def add_total(self, counter, n):
+        """Grow the expected total for a counter (services add theirs as they start)."""
+        with self._lock:
+            self.totals[counter] = self.totals.get(counter, 0) + n
+            self._touch()
+
+    def add_decision(self, decision):
+        """Record one decision ({service, hash, name, decision, reason})."""
+        with self._lock:
+            self.decision_seq += 1
+            self.decisions.append(dict(decision, seq=self.decision_seq))
+            self._touch()
+
+    def decisions_since(self, seq):
+        with self._lock:
+            return [d for d in self.decisions if d['seq'] > seq]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'phase': self.phase,
+                'service': self.service,
+                'counters': dict(self.counters),
+                'totals': dict(self.totals),
+                'updated_at': self.updated_at,
+            }
+
+
+class _NoProgress:
+    """Stand-in when nobody is watching (CLI runs)."""
+
+    def set_phase(self, phase, service=None):
+        pass
+
+    def add(self, counter, n=1):
+        pass
+
+    def add_total(self, counter, n):
+        pass
+
+    def add_decision(self, decision):
+        pass
+
+
+NO_PROGRESS = _NoProgress()
@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from .jobs import RunInProgress
+
+# How far ahead next_run() searches before declaring a cron expression unsatisfiable
+# (e.g. "0 0 31 2 *").
+_CRON_SEARCH_DAYS = 366 * 5
+# With a config store, the scheduler also checks config.yml for hand edits this often.
+CONFIG_POLL_SECONDS = 60
+
+
+class ScheduleError(ValueError):
+    """Raised for an invalid `schedule` config section."""
+
+
+def _parse_cron_field(field, low, high, name):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_str = part.split('/', 1)
+            if not step_str.isdigit() or int(step_str) < 1:
+                raise ScheduleError(f"Invalid step in cron {name} field: '{field}'")
+            step = int(step_str)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            a, b = part.split('-', 1)
+            if not (a.isdigit() and b.isdigit()):
+                raise ScheduleError(f"Invalid range in cron {name} field: '{field}'")
+            start, end = int(a), int(b)
+        elif part.isdigit():
+            start = int(part)
+            end = high if step > 1 else start
+        else:
+            raise ScheduleError(f"Invalid cron {name} field: '{field}'")
+        if start < low or end > high or start > end:
+            raise ScheduleError(f"Cron {name} field out of range {low}-{high}: '{field}'")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """Standard 5-field cron expression: minute hour day-of-month month day-of-week.
+
+    Supports *, lists, ranges and steps. Day-of-week is 0-7 with 0 and 7 both Sunday.
+    As in cron, when both day fields are restricted a day matches if either does.
+    Times are local to the container (set TZ).
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ScheduleError(f"Cron expression must have 5 fields: '{expression}'")
+        self.expression = expression
+        self.minutes = _parse_cron_field(fields[0], 0, 59, 'minute')
+        self.hours = _parse_cron_field(fields[1], 0, 23, 'hour')
+        self.days = _parse_cron_field(fields[2], 1, 31, 'day-of-month')
+        self.months = _parse_cron_field(fields[3], 1, 12, 'month')
+        weekdays = _parse_cron_field(fields[4], 0, 7, 'day-of-week')
+        # cron: 0/7 = Sunday; Python: Monday = 0 ... Sunday = 6
+        self.weekdays = {(d - 1) % 7 for d in weekdays}
+        self._dom_any = fields[2] == '*'
+        self._dow_any = fields[4] == '*'
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        dom = day.day in self.days
+        dow = day.weekday() in self.weekdays
+        if self._dom_any or self._dow_any:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, now):
+        start = (now + timedelta(minutes=1)).replace(second=0, microsecond=0)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(_CRON_SEARCH_DAYS):
+            if self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ScheduleError(f"Cron expression never matches: '{self.expression}'")
+
+    def describe(self):
+        return f"cron '{self.expression}'"
+
+
+class IntervalSchedule:
+    def __init__(self, minutes):
+        if minutes <= 0:
+            raise ScheduleError("schedule.interval_minutes must be positive")
+        self.minutes = minutes
+
+    def next_after(self, now):
+        return now + timedelta(minutes=self.minutes)
+
+    def describe(self):
+        return f"every {self.minutes} min"
+
+
+def parse_schedule(schedule):
+    """Build a schedule from a ScheduleConfig, or None if disabled."""
+    if not schedule.enabled:
+        return None
+    if schedule.cron:
+        return CronSchedule(schedule.cron)
+    if schedule.interval_minutes is not None:
+        return IntervalSchedule(schedule.interval_minutes)
+    raise ScheduleError("schedule needs either 'cron' or 'interval_minutes'")
+
+
+class Scheduler:
+    """Runs scheduled jobs inside the API process.
+
+    Ticks go through the JobManager, so they share the run lock with manual runs and
+    reuse the process's warm clients, snapshots and library indexes. A tick that finds a
+    run still going is skipped, not queued.
+
+    With several API workers each has a Scheduler, but only the one holding
+    `leader_lock` (a FileLock, kept until the worker exits) fires ticks. The leader
+    writes next/last run to `state_path`, and the others report those in status().
+    The others retry the lock every time they check the config, so one takes over if
+    the leader exits; `on_lead` is called (on its own thread) when this worker does.
+    """
+
+    def __init__(self, job_manager, config_store=None, leader_lock=None, state_path=None, on_lead=None):
+        self.job_manager = job_manager
+        self.leader_lock = leader_lock
+        self.state_path = state_path
+        self.on_lead = on_lead
+        self._leading = leader_lock is None
+        # A ConfigStore whose on_change calls configure(); polled so edits made to
+        # config.yml outside the API still reschedule.
+        self.config_store = config_store
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._section = None
+        self.schedule = None
+        self.jitter_seconds = 0
+        self.dry_run = None
+        self.next_run = None
+        self.last_run = None
+
+    def configure(self, config):
+        """Apply config.schedule (already validated); safe to call again after a config change."""
+        section = config.schedule
+        with self._lock:
+            if section == self._section and self._thread is not None:
+                return  # unchanged: keep the pending slot and its jitter
+            self._section = section
+            self.schedule = parse_schedule(section)
+            self.jitter_seconds = section.jitter_seconds if self.schedule else 0
+            # None = use the config's dry_run at run time, like a CLI run.
+            self.dry_run = section.dry_run
+            self.next_run = self._compute_next(datetime.now()) if self.schedule else None
+            if self._lead():
+                if self.schedule:
+                    logging.info(f"Scheduler: {self.schedule.describe()}, next run at {self.next_run:%Y-%m-%d %H:%M:%S}")
+                self._save_state()
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _compute_next(self, now):
+        # Jitter spreads load when several instances share a schedule; never negative,
+        # so a run can't fire before its slot.
+        jitter = random.uniform(0, self.jitter_seconds) if self.jitter_seconds else 0
+        return self.schedule.next_after(now) + timedelta(seconds=jitter)
+
+    @property
+    def leading(self):
+        """Whether this worker is the leader: it fires the ticks (and runs the library watchers)."""
+        return self._leading
+
+    def _lead(self):
+        """Whether this worker fires the ticks (takes the leader lock if it's free). Caller holds self._lock."""
+        if not self._leading and self.leader_lock.acquire(blocking=False):
+            self._leading = True
+            if self.on_lead is not None:
+                # Not under self._lock: the callback may load the config, which reconfigures us.
+                threading.Thread(target=self.on_lead, name="scheduler-lead", daemon=True).start()
+        return self._leading
+
+    def _save_state(self):
+        """Share next/last run with the other workers. Caller holds self._lock."""
+        if not self.state_path:
+            return
+        state = {
+            "next_run": self.next_run.isoformat(timespec='seconds') if self.next_run else None,
+            "last_run": self.last_run,
+        }
+        temp_path = f"{self.state_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.state_path)
+        except Exception as e:
+            logging.warning(f"Scheduler: could not save state {self.state_path}: {e}")
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            if self._leading and self.leader_lock is not None:
+                self.leader_lock.release()
+                self._leading = False
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+                next_run = self.next_run
+            timeout = None if next_run is None else max(0.0, (next_run - datetime.now()).total_seconds())
+            if self.config_store is not None:
+                timeout = CONFIG_POLL_SECONDS if timeout is None else min(timeout, CONFIG_POLL_SECONDS)
+            if self._wake.wait(timeout):
+                self._wake.clear()
+                continue  # reconfigured or stopped: recompute
+            if self.config_store is not None:
+                try:
+                    self.config_store.get()
+                except Exception as e:
+                    logging.warning(f"Scheduler: config reload failed, keeping current schedule: {e}")
+                if self._wake.is_set():
+                    continue
+            with self._lock:
+                leading = not self._stopped and self._lead()
+                if self._stopped or self.next_run is None or datetime.now() < self.next_run:
+                    continue
+                dry_run = self.dry_run
+                self.next_run = self._compute_next(datetime.now())
+            if leading:
+                self._tick(dry_run)
+
+    def _tick(self, dry_run):
+        at = datetime.now().isoformat(timespec='seconds')
+        try:
+            job = self.job_manager.submit(dry_run)
+            logging.info(f"Scheduler: started run job {job.id}")
+            last_run = {"at": at, "job_id": job.id, "skipped": False}
+        except RunInProgress:
+            logging.warning("Scheduler: previous run still in progress; skipping this tick")
+            last_run = {"at": at, "job_id": None, "skipped": True}
+        with self._lock:
+            self.last_run = last_run
+            self._save_state()
+
+    def status(self):
+        with self._lock:
+            next_run = self.next_run.isoformat(timespec='seconds') if self.next_run else None
+            last_run = dict(self.last_run) if self.last_run else None
+            if not self._leading and self.state_path:
+                state = self._load_state()
+                if self.schedule is not None:
+                    next_run = state.get("next_run", next_run)
+                last_run = state.get("last_run")
+            if last_run and last_run.get("job_id"):
+                job = self.job_manager.get(last_run["job_id"], include_result=False)
+                last_run["status"] = job['status'] if job else None
+            return {
+                "enabled": self.schedule is not None,
+                "schedule": self.schedule.describe() if self.schedule else None,
+                "jitter_seconds": self.jitter_seconds,
+                "dry_run": self.dry_run,
+                "next_run": next_run,
+                "last_run": last_run,
+                "leader": self._leading,
+            }
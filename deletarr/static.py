@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:  # in requirements.txt; a bare install without it still serves gzip
+    brotli = None
+
+# Vite writes content-hashed file names under assets/, so a given URL never changes.
+IMMUTABLE_PREFIX = "assets/"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Everything else (index.html first of all) is revalidated with its ETag on every load.
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Smaller files aren't worth a compressed variant; variants that don't save at least
+# a tenth of the size are dropped.
+MIN_COMPRESS_SIZE = 256
+MIN_COMPRESS_RATIO = 0.9
+# Types already compressed (images, fonts, archives) are served as they are.
+_COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/xml",
+                       "application/manifest+json", "image/svg+xml", "application/wasm")
+
+
+class StaticFile:
+    __slots__ = ("content_type", "cache_control", "variants")
+
+    def __init__(self, content_type, cache_control, variants):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        # {encoding ('' for identity): (body, etag)}
+        self.variants = variants
+
+
+def _etag(body, encoding):
+    digest = hashlib.sha256(body).hexdigest()[:20]
+    # Each representation needs its own strong ETag.
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+
+def _compressible(content_type):
+    return content_type.startswith(_COMPRESSIBLE_TYPES)
+
+
+def _build_variants(body, content_type):
+    variants = {"": (body, _etag(body, ""))}
+    if len(body) < MIN_COMPRESS_SIZE or not _compressible(content_type):
+        return variants
+    candidates = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        candidates["br"] = brotli.compress(body, quality=11)
+    for encoding, compressed in candidates.items():
+        if len(compressed) <= len(body) * MIN_COMPRESS_RATIO:
+            variants[encoding] = (compressed, _etag(body, encoding))
+    return variants
+
+
+def accepted_encodings(header):
+    """Encodings the client accepts (q > 0), from an Accept-Encoding header."""
+    accepted = set()
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if token and q > 0:
+            accepted.add(token)
+    return accepted
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match uses weak comparison (a proxy may have turned ours into W/"...")."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class StaticSite:
+    """The built SPA, indexed once into an in-memory route table.
+
+    Every regular file under root is read at startup, with gzip and brotli variants
+    precomputed, so a request is one dict lookup and no filesystem access. Only files whose realpath stays inside root are indexed: a
+    request path can only ever name one of those, which blocks ../ and symlink escapes.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.routes = {}
+        self._index(self.root)
+        self.index_html = self.routes.get("index.html")
+        total = sum(len(f.variants[""][0]) for f in self.routes.values())
+        encodings = sorted({e for f in self.routes.values() for e in f.variants if e})
+        logging.info(
+            f"Indexed {len(self.routes)} frontend files ({total / 1024:.0f} KiB) from {self.root}; "
+            f"precompressed: {', '.join(encodings) or 'none'}"
+        )
+
+    def _index(self, directory):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                real = os.path.realpath(entry.path)
+                if os.path.commonpath([real, self.root]) != self.root:
+                    logging.warning(f"Not serving {entry.path}: it resolves outside {self.root}")
+                    continue
+                if entry.is_dir():
+                    self._index(entry.path)
+                elif entry.is_file():
+                    self._add(entry.path, real)
+
+    def _add(self, path, real):
+        rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+        with open(real, "rb") as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+        cache_control = IMMUTABLE_CACHE_CONTROL if rel.startswith(IMMUTABLE_PREFIX) else REVALIDATE_CACHE_CONTROL
+        self.routes[rel] = StaticFile(content_type, cache_control, _build_variants(body, content_type))
+
+    def lookup(self, path):
+        """The file to serve for a request path: an indexed file, else the SPA's index.html.
+
+        Returns None for a missing hashed asset (a 404 is better than HTML parsed as JS).
+        """
+        static_file = self.routes.get(path)
+        if static_file is not None:
+            return static_file
+        if path.startswith(IMMUTABLE_PREFIX):
+            return None
+        return self.index_html
+
+    @staticmethod
+    def select(static_file, accept_encoding):
+        """(encoding, body, etag) of the best variant the client accepts."""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in static_file.variants and encoding in accepted:
+                return (encoding, *static_file.variants[encoding])
+        return ("", *static_file.variants[""])
@@ -7,42 +7,60 @@ class HardlinkCheckError(Exception):
     Callers must treat this as 'unknown' and keep the torrent."""
 
 
-def has_hardlinks_to_folder(file_path, target_folder):
+class LiveIndexStale(HardlinkCheckError):
+    """Raised by a live (inotify) library index that may have missed events.
+    LibraryIndexCache.find answers from a walk instead."""
+
+
+def has_hardlinks_to_folder(file_path, target_folder, library_indexes=None, scan_workers=1, arr_source=None,
+                            stat_info=None):
     """Check if a file has hardlinks pointing to the target folder (e.g., Radarr/Sonarr media folder).
 
     Returns True if a hardlink is found, False if the source has no hardlinks at all.
     Raises HardlinkCheckError if the check cannot complete (missing target folder, unstat-able
     source, etc.) — callers MUST treat that as 'do not delete this torrent'.
+
+    library_indexes is a LibraryIndexCache. Pass one when checking many files so target_folder
+    is walked once and shared; without it the folder is walked for this call alone.
+    scan_workers is the number of threads used if the folder has to be walked.
+    arr_source (an ArrLibrarySource) checks against the *arr's imported files instead.
+    stat_info is file_path's os.stat result if the caller already has it.
     """
-    # Target folder must exist and be a directory. Otherwise os.walk yields nothing
+    # Target folder must exist and be a directory. Otherwise the walk yields nothing
     # and the function would falsely report 'no hardlinks' for every torrent.
     if not os.path.isdir(target_folder):
         raise HardlinkCheckError(f"Target folder does not exist or is not a directory: {target_folder}")
 
-    try:
-        stat_info = os.stat(file_path)
-    except (OSError, IOError) as e:
-        raise HardlinkCheckError(f"Cannot stat source file {file_path}: {e}") from e
+    if stat_info is None:
+        try:
+            stat_info = os.stat(file_path)
+        except (OSError, IOError) as e:
+            raise HardlinkCheckError(f"Cannot stat source file {file_path}: {e}") from e
 
     # st_nlink == 1 means no hardlinks exist anywhere on this filesystem.
     if stat_info.st_nlink <= 1:
         return False
 
-    inode = stat_info.st_ino
-    device = stat_info.st_dev
-
-    try:
-        for root, dirs, files in os.walk(target_folder):
-            for file_name in files:
-                target_file = os.path.join(root, file_name)
-                try:
-                    target_stat = os.stat(target_file)
-                except (OSError, IOError):
-                    continue  # individual unreadable files are tolerable during the inode scan
-                if target_stat.st_ino == inode and target_stat.st_dev == device:
-                    logging.debug(f"Hardlink found: {file_path} -> {target_file}")
-                    return True
-    except (OSError, IOError) as e:
-        raise HardlinkCheckError(f"Error walking target folder {target_folder}: {e}") from e
+    if library_indexes is None:
+        from .library import LibraryIndexCache
+        library_indexes = LibraryIndexCache()
 
+    linked_path = library_indexes.find(target_folder, stat_info, scan_workers, arr_source)
+    if linked_path is not None:
+        logging.debug(f"Hardlink found: {file_path} -> {linked_path}")
+        return True
     return False
+
+
+def mounts():
+    """[(mount_point, fstype), ...] from /proc/self/mounts ([] if it can't be read)."""
+    result = []
+    try:
+        with open("/proc/self/mounts", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3:
+                    result.append((parts[1].replace("\\040", " "), parts[2]))
+    except OSError:
+        pass
+    return result
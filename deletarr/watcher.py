@@ -0,0 +1,410 @@
+import os
+import stat
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+from .utils import HardlinkCheckError, LiveIndexStale, mounts
+
+# <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (
+    IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+# inotify only sees changes made through this kernel. On network filesystems another
+# host (the NAS, Radarr on a different box) can change the tree without a single event,
+# so a live index there could silently miss a new hardlink.
+_NETWORK_FILESYSTEMS = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "ceph", "glusterfs",
+    "fuse.sshfs", "fuse.rclone", "fuse.glusterfs", "fuse.ceph",
+}
+
+# Seconds to wait before rebuilding after the watch limit was hit (it will usually be hit
+# again until someone raises fs.inotify.max_user_watches); overflow retries immediately.
+_WATCH_LIMIT_BACKOFF = 300
+_REBUILD_BACKOFF = 30
+
+
+class _WatchLimitReached(Exception):
+    pass
+
+
+def _filesystem_type(path):
+    """fstype of the mount containing path, from /proc/self/mounts ('' if unknown)."""
+    path = os.path.realpath(path)
+    best, best_type = "", ""
+    for mount_point, fs_type in mounts():
+        if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) >= len(best):
+            best, best_type = mount_point, fs_type
+    return best_type
+
+
+class _Inotify:
+    """Minimal ctypes binding: one non-blocking inotify instance."""
+
+    _libc = None
+
+    def __init__(self):
+        if _Inotify._libc is None:
+            _Inotify._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = _Inotify._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+
+    def add_watch(self, path):
+        wd = _Inotify._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise _WatchLimitReached(f"inotify watch limit reached at {path} (raise fs.inotify.max_user_watches)")
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        _Inotify._libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        return bool(readable)
+
+    def read_events(self):
+        """All queued events as (wd, mask, name). Empty list when nothing is pending."""
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+class LiveLibraryIndex:
+    """Library inode index for one root folder, kept current by inotify.
+
+    Answers the same find()/contains() calls as LibraryIndex. Whenever events may have
+    been lost (queue overflow, watch limit, root moved or unmounted) the index is marked
+    stale and find() raises LiveIndexStale instead of answering 'no hardlinks'; the
+    run's LibraryIndexCache then walks the root and uses that for the rest of the run.
+    Later runs use the live index again once the watcher has rebuilt it.
+
+    Symlinked files are indexed by their target, resolved when the link appears (or
+    moves) under the library and again by refresh_symlinks(), which LibraryIndexCache
+    calls once per run, so a lookup never re-stats them.
+    """
+
+    def __init__(self, root_folder):
+        self.root_folder = root_folder
+        self.stale_reason = "not built yet"
+        self.retry_after = 0
+        self.unreadable_dirs = []
+        self._lock = threading.RLock()
+        self._inotify = None
+        self._reset()
+
+    def _reset(self):
+        if self._inotify is not None:
+            self._inotify.close()
+        self._inotify = None
+        self._wd_dirs = {}
+        self._dir_wds = {}
+        self._paths = {}
+        self._inodes = {}
+        self._symlinks = set()
+        self.unreadable_dirs = []
+
+    @property
+    def ready(self):
+        return self.stale_reason is None
+
+    @property
+    def scan_stats(self):
+        return {"live": True, "full_rescan": False, "dirs_scanned": 0, "dirs_reused": len(self._dir_wds),
+                "files_scanned": 0, "files_reused": len(self._paths), "unreadable_dirs": len(self.unreadable_dirs)}
+
+    def __len__(self):
+        return len(self._inodes)
+
+    def mark_stale(self, reason, retry_after=0):
+        with self._lock:
+            self.retry_after = retry_after
+            if self.stale_reason is None:
+                logging.warning(f"Live library index for {self.root_folder} is stale ({reason}); runs will walk the library")
+            self.stale_reason = reason
+            self._reset()
+
+    def build(self):
+        """(Re)create all watches and index the tree. Leaves the index stale on failure."""
+        with self._lock:
+            self._reset()
+            self.retry_after = 0
+            fs_type = _filesystem_type(self.root_folder)
+            if fs_type in _NETWORK_FILESYSTEMS:
+                self.stale_reason = f"{fs_type} mount: inotify can't see changes made by other hosts"
+                self.retry_after = None
+                return
+            try:
+                self._inotify = _Inotify()
+                self._watch_tree(self.root_folder, is_root=True)
+            except _WatchLimitReached as e:
+                self.stale_reason = str(e)
+                self.retry_after = _WATCH_LIMIT_BACKOFF
+                self._reset()
+                return
+            except OSError as e:
+                self.stale_reason = str(e)
+                self.retry_after = _REBUILD_BACKOFF
+                self._reset()
+                return
+            self.stale_reason = None
+            logging.info(
+                f"Live library index for {self.root_folder}: watching {len(self._dir_wds)} dirs, "
+                f"{len(self._paths)} files"
+            )
+
+    def _watch_tree(self, top, is_root=False):
+        # Watch before listing: anything created after the listing arrives as an event,
+        # anything created before is in the listing. Duplicates are idempotent.
+        pending = [top]
+        while pending:
+            path = pending.pop()
+            try:
+                wd = self._inotify.add_watch(path)
+                self._wd_dirs[wd] = path
+                self._dir_wds[path] = wd
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError as e:
+                if is_root and path == top:
+                    raise
+                logging.warning(f"Cannot watch library directory {path}: {e}")
+                self.unreadable_dirs.append(path)
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_symlink():
+                        if not entry.is_dir():
+                            self._add_file(entry.path)
+                    elif entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    else:
+                        st = entry.stat(follow_symlinks=False)
+                        self._index(entry.path, (st.st_dev, st.st_ino))
+                except OSError:
+                    continue  # individual unreadable files are tolerable during the inode scan
+
+    def _index(self, path, key):
+        self._remove_path(path)
+        self._paths[path] = key
+        self._inodes.setdefault(key, set()).add(path)
+
+    def _add_file(self, path):
+        try:
+            is_link = stat.S_ISLNK(os.lstat(path).st_mode)
+            st = os.stat(path)
+        except OSError:
+            self._remove_path(path)
+            return
+        if is_link:
+            self._symlinks.add(path)
+        self._index(path, (st.st_dev, st.st_ino))
+
+    def _remove_path(self, path):
+        self._symlinks.discard(path)
+        key = self._paths.pop(path, None)
+        if key is not None:
+            paths = self._inodes.get(key)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._inodes[key]
+
+    def _remove_tree(self, top):
+        prefix = top.rstrip("/") + "/"
+        for path in [p for p in self._paths if p.startswith(prefix)]:
+            self._remove_path(path)
+        for path in [d for d in self._dir_wds if d == top or d.startswith(prefix)]:
+            wd = self._dir_wds.pop(path)
+            self._wd_dirs.pop(wd, None)
+            self._inotify.rm_watch(wd)
+        self.unreadable_dirs = [d for d in self.unreadable_dirs if d != top and not d.startswith(prefix)]
+
+    def _drain(self):
+        """Apply every queued event. Caller holds the lock."""
+        if self._inotify is None:
+            return
+        for wd, mask, name in self._inotify.read_events():
+            if self.stale_reason is not None:
+                return
+            if mask & IN_Q_OVERFLOW:
+                self.mark_stale("inotify event queue overflowed")
+                return
+            directory = self._wd_dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT | IN_IGNORED):
+                if directory == self.root_folder:
+                    self.mark_stale("root folder was moved, deleted or unmounted")
+                    return
+                if mask & IN_IGNORED:
+                    self._wd_dirs.pop(wd, None)
+                    if self._dir_wds.get(directory) == wd:
+                        del self._dir_wds[directory]
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if mask & IN_ISDIR:
+                    if mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._remove_tree(path)
+                    elif mask & (IN_CREATE | IN_MOVED_TO):
+                        self._watch_tree(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._remove_path(path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_file(path)
+            except _WatchLimitReached as e:
+                self.mark_stale(str(e), retry_after=_WATCH_LIMIT_BACKOFF)
+                return
+
+    def pump(self, timeout):
+        """Block up to `timeout` seconds for events, then apply them."""
+        inotify = self._inotify
+        if inotify is None:
+            return
+        try:
+            has_events = inotify.wait(timeout)
+        except (OSError, ValueError):
+            return  # fd closed under us by a rebuild/stale transition
+        if has_events:
+            with self._lock:
+                if self._inotify is inotify:
+                    self._drain()
+
+    def find(self, stat_info):
+        """Library path linked to the stat'd file, or None. Same contract as LibraryIndex.find."""
+        key = (stat_info.st_dev, stat_info.st_ino)
+        with self._lock:
+            # Apply anything the watcher thread hasn't picked up yet, so a link created
+            # just before this check is already visible.
+            self._drain()
+            if self.stale_reason is not None:
+                raise LiveIndexStale(f"Live library index for {self.root_folder} is stale: {self.stale_reason}")
+            paths = self._inodes.get(key)
+            if paths:
+                return next(iter(paths))
+            if self.unreadable_dirs:
+                raise HardlinkCheckError(
+                    f"Library index for {self.root_folder} is incomplete "
+                    f"({len(self.unreadable_dirs)} unreadable director(ies), e.g. {self.unreadable_dirs[0]})"
+                )
+            return None
+
+    def contains(self, stat_info):
+        return self.find(stat_info) is not None
+
+    def refresh_symlinks(self):
+        """Re-resolve every symlink's target: one can be replaced outside the library, without an event here."""
+        with self._lock:
+            self._drain()
+            for path in list(self._symlinks):
+                self._add_file(path)
+
+    def close(self):
+        with self._lock:
+            self.stale_reason = "stopped"
+            self._reset()
+
+
+class LibraryWatcher:
+    """Background inotify watchers, one thread per library root folder.
+
+    Passed to LibraryIndexCache as `live_indexes`: get(root) returns the live index for a
+    root only while it is current, so a stale or rebuilding watcher means a normal walk.
+    """
+
+    def __init__(self):
+        self._watches = {}
+        self._lock = threading.Lock()
+
+    def watch(self, root_folders):
+        """Watch exactly these root folders: start new ones, stop ones no longer listed."""
+        wanted = {os.path.realpath(r) for r in root_folders if r}
+        with self._lock:
+            for key in list(self._watches):
+                if key not in wanted:
+                    self._stop(key)
+            for key in wanted - set(self._watches):
+                live = LiveLibraryIndex(key)
+                stop = threading.Event()
+                thread = threading.Thread(target=self._run, args=(live, stop), name=f"library-watch:{key}", daemon=True)
+                self._watches[key] = (live, stop, thread)
+                thread.start()
+
+    def _stop(self, key):
+        live, stop, _thread = self._watches.pop(key)
+        stop.set()
+        live.close()
+
+    def stop(self):
+        with self._lock:
+            for key in list(self._watches):
+                self._stop(key)
+
+    def _run(self, live, stop):
+        while not stop.is_set():
+            if not live.ready:
+                if live.retry_after:
+                    stop.wait(live.retry_after)
+                    if stop.is_set():
+                        break
+                live.build()
+                if not live.ready and not stop.is_set():
+                    logging.warning(f"Live library index for {live.root_folder} unavailable: {live.stale_reason}")
+                    if live.retry_after is None:
+                        return  # permanent (e.g. network filesystem): runs keep walking
+                continue
+            live.pump(timeout=1.0)
+
+    def get(self, root_folder):
+        with self._lock:
+            watch = self._watches.get(os.path.realpath(root_folder))
+        if watch is None or not watch[0].ready:
+            return None
+        return watch[0]
+
+    def status(self):
+        with self._lock:
+            return {
+                key: {"ready": live.ready, "stale_reason": live.stale_reason, "files": len(live._paths)}
+                for key, (live, _stop, _thread) in self._watches.items()
+            }
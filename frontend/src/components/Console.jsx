@@ -2,28 +2,34 @@ import React, { useState, useEffect, useRef } from 'react'
 import { Terminal, ChevronUp, ChevronDown } from 'lucide-react'
 import { Button } from '@/components/ui/button'
 
+// Client-side cap; the server keeps its own ring buffer.
+const MAX_LINES = 500
+const LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+const LEVEL_COLORS = {
+    DEBUG: 'text-muted-foreground',
+    INFO: 'text-green-400',
+    WARNING: 'text-yellow-400',
+    ERROR: 'text-red-400',
+    CRITICAL: 'text-red-500',
+}
+
 export default function Console() {
     const [logs, setLogs] = useState([])
     const [isOpen, setIsOpen] = useState(false)
+    const [level, setLevel] = useState('INFO')
     const logsEndRef = useRef(null)
 
-    const fetchLogs = async () => {
-        try {
-            const res = await fetch('/api/logs')
-            const data = await res.json()
-            if (data.logs) {
-                setLogs(data.logs)
-            }
-        } catch (err) {
-            console.error("Failed to fetch logs:", err)
-        }
-    }
-
+    // Streams only new records; EventSource resumes from the last seq on reconnect.
     useEffect(() => {
-        fetchLogs()
-        const interval = setInterval(fetchLogs, 2000)
-        return () => clearInterval(interval)
-    }, [])
+        setLogs([])
+        const source = new EventSource(`/api/logs/stream?level=${level}`)
+        source.addEventListener('logs', (event) => {
+            const records = JSON.parse(event.data)
+            setLogs(prev => prev.concat(records).slice(-MAX_LINES))
+        })
+        source.onerror = () => console.error("Log stream interrupted; reconnecting")
+        return () => source.close()
+    }, [level])
 
     useEffect(() => {
         if (isOpen && logsEndRef.current) {
@@ -42,7 +48,18 @@ export default function Console() {
                     <Terminal className="w-4 h-4" />
                     <span>Console Logs</span>
                 </div>
-                <div className="flex items-center">
+                <div className="flex items-center space-x-2">
+                    {isOpen && (
+                        <select
+                            value={level}
+                            onChange={(e) => setLevel(e.target.value)}
+                            onClick={(e) => e.stopPropagation()}
+                            className="bg-black border border-border rounded px-1 text-xs font-mono text-muted-foreground"
+                            aria-label="Minimum log level"
+                        >
+                            {LEVELS.map(l => <option key={l} value={l}>{l}</option>)}
+                        </select>
+                    )}
                     {isOpen ? <ChevronDown className="w-4 h-4" /> : <ChevronUp className="w-4 h-4" />}
                 </div>
             </div>
@@ -53,8 +70,8 @@ export default function Console() {
                     {logs.length === 0 ? (
                         <div className="text-muted-foreground italic">No logs execution yet...</div>
                     ) : (
-                        logs.map((log, i) => (
-                            <div key={i} className="break-all whitespace-pre-wrap">{log}</div>
+                        logs.map((log) => (
+                            <div key={log.seq} className={`break-all whitespace-pre-wrap ${LEVEL_COLORS[log.level] || ''}`}>{log.message}</div>
                         ))
                     )}
                     <div ref={logsEndRef} />
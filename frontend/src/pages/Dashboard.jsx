@@ -34,6 +34,18 @@ export default function Dashboard({ setActivePage }) {
         return <div className="p-8 text-muted-foreground">Loading dashboard...</div>
     }
 
+    // A config section is one mapping or a list of named instances (see config.yml.sample).
+    const instancesOf = (section, icon, alwaysEnabled = false) => {
+        const value = config?.[section]
+        if (!value) return [{ name: section, icon, enabled: alwaysEnabled, url: 'No URL configured' }]
+        return (Array.isArray(value) ? value : [{ name: section, ...value }]).map((instance) => ({
+            name: instance.name,
+            icon,
+            enabled: alwaysEnabled || instance.enabled !== false,
+            url: instance.url || 'No URL configured',
+        }))
+    }
+
     const ServiceInfo = ({ name, icon: Icon, enabled, url }) => (
         <button
             onClick={() => setActivePage('settings')}
@@ -145,24 +157,9 @@ export default function Dashboard({ setActivePage }) {
                 </CardHeader>
                 <CardContent>
                     <div className="flex flex-col gap-4">
-                        <ServiceInfo
-                            name="Radarr"
-                            icon={Server}
-                            enabled={config?.Radarr?.enabled}
-                            url={status?.Radarr?.status === 'ok' ? config?.Radarr?.url : (config?.Radarr?.url || 'No URL configured')}
-                        />
-                        <ServiceInfo
-                            name="Sonarr"
-                            icon={Server}
-                            enabled={config?.Sonarr?.enabled}
-                            url={status?.Sonarr?.status === 'ok' ? config?.Sonarr?.url : (config?.Sonarr?.url || 'No URL configured')}
-                        />
-                        <ServiceInfo
-                            name="qBittorrent"
-                            icon={Activity}
-                            enabled={true}
-                            url={config?.qBittorrent?.url || 'No URL configured'}
-                        />
+                        {[...instancesOf('Radarr', Server), ...instancesOf('Sonarr', Server), ...instancesOf('qBittorrent', Activity, true)].map((instance) => (
+                            <ServiceInfo key={instance.name} {...instance} />
+                        ))}
                     </div>
                 </CardContent>
             </Card>
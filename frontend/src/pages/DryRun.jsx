@@ -3,13 +3,70 @@ import { Button } from '@/components/ui/button'
 import { Card, CardHeader, CardTitle, CardContent, CardDescription } from '@/components/ui/card'
 import { Play, Activity, AlertTriangle, ShieldCheck, ChevronDown, ChevronRight, Clapperboard, Tv, Zap, Trash2 } from 'lucide-react'
 
+const PROGRESS_LABELS = [
+    ['torrents_fetched', 'Torrents fetched'],
+    ['file_lists_fetched', 'File lists retrieved'],
+    ['files_checked', 'Files checked'],
+    ['deletions_done', 'Deletions done'],
+]
+
+const PHASE_LABELS = {
+    starting: 'Starting',
+    loading_config: 'Loading configuration',
+    fetching_torrents: 'Fetching torrents',
+    evaluating: 'Evaluating',
+    verifying: 'Re-checking reviewed candidates',
+    deleting: 'Deleting',
+    done: 'Finishing',
+}
+
+// Per-torrent decisions shown live while a run is going.
+const LIVE_DECISIONS = 8
+
+const DECISION_STYLES = {
+    candidate: 'text-destructive',
+    keep: 'text-green-500',
+    skip: 'text-muted-foreground',
+}
+
+// Follows a background run job until it finishes. Uses the SSE stream for live
+// progress and decisions, and falls back to polling if the stream drops (e.g. a proxy timeout).
+const followJob = (jobId, onProgress, onDecisions) => new Promise((resolve, reject) => {
+    const poll = async () => {
+        try {
+            const res = await fetch(`/api/jobs/${jobId}`)
+            if (!res.ok) throw new Error(`Request failed: ${res.statusText}`)
+            const job = await res.json()
+            onProgress(job.progress)
+            if (job.status === 'succeeded' || job.status === 'failed') resolve(job)
+            else setTimeout(poll, 1000)
+        } catch (err) {
+            reject(err)
+        }
+    }
+
+    const events = new EventSource(`/api/jobs/${jobId}/events`)
+    events.addEventListener('progress', (e) => onProgress(JSON.parse(e.data).progress))
+    events.addEventListener('decisions', (e) => onDecisions(JSON.parse(e.data)))
+    events.addEventListener('done', (e) => {
+        events.close()
+        resolve(JSON.parse(e.data))
+    })
+    events.onerror = () => {
+        events.close()
+        poll()
+    }
+})
+
 export default function DryRun() {
     const [config, setConfig] = useState(null)
     const [configLoading, setConfigLoading] = useState(true)
     const [loading, setLoading] = useState(false)
     const [results, setResults] = useState(null)
     const [error, setError] = useState(null)
-    const [expandedServices, setExpandedServices] = useState({ Radarr: false, Sonarr: false })
+    const [progress, setProgress] = useState(null)
+    const [decisions, setDecisions] = useState({ counts: {}, recent: [] })
+    const [expandedServices, setExpandedServices] = useState({})
 
     useEffect(() => {
         const fetchConfig = async () => {
@@ -35,7 +92,7 @@ export default function DryRun() {
         setLoading(true)
         if (!forceReal) setResults(null) // Only clear results when starting a new simulation
         setError(null)
-        setExpandedServices({ Radarr: false, Sonarr: false })
+        setExpandedServices({})
 
         if (forceReal) {
             if (!confirm("Are you sure you want to PERMANENTLY delete these items? This action cannot be undone.")) {
@@ -44,21 +101,94 @@ export default function DryRun() {
             }
         }
 
-        const endpoint = isDryRun ? '/api/dry-run' : '/api/run'
+        setProgress(null)
+        setDecisions({ counts: {}, recent: [] })
         try {
-            const options = isDryRun ? { method: 'GET' } : { method: 'POST' }
-            const res = await fetch(endpoint, options)
-            if (!res.ok) throw new Error(`Request failed: ${res.statusText}`)
-            const data = await res.json()
-            if (data.success === false) throw new Error(data.error || "Unknown error occurred")
+            // Applying deletes exactly the reviewed plan; the server re-checks each candidate first.
+            const res = await fetch('/api/jobs', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(forceReal ? { plan_id: results.plan_id } : { dry_run: isDryRun }),
+            })
+            if (!res.ok) {
+                const body = await res.json().catch(() => ({}))
+                throw new Error(body.detail || `Request failed: ${res.statusText}`)
+            }
+            const job = await res.json()
+            setProgress(job.progress)
+            const finished = await followJob(job.id, setProgress, (batch) => setDecisions(prev => {
+                const counts = { ...prev.counts }
+                batch.forEach(d => { counts[d.decision] = (counts[d.decision] || 0) + 1 })
+                return { counts, recent: [...batch.reverse(), ...prev.recent].slice(0, LIVE_DECISIONS) }
+            }))
+            const data = finished.result
+            if (finished.status === 'failed' || !data || data.success === false) {
+                throw new Error(finished.error || data?.error || "Unknown error occurred")
+            }
             setResults(data)
         } catch (err) {
             setError(err.message)
         } finally {
             setLoading(false)
+            setProgress(null)
         }
     }
 
+    const renderProgress = () => {
+        if (!loading || !progress) return null
+        const phase = PHASE_LABELS[progress.phase] || progress.phase
+        return (
+            <Card className="border-border/50 bg-card/30 backdrop-blur-sm animate-in fade-in duration-300">
+                <CardContent className="p-6 space-y-4">
+                    <div className="flex items-center gap-2 text-sm font-bold">
+                        <Activity className="animate-spin text-primary" size={16} />
+                        <span>{phase}{progress.service ? ` — ${progress.service}` : ''}</span>
+                    </div>
+                    <div className="grid grid-cols-2 md:grid-cols-4 gap-4">
+                        {PROGRESS_LABELS.map(([key, label]) => {
+                            const count = progress.counters?.[key] ?? 0
+                            const total = progress.totals?.[key]
+                            return (
+                                <div key={key} className="space-y-1">
+                                    <div className="text-xs uppercase tracking-widest text-muted-foreground">{label}</div>
+                                    <div className="text-lg font-mono font-bold">
+                                        {count}{total ? <span className="text-muted-foreground"> / {total}</span> : null}
+                                    </div>
+                                    {total ? (
+                                        <div className="h-1 rounded bg-muted overflow-hidden">
+                                            <div className="h-full bg-primary transition-all" style={{ width: `${Math.min(100, (count / total) * 100)}%` }} />
+                                        </div>
+                                    ) : null}
+                                </div>
+                            )
+                        })}
+                    </div>
+                    {decisions.recent.length > 0 && (
+                        <div className="space-y-1 pt-2 border-t border-border/30">
+                            <div className="text-xs uppercase tracking-widest text-muted-foreground">
+                                {['candidate', 'keep', 'skip'].map(d => `${decisions.counts[d] || 0} ${d}`).join(' · ')}
+                            </div>
+                            {decisions.recent.map((d) => (
+                                <div key={d.seq} className="text-xs font-mono truncate">
+                                    <span className={`font-bold uppercase ${DECISION_STYLES[d.decision] || ''}`}>{d.decision}</span>
+                                    <span className="ml-2">{d.name}</span>
+                                    <span className="ml-2 text-muted-foreground">({d.reason})</span>
+                                </div>
+                            ))}
+                        </div>
+                    )}
+                </CardContent>
+            </Card>
+        )
+    }
+
+    // Sonarr may be one mapping (named Sonarr unless it sets `name`) or a list of named instances.
+    const isSonarr = (name) => {
+        const section = config?.Sonarr
+        if (Array.isArray(section)) return section.some(instance => instance?.name === name)
+        return (section?.name || 'Sonarr') === name
+    }
+
     const renderServiceCol = (serviceName, list, icon) => {
         const Icon = icon;
         const sortedList = list ? [...list].sort((a, b) => a.name.localeCompare(b.name)) : []
@@ -140,7 +270,8 @@ export default function DryRun() {
     }
 
     const isGlobalDryRun = config?.dry_run
-    const hasDeletions = results?.deleted_count > 0 || (results?.summary && (results.summary.Sonarr?.length > 0 || results.summary.Radarr?.length > 0))
+    const hasDeletions = results?.deleted_count > 0 || Object.values(results?.summary || {}).some(list => list?.length > 0)
+    const dropped = Object.values(results?.dropped || {}).flat()
 
     return (
         <div className="space-y-8 animate-in fade-in duration-500">
@@ -205,6 +336,8 @@ export default function DryRun() {
                 </Card>
             </div>
 
+            {renderProgress()}
+
             {error && (
                 <div className="p-4 rounded-xl border border-destructive/50 bg-destructive/10 text-destructive text-sm font-medium flex items-center gap-3">
                     <AlertTriangle size={20} />
@@ -233,7 +366,7 @@ export default function DryRun() {
                             </span>
                         </div>
 
-                        {!isGlobalDryRun && results.dry_run && hasDeletions && (
+                        {!isGlobalDryRun && results.dry_run && hasDeletions && results.plan_id && (
                             <Button
                                 onClick={() => handleRun(true)}
                                 disabled={loading}
@@ -251,9 +384,29 @@ export default function DryRun() {
                         )}
                     </div>
 
+                    {results.complete === false && (
+                        <div className="p-4 rounded-xl border border-primary/30 bg-primary/5 text-sm">
+                            <span className="font-bold">Run budget used up</span> before {results.pending.join(', ')} finished.
+                            The next run resumes this pass; nothing is deleted until it completes.
+                        </div>
+                    )}
+
+                    {dropped.length > 0 && (
+                        <div className="p-4 rounded-xl border border-primary/30 bg-primary/5 text-sm space-y-1">
+                            <div className="font-bold">{dropped.length} reviewed item(s) changed since the simulation and were kept:</div>
+                            {dropped.map((t) => (
+                                <div key={t.hash} className="text-muted-foreground truncate">{t.name} — {t.reason}</div>
+                            ))}
+                        </div>
+                    )}
+
                     <div className="flex flex-col lg:flex-row gap-6">
-                        {renderServiceCol('Sonarr', results.summary.Sonarr, Tv)}
-                        {renderServiceCol('Radarr', results.summary.Radarr, Clapperboard)}
+                        {/* One column per service instance (e.g. Radarr, Radarr-4K, Sonarr) */}
+                        {Object.entries(results.summary).map(([name, list]) => (
+                            <React.Fragment key={name}>
+                                {renderServiceCol(name, list, isSonarr(name) ? Tv : Clapperboard)}
+                            </React.Fragment>
+                        ))}
                     </div>
                 </div>
             )}
@@ -53,7 +53,9 @@ export default function Settings() {
                 const healthRes = await fetch('/api/health/services')
                 setServiceHealth(await healthRes.json())
             } else {
-                setStatusMessage({ type: 'error', text: 'Failed to save settings.' })
+                // 400 carries the validation error, e.g. "Radarr.root_folder is required"
+                const data = await res.json().catch(() => ({}))
+                setStatusMessage({ type: 'error', text: data.detail ? `Failed to save settings: ${data.detail}` : 'Failed to save settings.' })
             }
         } catch (error) {
             setStatusMessage({ type: 'error', text: 'Error saving settings.' })
@@ -129,6 +131,26 @@ export default function Settings() {
         </div>
     )
 
+    // A section given as a list (several instances) is shown read-only; edit those in config.yml.
+    const MultiInstanceCard = ({ icon, title, instances }) => (
+        <Card className="border-border/60 bg-card/40 backdrop-blur-sm">
+            <CardHeader>
+                <SectionHeader icon={icon} title={title} description={`${instances.length} instances, configured in config.yml`} />
+            </CardHeader>
+            <CardContent className="space-y-3">
+                {instances.map((instance) => (
+                    <div key={instance.name} className="flex items-center justify-between gap-4 p-3 rounded-lg bg-muted/30">
+                        <div className="min-w-0">
+                            <div className="text-sm font-semibold">{instance.name}</div>
+                            <div className="text-xs text-muted-foreground font-mono truncate">{instance.root_folder || instance.url}</div>
+                        </div>
+                        <HealthBadge service={instance.name} />
+                    </div>
+                ))}
+            </CardContent>
+        </Card>
+    )
+
     const Field = ({ label, path, type = "text", placeholder, options }) => {
         const keys = path.split('.')
         let value = editedConfig
@@ -227,56 +249,68 @@ export default function Settings() {
                 </Card>
 
                 {/* qBittorrent Settings */}
-                <Card className="border-border/60 bg-card/40 backdrop-blur-sm">
-                    <CardHeader>
-                        <SectionHeader icon={Activity} title="qBittorrent" description="Download client connectivity" service="qBittorrent" />
-                    </CardHeader>
-                    <CardContent className="grid grid-cols-1 md:grid-cols-2 gap-4">
-                        <div className="md:col-span-2">
-                            <Field label="API URL" path="qBittorrent.url" placeholder="http://ip:port/" />
-                        </div>
-                        <Field label="Username" path="qBittorrent.username" />
-                        <Field label="Password" path="qBittorrent.password" type="password" />
-                    </CardContent>
-                </Card>
+                {Array.isArray(editedConfig?.qBittorrent) ? (
+                    <MultiInstanceCard icon={Activity} title="qBittorrent" instances={editedConfig.qBittorrent} />
+                ) : (
+                    <Card className="border-border/60 bg-card/40 backdrop-blur-sm">
+                        <CardHeader>
+                            <SectionHeader icon={Activity} title="qBittorrent" description="Download client connectivity" service={editedConfig?.qBittorrent?.name || 'qBittorrent'} />
+                        </CardHeader>
+                        <CardContent className="grid grid-cols-1 md:grid-cols-2 gap-4">
+                            <div className="md:col-span-2">
+                                <Field label="API URL" path="qBittorrent.url" placeholder="http://ip:port/" />
+                            </div>
+                            <Field label="Username" path="qBittorrent.username" />
+                            <Field label="Password" path="qBittorrent.password" type="password" />
+                        </CardContent>
+                    </Card>
+                )}
 
                 {/* Radarr Settings */}
-                <Card className="border-border/60 bg-card/40 backdrop-blur-sm">
-                    <CardHeader>
-                        <SectionHeader icon={Server} title="Radarr" description="Movie library integration" service="Radarr" />
-                    </CardHeader>
-                    <CardContent className="space-y-4">
-                        <div className="grid grid-cols-2 gap-4">
-                            <Field label="Enabled" path="Radarr.enabled" type="switch" />
-                            <Field label="Category" path="Radarr.category" />
-                        </div>
-                        <div className="grid grid-cols-2 gap-4">
-                            <Field label="Min Seed Days" path="Radarr.min_seed_days" type="number" />
-                            <Field label="Max Delete %" path="Radarr.max_delete_percent" type="number" />
-                        </div>
-                        <Field label="API Key" path="Radarr.api_key" type="password" />
-                        <Field label="Root Folder" path="Radarr.root_folder" />
-                    </CardContent>
-                </Card>
+                {Array.isArray(editedConfig?.Radarr) ? (
+                    <MultiInstanceCard icon={Server} title="Radarr" instances={editedConfig.Radarr} />
+                ) : (
+                    <Card className="border-border/60 bg-card/40 backdrop-blur-sm">
+                        <CardHeader>
+                            <SectionHeader icon={Server} title="Radarr" description="Movie library integration" service={editedConfig?.Radarr?.name || 'Radarr'} />
+                        </CardHeader>
+                        <CardContent className="space-y-4">
+                            <div className="grid grid-cols-2 gap-4">
+                                <Field label="Enabled" path="Radarr.enabled" type="switch" />
+                                <Field label="Category" path="Radarr.category" />
+                            </div>
+                            <div className="grid grid-cols-2 gap-4">
+                                <Field label="Min Seed Days" path="Radarr.min_seed_days" type="number" />
+                                <Field label="Max Delete %" path="Radarr.max_delete_percent" type="number" />
+                            </div>
+                            <Field label="API Key" path="Radarr.api_key" type="password" />
+                            <Field label="Root Folder" path="Radarr.root_folder" />
+                        </CardContent>
+                    </Card>
+                )}
 
                 {/* Sonarr Settings */}
-                <Card className="border-border/60 bg-card/40 backdrop-blur-sm">
-                    <CardHeader>
-                        <SectionHeader icon={Server} title="Sonarr" description="TV library integration" service="Sonarr" />
-                    </CardHeader>
-                    <CardContent className="space-y-4">
-                        <div className="grid grid-cols-2 gap-4">
-                            <Field label="Enabled" path="Sonarr.enabled" type="switch" />
-                            <Field label="Category" path="Sonarr.category" />
-                        </div>
-                        <div className="grid grid-cols-2 gap-4">
-                            <Field label="Min Seed Days" path="Sonarr.min_seed_days" type="number" />
-                            <Field label="Max Delete %" path="Sonarr.max_delete_percent" type="number" />
-                        </div>
-                        <Field label="API Key" path="Sonarr.api_key" type="password" />
-                        <Field label="Root Folder" path="Sonarr.root_folder" />
-                    </CardContent>
-                </Card>
+                {Array.isArray(editedConfig?.Sonarr) ? (
+                    <MultiInstanceCard icon={Server} title="Sonarr" instances={editedConfig.Sonarr} />
+                ) : (
+                    <Card className="border-border/60 bg-card/40 backdrop-blur-sm">
+                        <CardHeader>
+                            <SectionHeader icon={Server} title="Sonarr" description="TV library integration" service={editedConfig?.Sonarr?.name || 'Sonarr'} />
+                        </CardHeader>
+                        <CardContent className="space-y-4">
+                            <div className="grid grid-cols-2 gap-4">
+                                <Field label="Enabled" path="Sonarr.enabled" type="switch" />
+                                <Field label="Category" path="Sonarr.category" />
+                            </div>
+                            <div className="grid grid-cols-2 gap-4">
+                                <Field label="Min Seed Days" path="Sonarr.min_seed_days" type="number" />
+                                <Field label="Max Delete %" path="Sonarr.max_delete_percent" type="number" />
+                            </div>
+                            <Field label="API Key" path="Sonarr.api_key" type="password" />
+                            <Field label="Root Folder" path="Sonarr.root_folder" />
+                        </CardContent>
+                    </Card>
+                )}
             </div>
         </div>
     )